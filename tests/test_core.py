@@ -0,0 +1,316 @@
+"""
+不依赖 Tk 的核心部分的测试（python -m pytest -q）。
+脚本文件名是中文，这里按路径加载成模块 zhuangbi。
+"""
+import importlib.util
+import pathlib
+import sys
+import types
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+_spec = importlib.util.spec_from_file_location("zhuangbi", ROOT / "装逼代码.py")
+zb = importlib.util.module_from_spec(_spec)
+sys.modules["zhuangbi"] = zb   # 进程池按模块名找函数
+_spec.loader.exec_module(zb)
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch, tmp_path):
+    """不读写用户目录下的缓存，不带着上一个用例的埋点/降载状态。"""
+    monkeypatch.setattr(zb, "POINT_CACHE_ENABLED", False)
+    monkeypatch.setattr(zb, "POINT_CACHE_DIR", str(tmp_path / "points"))
+    monkeypatch.setattr(zb, "FONT_COVERAGE_PATH", str(tmp_path / "fonts.json"))
+    monkeypatch.setattr(zb, "TRACER", None)
+    monkeypatch.setattr(zb, "LOAD", None)
+
+
+# ======== 自适应降载 ========
+def _feed(ctrl, lag_ms, t0, t1, step=16):
+    """从 t0 到 t1（不含）每 step 毫秒喂一次同样的延迟，返回下一个时刻。"""
+    t = t0
+    while t < t1:
+        ctrl.sample(lag_ms, t)
+        t += step
+    return t
+
+def test_load_steps_down_once_per_hold():
+    seen = []
+    ctrl = zb.LoadController(target_ms=8, on_adjust=lambda c, old, new, lag: seen.append((old, new)))
+    ctrl.sample(50, 0)
+    assert ctrl.level == 1 and ctrl.knobs is zb.LOAD_LEVELS[1]
+    _feed(ctrl, 50, 16, zb.ADAPTIVE_HOLD_MS)
+    assert ctrl.level == 1   # 间隔不到 ADAPTIVE_HOLD_MS 不再降
+    _feed(ctrl, 50, zb.ADAPTIVE_HOLD_MS, 10 * zb.ADAPTIVE_HOLD_MS)
+    assert ctrl.level == len(zb.LOAD_LEVELS) - 1   # 降到底就停
+    assert seen == [(i, i + 1) for i in range(len(zb.LOAD_LEVELS) - 1)]
+
+def test_load_restores_one_level_after_calm_period():
+    ctrl = zb.LoadController(target_ms=8, on_adjust=None)
+    t = _feed(ctrl, 50, 0, 2 * zb.ADAPTIVE_HOLD_MS + 40)
+    assert ctrl.level == 3
+    calm = _feed(ctrl, 0, t, t + zb.ADAPTIVE_RESTORE_MS)
+    assert ctrl.level == 3   # 平滑值刚降下来，余量还没持续够
+    _feed(ctrl, 0, calm, calm + zb.ADAPTIVE_RESTORE_MS)
+    assert ctrl.level == 2   # 每个 ADAPTIVE_RESTORE_MS 只恢复一级
+    _feed(ctrl, 0, calm + zb.ADAPTIVE_RESTORE_MS, calm + 4 * zb.ADAPTIVE_RESTORE_MS)
+    assert ctrl.level == 0
+
+def test_load_holds_level_between_half_target_and_target():
+    ctrl = zb.LoadController(target_ms=8, on_adjust=None)
+    ctrl.sample(100, 0)
+    _feed(ctrl, 6, 16, 20000)   # 平滑后停在 6 ms：不该再降，也不该恢复
+    assert ctrl.level == 1 and ctrl.adjustments == 1
+
+def test_load_ignores_early_ticks():
+    ctrl = zb.LoadController(target_ms=8, on_adjust=None)
+    _feed(ctrl, -5, 0, 5000)   # 回调比计划早到按 0 算
+    assert ctrl.level == 0 and ctrl.lag_ms == 0.0
+
+
+# ======== 帧预算生成调度器 ========
+class FakeClock:
+    """替换模块里的 time：perf_counter 只在 advance 时走。"""
+    def __init__(self):
+        self.ms = 0.0
+
+    def perf_counter(self):
+        return self.ms / 1000.0
+
+    def advance(self, ms):
+        self.ms += ms
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = FakeClock()
+    monkeypatch.setattr(zb, "time", types.SimpleNamespace(perf_counter=c.perf_counter))
+    return c
+
+def _run_frames(sched, clock, frames, frame_ms=16):
+    counts = []
+    for _ in range(frames):
+        clock.advance(frame_ms)
+        sched.pump()
+        counts.append(sched.stats["spawned"])
+    return counts
+
+def test_scheduler_honours_sub_frame_interval(clock):
+    spawned, finished = [], []
+    sched = zb.SpawnScheduler(None, [list(range(100))], spawned.append,
+                              on_finish=lambda: finished.append(clock.ms), interval_ms=2).start()
+    counts = _run_frames(sched, clock, 15)
+    assert counts == [min(100, 8 * (k + 1)) for k in range(15)]   # 每帧 16 ms，间隔 2 ms：一帧 8 个
+    assert spawned == list(range(100))
+    assert finished == [208.0] and sched.pump()
+
+def test_scheduler_waits_one_interval_between_batches(clock):
+    sched = zb.SpawnScheduler(None, [[1] * 5, [2] * 5], lambda item: None, interval_ms=10).start()
+    clock.advance(65)
+    sched.pump()
+    assert sched.stats["spawned"] == 5   # 第一批在 10..50 ms，第二批从 70 ms 开始
+    clock.advance(5)
+    sched.pump()
+    assert sched.stats["spawned"] == 6
+
+def test_scheduler_respects_frame_budget(clock):
+    def slow_spawn(item):
+        clock.advance(1)
+    sched = zb.SpawnScheduler(None, [list(range(50))], slow_spawn, interval_ms=0, budget_ms=4).start()
+    sched.pump()
+    assert sched.stats["spawned"] == 4   # 不限速时只受帧预算约束，剩下的顺延
+    clock.advance(16)
+    sched.pump()
+    assert sched.stats["spawned"] == 8
+
+def test_scheduler_bursts_under_load(clock, monkeypatch):
+    ctrl = zb.LoadController(target_ms=8, on_adjust=None)
+    _feed(ctrl, 50, 0, zb.ADAPTIVE_HOLD_MS + 16)
+    assert ctrl.level == 2
+    monkeypatch.setattr(zb, "LOAD", ctrl)
+    sched = zb.SpawnScheduler(None, [list(range(10))], lambda item: None, interval_ms=10).start()
+    clock.advance(10)
+    sched.pump()
+    assert sched.stats["spawned"] == ctrl.knobs["batch_mult"]   # 降载时一个到期时刻连出 batch_mult 个
+
+def test_scheduler_streaming_waits_for_close(clock):
+    finished = []
+    sched = zb.SpawnScheduler(None, [[1, 2]], lambda item: None, on_finish=lambda: finished.append(1),
+                              interval_ms=1, streaming=True).start()
+    clock.advance(16)
+    assert not sched.pump()
+    sched.feed([3])
+    sched.close()
+    clock.advance(16)
+    assert sched.pump() and finished == [1] and sched.stats["spawned"] == 3
+
+
+# ======== 点序与逐行流式栅格化 ========
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    """两条实现各跑一遍：有 NumPy 的整块运算，和没有 NumPy 时的纯 Python 回退。"""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(zb, "np", None)
+    return request.param
+
+def _random_points(n, seed=7):
+    import random
+    rng = random.Random(seed)
+    return list({(rng.randrange(0, 96), rng.randrange(0, 54)) for _ in range(n)})
+
+@pytest.mark.parametrize("order", range(7))
+def test_point_set_order_matches_sort_points(backend, order):
+    pts = _random_points(400)
+    assert zb.PointSet(pts).order_by(order).tolist() == list(zb.sort_points(pts, order))
+
+@pytest.mark.parametrize("order_fn", ["hilbert_order", "nearest_neighbour_order"])
+def test_locality_orders_are_permutations(backend, order_fn):
+    pts = _random_points(300)
+    xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+    if backend == "numpy":
+        import numpy as np
+        xs, ys = np.array(xs), np.array(ys)
+    idx = [int(i) for i in getattr(zb, order_fn)(xs, ys)]
+    assert sorted(idx) == list(range(len(pts)))
+
+def test_nearest_neighbour_walks_a_line_in_order():
+    xs = [5, 0, 3, 1, 4, 2]
+    assert [int(i) for i in zb.nearest_neighbour_order(xs, [0] * 6)] == [1, 3, 5, 2, 4, 0]
+
+@pytest.mark.parametrize("text", ["装逼", "天天开心\n万事如意", "二\n三"])
+def test_streamed_lines_concatenate_to_whole_text(backend, text):
+    whole = zb.text_to_grid_points(text, 96, 54, 1, 4)
+    lines = list(zb.iter_text_line_points(text, 96, 54, 1, 4, cache=False))
+    assert lines and all(len(p) for p in lines)
+    assert [q for p in lines for q in p] == list(whole)
+    assert len(lines) == text.count("\n") + 1
+
+def test_streamed_lines_from_cache_match_fresh_render(monkeypatch):
+    monkeypatch.setattr(zb, "POINT_CACHE_ENABLED", True)
+    text = "天天开心\n万事如意"
+    fresh = [p.tolist() for p in zb.iter_text_line_points(text, 96, 54, 1, 4)]
+    hits = zb.point_cache_stats["hits"]
+    cached = [p.tolist() for p in zb.iter_text_line_points(text, 96, 54, 1, 4)]
+    assert zb.point_cache_stats["hits"] == hits + 1
+    assert cached == fresh
+    bands = zb.text_line_bands(text, 96, 54, 1, 4)
+    assert [p.tolist() for p in zb.split_points_into_lines(zb.PointSet([q for l in fresh for q in l]), bands)] == fresh
+
+
+# ======== show bundle ========
+BUNDLE_SEQUENCE = [
+    {"text": "装逼", "CELL_SIZE": 20},
+    {"text": "天天开心\n万事如意", "CELL_SIZE": 10, "DISPLAY_ORDER": 5},
+    {"text": "开心", "PARTICLE": True, "CELL_SIZE": 10},
+    {"RANDOM_WINDOW_COUNT": 5},
+]
+
+def _plain(v):
+    """PointSet / 数组 / 元组统一成嵌套 list，便于比较。"""
+    if hasattr(v, "tolist"):
+        v = v.tolist()
+    if isinstance(v, (list, tuple)):
+        return [_plain(x) for x in v]
+    return v
+
+def test_bundle_round_trip_matches_plan_segment(tmp_path):
+    pytest.importorskip("PIL")
+    path = str(tmp_path / "show.bundle")
+    count, size = zb.compile_bundle(BUNDLE_SEQUENCE, path, 640, 360)
+    assert count == len(BUNDLE_SEQUENCE) and size == (tmp_path / "show.bundle").stat().st_size
+    assert not (tmp_path / "show.bundle.tmp").exists()
+    bundle = zb.ShowBundle(path)
+    try:
+        assert len(bundle) == count and bundle.screen == (640, 360)
+        for idx, cfg in enumerate(BUNDLE_SEQUENCE):
+            conf = zb.resolve_config(cfg)
+            assert bundle.confs[idx] == conf
+            want, got = zb.plan_segment(conf, 640, 360), bundle.plan(idx, 640, 360)
+            assert got["mode"] == want["mode"]
+            assert want["mode"] == "random" or len(want["grid_points"])
+            assert _plain(got["grid_points"]) == _plain(want["grid_points"])
+            if want["mode"] == "particle":
+                assert len(got["strokes"]) == len(want["strokes"])
+                for g, w in zip(got["strokes"], want["strokes"]):
+                    assert _plain(g["centers"]) == _plain(w["centers"])
+                    assert _plain(g["kinds"]) == _plain(w["kinds"])
+                    assert _plain(g["paths"]) == _plain(w["paths"])
+            elif want["mode"] == "random":
+                assert len(got["positions"]) == len(want["positions"])
+            else:
+                assert _plain(got["batches"]) == _plain(want["batches"])
+    finally:
+        bundle.close()
+
+def test_bundle_rejects_foreign_files(tmp_path):
+    bad = tmp_path / "bad.bundle"
+    bad.write_bytes(b"not a bundle at all")
+    with pytest.raises(ValueError):
+        zb.ShowBundle(str(bad))
+
+
+# ======== 离线渲染 ========
+RENDER_SEQUENCE = [
+    {"text": "装逼", "CELL_SIZE": 20, "HOLD_AFTER_DONE_MS": 200},
+    {"text": "开心", "PARTICLE": True, "CELL_SIZE": 10, "HOLD_AFTER_DONE_MS": 200},
+    {"RANDOM_WINDOW_COUNT": 8, "HOLD_AFTER_DONE_MS": 200},
+]
+
+def test_render_script_is_deterministic_per_seed():
+    import random
+    pytest.importorskip("PIL")
+    state = random.getstate()
+    a = zb.build_render_script(RENDER_SEQUENCE, 320, 180, seed=3)
+    assert random.getstate() == state   # 只用自己的随机源，不动全局 random
+    assert a == zb.build_render_script(RENDER_SEQUENCE, 320, 180, seed=3)
+    assert a != zb.build_render_script(RENDER_SEQUENCE, 320, 180, seed=4)
+
+def test_render_frames_do_not_depend_on_job_count(tmp_path):
+    pytest.importorskip("PIL")
+    out = {}
+    for jobs in (1, 2):
+        d = tmp_path / f"jobs{jobs}"
+        n = zb.render_headless(RENDER_SEQUENCE, str(d), 320, 180, fps=10, seed=1, jobs=jobs)
+        out[jobs] = [p.read_bytes() for p in sorted(d.glob("frame_*.png"))]
+        assert len(out[jobs]) == n > 1
+    assert out[1] == out[2]
+
+
+# ======== 基准 ========
+def test_compare_benchmarks_flags_only_real_regressions():
+    base = {"results": {"a": {"min_ms": 1.0}, "b": {"min_ms": 1.0}, "noise": {"min_ms": 0.01},
+                        "gone": {"min_ms": 1.0}}}
+    cur = {"results": {"a": {"min_ms": 1.1}, "b": {"min_ms": 2.0}, "noise": {"min_ms": 1.0},
+                       "new": {"min_ms": 5.0}}}
+    assert zb.compare_benchmarks(cur, base, threshold=0.15) == [("b", 1.0, 2.0, 2.0)]
+    assert [r[0] for r in zb.compare_benchmarks(cur, base, threshold=0.05)] == ["b", "a"]
+
+def test_run_benchmarks_reports_every_case():
+    pytest.importorskip("PIL")
+    seen = []
+    report = zb.run_benchmarks(repeat=1, screens={"tiny": (320, 180)}, cells=(20,), texts={"s": "装逼"},
+                               progress=lambda key, r: seen.append(key))
+    assert seen == list(report["results"])
+    assert seen and all(k.endswith("|tiny|cell20|s") for k in seen)
+    assert all(r["min_ms"] <= r["median_ms"] for r in report["results"].values())
+    assert zb.compare_benchmarks(report, report) == []
+
+
+# ======== 段配置 ========
+def test_current_config_falls_back_to_defaults(monkeypatch):
+    for key in zb.default_base_config():
+        monkeypatch.delattr(zb, key, raising=False)
+    assert zb.current_config() == zb.resolve_config({})   # 还没 apply_config 过
+    cfg = {"text": "开心", "PARTICLE": True, "Display_text": False}
+    for key in zb.default_base_config():
+        monkeypatch.setattr(zb, key, None, raising=False)   # 用例结束时撤销 apply_config 写的全局
+    zb.apply_config(cfg)
+    assert zb.current_config() == zb.resolve_config(cfg)
+
+def test_segment_config_is_read_only():
+    conf = zb.resolve_config({"text": "开心"})
+    with pytest.raises(AttributeError):
+        conf.text = "别的"
+    assert conf.replace(text="别的").text == "别的" and conf.text == "开心"
@@ -1,12 +1,31 @@
 # -*- coding: utf-8 -*-
 import sys
-import tkinter as tk
+import argparse
+# Tk 只在实际弹窗/粒子播放时需要；离线渲染（--render）在没有 tkinter 的机器上也能跑
+try:
+    import tkinter as tk
+except ImportError:
+    tk = None
 import random
 import threading
 import time
 import os
 import math
-from collections import deque
+import json
+import hashlib
+import mmap
+import struct
+import bisect
+import importlib
+import multiprocessing
+import unicodedata
+from array import array
+from collections import deque, OrderedDict
+from functools import lru_cache
+from itertools import groupby
+from dataclasses import dataclass, fields, replace as _replace_fields
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import queue
 
 # 隐藏控制台黑框（仅限 Windows）
 if os.name == "nt":
@@ -17,28 +36,177 @@ if os.name == "nt":
         pass
 
 # 需要 Pillow：pip install pillow
+# 按需导入：第一次用到时才真正 import，并把模块全局换成真模块（之后没有额外开销）；
+# --play 播放编译好的 bundle 时全程不导入 Pillow。其它入口在 cli() 里先 require_pillow() 提前报错。
+class _LazyPIL:
+    __slots__ = ("_name",)
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(_import_pil(self._name), attr)
+
+def _import_pil(name):
+    try:
+        mod = importlib.import_module("PIL." + name)
+    except ImportError:
+        raise SystemExit("未检测到 Pillow，请先执行：pip install pillow")
+    globals()[name] = mod
+    return mod
+
+def require_pillow():
+    for name in ("Image", "ImageDraw", "ImageFont", "ImageOps", "ImageColor"):
+        _import_pil(name)
+
+Image, ImageDraw, ImageFont, ImageOps, ImageColor = (
+    _LazyPIL(n) for n in ("Image", "ImageDraw", "ImageFont", "ImageOps", "ImageColor"))
+
+# 可选：NumPy（有则走向量化点阵提取；没有就用纯 Python 路径）
 try:
-    from PIL import Image, ImageDraw, ImageFont, ImageOps
+    import numpy as np
 except ImportError:
-    raise SystemExit("未检测到 Pillow，请先执行：pip install pillow")
+    np = None
+
+
+# ======== 性能埋点（默认关闭） ========
+# TRACER 为 None 时每个埋点只是一次全局读取 + is None 判断，不计时、不分配；
+# --trace 打开后记录成 Chrome trace JSON（chrome://tracing 或 Perfetto 直接打开）。
+TRACER = None
+
+class Tracer:
+    """收集 Chrome trace 事件：end() 记完整区间，counter() 记计数曲线；可选 tracemalloc 峰值。"""
+    def __init__(self, memory=False):
+        self.events = []
+        self._t0 = time.perf_counter()
+        self._tm = None
+        if memory:
+            import tracemalloc
+            tracemalloc.start()
+            self._tm = tracemalloc
+
+    def _us(self, t):
+        return round((t - self._t0) * 1e6, 1)
+
+    @staticmethod
+    def begin():
+        return time.perf_counter()
+
+    def end(self, name, t_begin, cat="phase", **args):
+        t1 = time.perf_counter()
+        self.events.append({"name": name, "cat": cat, "ph": "X", "ts": self._us(t_begin),
+                            "dur": round((t1 - t_begin) * 1e6, 1), "pid": os.getpid(),
+                            "tid": threading.get_ident(), "args": args})
+
+    def counter(self, name, **values):
+        self.events.append({"name": name, "ph": "C", "ts": self._us(time.perf_counter()),
+                            "pid": os.getpid(), "args": values})
+
+    def instant(self, name, cat="report", **args):
+        self.events.append({"name": name, "cat": cat, "ph": "i", "s": "g", "ts": self._us(time.perf_counter()),
+                            "pid": os.getpid(), "tid": threading.get_ident(), "args": args})
+
+    def memory_peak_kb(self):
+        """自上次调用以来的 tracemalloc 峰值（KB），并重置峰值；未开启时返回 None。"""
+        if self._tm is None:
+            return None
+        peak = self._tm.get_traced_memory()[1]
+        self._tm.reset_peak()
+        return peak // 1024
+
+    def save(self, path):
+        names = {}
+        for ev in self.events:
+            if "tid" in ev:
+                names.setdefault(ev["tid"], None)
+        main_tid = threading.main_thread().ident
+        meta = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                 "args": {"name": "Tk 主线程" if tid == main_tid else f"后台 {tid}"}} for tid in names]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": meta + self.events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+
+VERBOSE = False   # --verbose：把火花/小窗池/分片/时间线的统计打印出来
+
+def report_stats(name, text, stats=None):
+    """运行统计：开了 --trace 时记成 trace 里的即时事件，--verbose 时打印；都没开就什么都不做。"""
+    tr = TRACER
+    if tr is not None:
+        tr.instant(name, text=text, **(stats or {}))
+    if VERBOSE:
+        print(text)
 
 
 # ========= 字体与多脚本 fallback =========
+# 字体注册表：路径只解析一次；解析好的 FreeTypeFont 放进有界 LRU，
+# 键为 (路径, 字号, 排版引擎)。TTC 动辄几 MB，重复解析是段与段之间卡顿的主要来源。
+FONT_CACHE_MAX = 64   # LRU 最多保留多少个 (路径, 字号, 引擎) 字体对象
+
+_font_lock = threading.RLock()
+_font_lru = OrderedDict()
+_font_path_cache = {}
+font_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
 def _first_existing(paths):
     for p in paths:
         if os.path.exists(p):
             return p
     return None
 
+def _resolve_font_path(candidates):
+    """候选列表 -> 第一个存在的路径（结果按列表缓存，不再反复 stat）。"""
+    key = tuple(candidates)
+    with _font_lock:
+        if key in _font_path_cache:
+            return _font_path_cache[key]
+    path = _first_existing(key)
+    with _font_lock:
+        _font_path_cache[key] = path
+    return path
+
+def _layout_engine():
+    return getattr(ImageFont, "LAYOUT_RAQM", 0)
+
 def _load_font(path, size):
+    engine = _layout_engine()
+    key = (path, int(size), engine)
+    with _font_lock:
+        font = _font_lru.get(key)
+        if font is not None:
+            _font_lru.move_to_end(key)
+            font_cache_stats["hits"] += 1
+            return font
+        font_cache_stats["misses"] += 1
     try:
-        return ImageFont.truetype(path, size, layout_engine=getattr(ImageFont, "LAYOUT_RAQM", 0))
+        font = ImageFont.truetype(path, size, layout_engine=engine)
     except Exception:
-        return ImageFont.truetype(path, size)
+        font = ImageFont.truetype(path, size)
+    with _font_lock:
+        _font_lru[key] = font
+        _font_lru.move_to_end(key)
+        while len(_font_lru) > max(1, int(FONT_CACHE_MAX)):
+            _font_lru.popitem(last=False)
+            font_cache_stats["evictions"] += 1
+    return font
 
-def pick_font(size: int):
+def font_cache_info():
+    """命中/未命中/淘汰计数 + 当前缓存条目数。"""
+    with _font_lock:
+        info = dict(font_cache_stats)
+        info["size"] = len(_font_lru)
+        info["max"] = FONT_CACHE_MAX
+    return info
+
+def font_cache_clear():
+    with _font_lock:
+        _font_lru.clear()
+        _font_path_cache.clear()
+        for k in font_cache_stats:
+            font_cache_stats[k] = 0
+
+def _primary_font_candidates():
     if os.name == "nt":
-        candidates = [
+        return [
             r"C:/Windows/Fonts/msyh.ttc",
             r"C:/Windows/Fonts/msyh.ttf",
             r"C:/Windows/Fonts/simhei.ttf",
@@ -48,23 +216,29 @@ def pick_font(size: int):
             r"C:/Windows/Fonts/arialuni.ttf",
         ]
     elif sys.platform == "darwin":
-        candidates = [
+        return [
             "/System/Library/Fonts/PingFang.ttc",
             "/System/Library/Fonts/Hiragino Sans GB W3.otf",
             "/Library/Fonts/Arial Unicode.ttf",
             "/Library/Fonts/Arial Unicode MS.ttf",
         ]
     else:
-        candidates = [
+        return [
             "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
             "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
             "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
         ]
-    path = _first_existing(candidates)
+
+def primary_font_path():
+    return _resolve_font_path(_primary_font_candidates())
+
+def pick_font(size: int):
+    path = primary_font_path()
     if path:
         return _load_font(path, size)
     return ImageFont.load_default()
 
+# 备用字体候选：按分组列出，覆盖索引按这里的顺序（组内从前到后）挑第一个真正含该字符的字体
 FALLBACK_FONT_PATHS = {
     "emoji": [
         r"C:/Windows/Fonts/seguiemj.ttf",
@@ -95,95 +269,520 @@ FALLBACK_FONT_PATHS = {
         "/System/Library/Fonts/Al Nile.ttc",
         "/usr/share/fonts/truetype/noto/NotoSansArabic-Regular.ttf",
     ],
+    "cjk": [
+        r"C:/Windows/Fonts/msyh.ttc",
+        r"C:/Windows/Fonts/simsun.ttc",
+        "/System/Library/Fonts/PingFang.ttc",
+        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+    ],
+    "general": [
+        r"C:/Windows/Fonts/arialuni.ttf",
+        "/Library/Fonts/Arial Unicode.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
+        "/usr/share/fonts/truetype/unifont/unifont.ttf",
+    ],
 }
 
-def _script_bucket(ch):
-    cp = ord(ch)
-    if 0x1F000 <= cp <= 0x1FAFF:
-        return "emoji"
-    if 0x2600 <= cp <= 0x27FF:
-        return "symbol"
-    if 0x0C80 <= cp <= 0x0CFF:
-        return "kannada"
-    if 0x0E00 <= cp <= 0x0E7F:
-        return "thai"
-    if 0x0600 <= cp <= 0x06FF:
-        return "arabic"
-    return None
 
-_fallback_font_cache = {}
-def _get_fallback_font(bucket, size):
-    if bucket is None:
-        return None
-    key = (bucket, size)
-    if key in _fallback_font_cache:
-        return _fallback_font_cache[key]
-    path = _first_existing(FALLBACK_FONT_PATHS.get(bucket, []))
-    if path:
-        _fallback_font_cache[key] = _load_font(path, size)
-        return _fallback_font_cache[key]
-    _fallback_font_cache[key] = None
-    return None
+# ======== 字体覆盖索引：读 cmap 决定每个字符由哪个字体画 ========
+# 每个候选字体的 cmap（format 4 / 12，含 TTC 第 0 个字体）只解析一次，
+# 覆盖的码位区间按 (路径, mtime, 大小) 存进 FONT_COVERAGE_PATH，下次启动直接读 JSON。
+# 主字体含有的字符一律由主字体画；主字体没有的，交给候选列表里第一个含它的字体；
+# 谁都没有的仍由主字体画（豆腐块）。
+FONT_COVERAGE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "zhuangbi_fonts.json")
+_COVERAGE_VERSION = 1
+
+def _sfnt_face_offset(buf, index=0):
+    if buf[:4] == b"ttcf":
+        n = struct.unpack_from(">I", buf, 8)[0]
+        if index >= n:
+            raise ValueError("TTC 中没有第 %d 个字体" % index)
+        return struct.unpack_from(">I", buf, 12 + 4 * index)[0]
+    return 0
+
+def _cmap_format4(buf, off):
+    seg_x2 = struct.unpack_from(">H", buf, off + 6)[0]
+    n = seg_x2 // 2
+    ends = struct.unpack_from(">%dH" % n, buf, off + 14)
+    starts = struct.unpack_from(">%dH" % n, buf, off + 16 + seg_x2)
+    deltas = struct.unpack_from(">%dh" % n, buf, off + 16 + 2 * seg_x2)
+    ro_base = off + 16 + 3 * seg_x2
+    range_offsets = struct.unpack_from(">%dH" % n, buf, ro_base)
+    ranges = []
+    for i in range(n):
+        s, e, d, ro = starts[i], ends[i], deltas[i], range_offsets[i]
+        if s == 0xFFFF:
+            continue
+        if ro == 0:
+            # 整段按 delta 映射，只有映射到 0 号字形的那一个码位算不覆盖
+            hole = (-d) & 0xFFFF
+            if s <= hole <= e:
+                if s < hole:
+                    ranges.append((s, hole - 1))
+                if hole < e:
+                    ranges.append((hole + 1, e))
+            else:
+                ranges.append((s, e))
+            continue
+        base = ro_base + 2 * i + ro
+        run = None
+        for c in range(s, e + 1):
+            pos = base + 2 * (c - s)
+            gid = struct.unpack_from(">H", buf, pos)[0] if pos + 2 <= len(buf) else 0
+            if gid and (gid + d) & 0xFFFF:
+                if run is None:
+                    run = c
+            elif run is not None:
+                ranges.append((run, c - 1)); run = None
+        if run is not None:
+            ranges.append((run, e))
+    return ranges
+
+def _cmap_format12(buf, off):
+    n = struct.unpack_from(">I", buf, off + 12)[0]
+    ranges = []
+    for i in range(n):
+        s, e, g = struct.unpack_from(">III", buf, off + 16 + 12 * i)
+        if g == 0:
+            s += 1   # 起点映射到 .notdef
+        if s <= e:
+            ranges.append((s, e))
+    return ranges
+
+def read_cmap_ranges(path, index=0):
+    """解析 TrueType/OpenType（含 TTC）的 cmap，返回排好序、合并过的覆盖区间 [(起, 止), ...]。"""
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        face = _sfnt_face_offset(buf, index)
+        num_tables = struct.unpack_from(">H", buf, face + 4)[0]
+        cmap = None
+        for t in range(num_tables):
+            tag, _, toff, _ = struct.unpack_from(">4sIII", buf, face + 12 + 16 * t)
+            if tag == b"cmap":
+                cmap = toff
+                break
+        if cmap is None:
+            return []
+        # 优先 Unicode 全平面（format 12），其次 BMP（format 4）
+        best = None
+        for r in range(struct.unpack_from(">H", buf, cmap + 2)[0]):
+            plat, enc, soff = struct.unpack_from(">HHI", buf, cmap + 4 + 8 * r)
+            if (plat, enc) == (3, 0):
+                continue   # 符号字体的私用区映射
+            fmt = struct.unpack_from(">H", buf, cmap + soff)[0]
+            rank = {12: 2, 4: 1}.get(fmt, 0) if plat in (0, 3) else 0
+            if rank and (best is None or rank > best[0]):
+                best = (rank, fmt, cmap + soff)
+        if best is None:
+            return []
+        ranges = _cmap_format12(buf, best[2]) if best[1] == 12 else _cmap_format4(buf, best[2])
+    finally:
+        buf.close()
+    ranges.sort()
+    merged = []
+    for s, e in ranges:
+        if merged and s <= merged[-1][1] + 1:
+            if e > merged[-1][1]:
+                merged[-1][1] = e
+        else:
+            merged.append([s, e])
+    return [tuple(r) for r in merged]
+
+class FontCoverage:
+    """
+    码位 -> 字体路径。ranges(path) 读（或解析后写入）磁盘索引；
+    fallback_path(ch) 在主字体不含 ch 时返回候选里第一个含它的字体路径，否则 None。
+    """
+    def __init__(self, index_path=None):
+        self.index_path = FONT_COVERAGE_PATH if index_path is None else index_path
+        self._lock = threading.Lock()
+        self._disk = None
+        self._tables = {}
+        self._memo = {}
+        self._candidates = None
+
+    def _load_disk(self):
+        if self._disk is None:
+            try:
+                with open(self.index_path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self._disk = data["fonts"] if data.get("version") == _COVERAGE_VERSION else {}
+            except (OSError, ValueError, KeyError, TypeError):
+                self._disk = {}
+        return self._disk
+
+    def _save_disk(self):
+        tmp = self.index_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": _COVERAGE_VERSION, "fonts": self._disk}, f)
+            os.replace(tmp, self.index_path)
+        except OSError:
+            pass   # 写不了就只在内存里用
+
+    def ranges(self, path):
+        """返回 (起点列表, 终点列表)；字体读不了时两者为空。"""
+        table = self._tables.get(path)
+        if table is not None:
+            return table
+        with self._lock:
+            disk = self._load_disk()
+            try:
+                st = os.stat(path)
+                stamp = [st.st_mtime, st.st_size]
+            except OSError:
+                stamp = None
+            entry = disk.get(path)
+            if stamp is None:
+                flat = []
+            elif entry is not None and entry.get("stamp") == stamp:
+                flat = entry["ranges"]
+            else:
+                try:
+                    flat = [v for r in read_cmap_ranges(path) for v in r]
+                except (OSError, ValueError, struct.error):
+                    flat = []
+                disk[path] = {"stamp": stamp, "ranges": flat}
+                self._save_disk()
+            table = self._tables[path] = (flat[0::2], flat[1::2])
+        return table
+
+    def covers(self, path, cp):
+        starts, ends = self.ranges(path)
+        i = bisect.bisect_right(starts, cp) - 1
+        return i >= 0 and cp <= ends[i]
+
+    def candidates(self):
+        if self._candidates is None:
+            seen = []
+            for paths in FALLBACK_FONT_PATHS.values():
+                for p in paths:
+                    if p not in seen and os.path.exists(p):
+                        seen.append(p)
+            self._candidates = seen
+        return self._candidates
+
+    def fallback_path(self, ch):
+        try:
+            return self._memo[ch]
+        except KeyError:
+            pass
+        cp = ord(ch)
+        primary = primary_font_path()
+        path = None
+        if ch.isprintable() and not ch.isspace() and primary and not self.covers(primary, cp):
+            for p in self.candidates():
+                if p != primary and self.covers(p, cp):
+                    path = p
+                    break
+        self._memo[ch] = path
+        return path
+
+    def fallback_fonts(self, text):
+        """文本里实际会用到的备用字体路径（排好序），供缓存键使用。"""
+        return sorted({p for p in map(self.fallback_path, set(text)) if p})
+
+    def reset(self):
+        self._tables.clear()
+        self._memo.clear()
+        self._candidates = None
+
+FONT_COVERAGE = FontCoverage()
+
+_advance_cache = {}
+
+def _advance(font, ch):
+    """主字体下单个字符的整数步进（fallback 分段落位用），按 (字体, 字符) 记忆。"""
+    key = (_font_key(font) or id(font), ch)
+    adv = _advance_cache.get(key)
+    if adv is None:
+        if hasattr(font, "getlength"):
+            adv = int(font.getlength(ch))
+        else:
+            bb = font.getbbox(ch)
+            adv = (bb[2] - bb[0]) if bb else max(1, font.size // 2)
+        if len(_advance_cache) > 65536:
+            _advance_cache.clear()
+        _advance_cache[key] = adv
+    return adv
 
 
 # ======== 点阵生成 ========
-def text_to_grid_points(text: str, grid_w: int, grid_h: int, margin_cells: int = 2, scale: int = 4):
-    target_w = max(1, grid_w - margin_cells * 2)
-    target_h = max(1, grid_h - margin_cells * 2)
+# 字号求解：只量 bbox，不为每次试探分配整块画布。
+# 候选字号与原先的线性收缩一致：从 min(canvas_w, canvas_h) 起每次 -2，直到 <=5；
+# 都放不下时回退 12 号。在“字号越小 bbox 越小”的前提下二分得到的就是线性循环挑中的那个。
+# 备用字体的分段按主字体的步进落位，所以主字体（多行用 multiline bbox）的外框就是排版外框。
+_measure_local = threading.local()
+
+def _measure_draw():
+    d = getattr(_measure_local, "draw", None)
+    if d is None:
+        d = ImageDraw.Draw(Image.new("L", (1, 1), 255))
+        _measure_local.draw = d
+    return d
+
+def _text_fits(text, size, canvas_w, canvas_h):
+    bbox = _measure_draw().textbbox((0, 0), text, font=pick_font(size))
+    return (bbox[2] - bbox[0]) <= canvas_w and (bbox[3] - bbox[1]) <= canvas_h
+
+@lru_cache(maxsize=512)
+def _fit_font_size_cached(text, canvas_w, canvas_h, font_path):
+    start = int(min(canvas_h, canvas_w))
+    n = (start - 5 + 1) // 2 if start > 5 else 0   # 候选：start, start-2, ... (>5)
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _text_fits(text, start - 2 * mid, canvas_w, canvas_h):
+            hi = mid
+        else:
+            lo = mid + 1
+    if lo >= n:
+        return 12
+    return start - 2 * lo
+
+def fit_font_size(text, canvas_w, canvas_h):
+    """返回能放进 canvas_w x canvas_h 的字号（结果按 文本/画布/字体 记忆）。"""
+    return _fit_font_size_cached(text, int(canvas_w), int(canvas_h), primary_font_path())
+
+# 同一个 FreeTypeFont 不能被多个线程同时拿来绘制（FT_Face 非线程安全），后台预取时串行化
+_render_lock = threading.Lock()
+
+
+# ======== 字形缓存：每个字只栅格化一次，文本由缓存的字形拼出来 ========
+# 键为 (字符, 字体路径, 字号, 排版引擎)，值是墨迹覆盖度蒙版 + 相对落笔点的偏移 + 步进；
+# 成对的字距（kerning）另存。拼字时落笔点按 Pillow 的 26.6 定点累加后四舍五入到整像素，
+# 用与 draw.text 相同的蒙版混合贴上去，结果与整串渲染逐像素一致。
+# 需要整串塑形的文字（阿拉伯/希伯来/印度系/泰文、组合符、ZWJ、变体选择符）仍整串渲染。
+GLYPH_ATLAS_ENABLED = True
+GLYPH_ATLAS_MAX_BYTES = 64 * 1024 * 1024   # 蒙版总字节上限，超出按最久未用淘汰
+GLYPH_POOL_WORKERS = 0        # >0 时一次缺字够多就用这么多个进程并行栅格化
+GLYPH_POOL_MIN_MISSES = 48    # 缺字少于这个数时不值得跨进程
+
+_SHAPED_RANGES = (
+    (0x0590, 0x08FF),   # 希伯来、阿拉伯、叙利亚、它拿……
+    (0x0900, 0x0DFF),   # 印度系（含卡纳达）
+    (0x0E00, 0x0EFF),   # 泰文、老挝文
+    (0x0F00, 0x109F),   # 藏文、缅甸文
+    (0x1100, 0x11FF),   # 谚文字母
+    (0x1780, 0x17FF),   # 高棉文
+    (0x200C, 0x200F),   # ZWNJ / ZWJ / 方向标记
+    (0xFB1D, 0xFDFF), (0xFE70, 0xFEFF),    # 希伯来/阿拉伯表现形式
+    (0xFE00, 0xFE0F), (0xE0100, 0xE01EF),  # 变体选择符
+    (0x1F3FB, 0x1F3FF),  # 肤色修饰
+)
+
+def _needs_shaping(text):
+    for ch in text:
+        cp = ord(ch)
+        if unicodedata.combining(ch):
+            return True
+        for lo, hi in _SHAPED_RANGES:
+            if lo <= cp <= hi:
+                return True
+    return False
+
+def _font_key(font):
+    path = getattr(font, "path", None)
+    if not isinstance(path, str):
+        return None   # load_default 之类没有路径的字体不进缓存
+    return (path, int(font.size), getattr(font, "layout_engine", 0))
+
+def _rasterize_glyph(font, ch):
+    """单个字形 -> (覆盖度蒙版 L 或 None, (左, 上) 相对落笔点的偏移, 步进)。"""
+    b = font.getbbox(ch)
+    adv = font.getlength(ch)
+    if b[2] <= b[0] or b[3] <= b[1]:
+        return None, (0, 0), adv
+    tile = Image.new("L", (b[2] - b[0], b[3] - b[1]), 255)
+    ImageDraw.Draw(tile).text((-b[0], -b[1]), ch, fill=0, font=font)
+    return ImageOps.invert(tile), (b[0], b[1]), adv
+
+def _rasterize_glyph_chunk(path, size, chars):
+    """进程池任务：在子进程里栅格化一批字形，蒙版以字节返回。"""
+    font = _load_font(path, size)
+    out = []
+    for ch in chars:
+        mask, off, adv = _rasterize_glyph(font, ch)
+        out.append((ch, None if mask is None else (mask.size, mask.tobytes()), off, adv))
+    return out
+
+class GlyphAtlas:
+    """
+    字形缓存（有界 LRU，按蒙版字节数计量）。调用方持有 _render_lock。
+    draw(img, x, y, s, font) 等价于 ImageDraw.Draw(img).text((x, y), s, fill=0, font=font)。
+    """
+    def __init__(self, max_bytes=GLYPH_ATLAS_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._glyphs = OrderedDict()
+        self._kern = {}
+        self._bytes = 0
+        self._pool = None
+        self.stats = {"hits": 0, "misses": 0, "pooled": 0, "evictions": 0}
+
+    def usable(self, s, font):
+        return GLYPH_ATLAS_ENABLED and _font_key(font) is not None and not _needs_shaping(s)
+
+    def _put(self, key, entry):
+        self._glyphs[key] = entry
+        if entry[0] is not None:
+            self._bytes += entry[0].size[0] * entry[0].size[1]
+        while self._bytes > self.max_bytes and len(self._glyphs) > 1:
+            _, old = self._glyphs.popitem(last=False)
+            if old[0] is not None:
+                self._bytes -= old[0].size[0] * old[0].size[1]
+            self.stats["evictions"] += 1
+
+    def glyph(self, ch, font, fkey=None):
+        key = (ch,) + (fkey or _font_key(font))
+        entry = self._glyphs.get(key)
+        if entry is not None:
+            self._glyphs.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+        self.stats["misses"] += 1
+        entry = _rasterize_glyph(font, ch)
+        self._put(key, entry)
+        return entry
+
+    def kern(self, a, b, font, fkey):
+        key = (a, b) + fkey
+        k = self._kern.get(key)
+        if k is None:
+            k = self._kern[key] = font.getlength(a + b) - font.getlength(a) - font.getlength(b)
+            if len(self._kern) > 65536:
+                self._kern.clear()
+        return k
+
+    def prefetch(self, chars, font):
+        """缺字够多且开了进程池时，把这批缺字分给子进程并行栅格化。"""
+        fkey = _font_key(font)
+        if GLYPH_POOL_WORKERS <= 0 or fkey is None:
+            return
+        missing = [ch for ch in dict.fromkeys(chars) if (ch,) + fkey not in self._glyphs]
+        if len(missing) < GLYPH_POOL_MIN_MISSES:
+            return
+        if self._pool is None:
+            # spawn：这里是持有 _render_lock 的后台线程，进程里已经有 Tk 和别的线程（可能正拿着字体锁），
+            # fork 出来的子进程会继承这些锁的状态而卡死
+            self._pool = ProcessPoolExecutor(max_workers=GLYPH_POOL_WORKERS,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        n = GLYPH_POOL_WORKERS
+        chunks = [missing[i::n] for i in range(n)]
+        for part in self._pool.map(_rasterize_glyph_chunk, [fkey[0]] * n, [fkey[1]] * n, chunks):
+            for ch, raw, off, adv in part:
+                mask = None if raw is None else Image.frombytes("L", raw[0], raw[1])
+                self._put((ch,) + fkey, (mask, off, adv))
+                self.stats["pooled"] += 1
+
+    def draw(self, img, x, y, s, font):
+        fkey = _font_key(font)
+        pen, prev = 0.0, None
+        for ch in s:
+            if prev is not None:
+                pen += self.kern(prev, ch, font, fkey)
+            mask, (bx, by), adv = self.glyph(ch, font, fkey)
+            if mask is not None:
+                img.paste(0, (x + math.floor(pen + 0.5) + bx, y + by), mask)
+            pen += adv
+            prev = ch
+
+    def clear(self):
+        self._glyphs.clear()
+        self._kern.clear()
+        self._bytes = 0
+
+    def info(self):
+        return dict(self.stats, glyphs=len(self._glyphs), bytes=self._bytes)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+GLYPH_ATLAS = GlyphAtlas()
+
+def _draw_ops(img, ops, dy=0):
+    """按排版指令往灰度图上画黑字；能用字形缓存的直接拼字。"""
+    atlas = GLYPH_ATLAS
+    draw = None
+    for x, y, s, f in ops:
+        if atlas.usable(s, f):
+            atlas.draw(img, x, y - dy, s, f)
+        else:
+            if draw is None:
+                draw = ImageDraw.Draw(img)
+            draw.text((x, y - dy), s, fill=0, font=f)
+
+def _layout_ops(text, target_w, target_h, scale):
+    """
+    排版成绘制指令 {行号: [(x, y, 字符串, 字体), ...]}：与 Pillow 多行 draw.text 一致，
+    每行落在 (ox, oy + 行号 x 行距)，行距 = "A" 的 bbox 底 + 4。主字体画不了的字符（见 FontCoverage）
+    按字体切段，每段各用自己的字体画，不再先画豆腐块再覆盖。
+    返回 (canvas_w, canvas_h, ops)；画布无效时返回 None。调用方持有 _render_lock。
+    """
     canvas_w = target_w * scale
     canvas_h = target_h * scale
+    if int(min(canvas_h, canvas_w)) <= 0:
+        return None
+    font = pick_font(fit_font_size(text, canvas_w, canvas_h))
+    bbox = _measure_draw().textbbox((0, 0), text, font=font)
+    ox = (canvas_w - (bbox[2] - bbox[0])) // 2 - bbox[0]
+    oy = (canvas_h - (bbox[3] - bbox[1])) // 2 - bbox[1]
 
-    font_size = int(min(canvas_h * 1, canvas_w * 1))
-    if font_size <= 0:
-        return []
-    while font_size > 5:
-        font = pick_font(font_size)
-        tmp_img = Image.new("L", (canvas_w, canvas_h), 255)
-        d = ImageDraw.Draw(tmp_img)
-        bbox = d.textbbox((0, 0), text, font=font)
-        text_w = bbox[2] - bbox[0]
-        text_h = bbox[3] - bbox[1]
-        if text_w <= canvas_w and text_h <= canvas_h:
-            break
-        font_size -= 2
-    else:
-        font = pick_font(12)
+    ops = {}
+    spacing = font.getbbox("A")[3] + 4
+    ascent = font.getmetrics()[0] if hasattr(font, "getmetrics") else 0
+    coverage = FONT_COVERAGE
+    for k, line in enumerate(text.split("\n")):
+        if not line:
+            continue
+        y = oy + k * spacing
+        if not any(map(coverage.fallback_path, line)):
+            ops[k] = [(ox, y, line, font)]
+            continue
+        # 主字体画不了的字符交给覆盖它的备用字体：按字体切成段，段首位置沿用主字体步进，备用字体按基线对齐
+        runs = ops[k] = []
+        x = ox
+        for path, chars in groupby(line, key=coverage.fallback_path):
+            chars = "".join(chars)
+            if path is None:
+                runs.append((x, y, chars, font))
+            else:
+                fb = _load_font(path, font.size)
+                runs.append((x, y + ascent - fb.getmetrics()[0], chars, fb))
+            x += sum(_advance(font, ch) for ch in chars)
+    return canvas_w, canvas_h, ops
 
+def _prefetch_glyphs(op_lists):
+    by_font = {}
+    for ops in op_lists:
+        for _, _, s, f in ops:
+            by_font.setdefault(id(f), (f, []))[1].append(s)
+    for f, strings in by_font.values():
+        GLYPH_ATLAS.prefetch("".join(strings), f)
+
+def _render_text_bitmap(text, target_w, target_h, scale):
+    """按 scale 倍放大画布渲染文本（含 fallback 覆盖），返回灰度图 L；画布无效时返回 None。"""
+    with _render_lock:
+        return _render_text_bitmap_locked(text, target_w, target_h, scale)
+
+def _render_text_bitmap_locked(text, target_w, target_h, scale):
+    layout = _layout_ops(text, target_w, target_h, scale)
+    if layout is None:
+        return None
+    canvas_w, canvas_h, ops = layout
+    _prefetch_glyphs(ops.values())
     img = Image.new("L", (canvas_w, canvas_h), 255)
-    draw = ImageDraw.Draw(img)
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_w = bbox[2] - bbox[0]
-    text_h = bbox[3] - bbox[1]
-    ox = (canvas_w - text_w) // 2 - bbox[0]
-    oy = (canvas_h - text_h) // 2 - bbox[1]
-    draw.text((ox, oy), text, fill=0, font=font)
-
-    # fallback 覆盖（逐字修正）
-    try:
-        ascent, descent = font.getmetrics()
-        line_h = ascent + descent
-    except Exception:
-        line_h = int(font.size * 1.2)
+    for k in sorted(ops):
+        _draw_ops(img, ops[k])
+    return img
 
-    def adv_width(ch):
-        if hasattr(font, "getlength"):
-            return int(font.getlength(ch))
-        bb = font.getbbox(ch)
-        if bb:
-            return bb[2] - bb[0]
-        return max(1, font.size // 2)
-
-    y = oy
-    for line in text.splitlines():
-        x = ox
-        for ch in line:
-            bucket = _script_bucket(ch)
-            fb = _get_fallback_font(bucket, font.size)
-            if fb is not None:
-                draw.text((x, y), ch, fill=0, font=fb)
-            x += adv_width(ch)
-        y += line_h
 
+def _bitmap_to_points_py(img, target_w, target_h):
     bw = img.point(lambda p: 0 if p < 200 else 255, mode="1")
     reduced = bw.resize((target_w, target_h), Image.NEAREST)
 
@@ -194,6 +793,48 @@ def text_to_grid_points(text: str, grid_w: int, grid_h: int, margin_cells: int =
             v = px[gx, gy]
             if (v == 0) or (v is False):
                 points.append((gx, gy))
+    return points
+
+def _bitmap_to_points_np(img, target_w, target_h, offset_x=0, offset_y=0):
+    # 逐点阈值与 NEAREST 缩放可交换：先在 C 里缩放灰度图，再整块阈值 + np.nonzero。
+    # nonzero 按行优先返回，顺序与纯 Python 的 gy 外层 / gx 内层循环一致。
+    reduced = img.resize((target_w, target_h), Image.NEAREST)
+    mask = np.asarray(reduced) < 200
+    ys, xs = np.nonzero(mask)
+    out = np.empty((len(xs), 2), dtype=np.int16)
+    out[:, 0] = xs + offset_x
+    out[:, 1] = ys + offset_y
+    return out
+
+def grid_points_view(arr):
+    """int16 坐标数组 -> 旧接口的 [(gx, gy), ...] 列表。"""
+    if np is not None and isinstance(arr, np.ndarray):
+        return list(map(tuple, arr.tolist()))
+    return [tuple(p) for p in arr]
+
+def text_to_grid_array(text: str, grid_w: int, grid_h: int, margin_cells: int = 2, scale: int = 4):
+    """同 text_to_grid_points，但返回紧凑的 (N, 2) int16 数组（需要 NumPy）。"""
+    if np is None:
+        raise RuntimeError("text_to_grid_array 需要 NumPy：pip install numpy")
+    target_w = max(1, grid_w - margin_cells * 2)
+    target_h = max(1, grid_h - margin_cells * 2)
+    img = _render_text_bitmap(text, target_w, target_h, scale)
+    if img is None:
+        return np.empty((0, 2), dtype=np.int16)
+    offset_x = (grid_w - target_w) // 2
+    offset_y = (grid_h - target_h) // 2
+    return _bitmap_to_points_np(img, target_w, target_h, offset_x, offset_y)
+
+def text_to_grid_points(text: str, grid_w: int, grid_h: int, margin_cells: int = 2, scale: int = 4):
+    if np is not None:
+        return grid_points_view(text_to_grid_array(text, grid_w, grid_h, margin_cells, scale))
+
+    target_w = max(1, grid_w - margin_cells * 2)
+    target_h = max(1, grid_h - margin_cells * 2)
+    img = _render_text_bitmap(text, target_w, target_h, scale)
+    if img is None:
+        return []
+    points = _bitmap_to_points_py(img, target_w, target_h)
 
     offset_x = (grid_w - target_w) // 2
     offset_y = (grid_h - target_h) // 2
@@ -201,8 +842,439 @@ def text_to_grid_points(text: str, grid_w: int, grid_h: int, margin_cells: int =
     return centered
 
 
+# ======== 点阵磁盘缓存 ========
+# 同一套 get_config_sequence 在多台机器、每次启动都会重新栅格化。
+# 以 (文本, grid_w, grid_h, GRID_MARGIN, scale, 字体路径+mtime) 的哈希为文件名做内容寻址缓存；
+# 文件是 8 字节头 + 小端 int16 (gx, gy) 对，读取时 mmap，命中时完全不碰 Pillow。
+# 逐行流式栅格化写入的文件后面还跟一段行带表：uint32 个数 + int16 (row0, row1) 对，命中时按它切行，不用再排版。
+POINT_CACHE_ENABLED = True
+POINT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "zhuangbi_points")
+POINT_CACHE_MAX_BYTES = 64 * 1024 * 1024   # 目录总大小上限，超出按最久未用淘汰
+_POINT_CACHE_MAGIC = b"PTS1"
+_POINT_CACHE_VERSION = 2                   # 栅格化算法变了就 +1，旧文件自然失效
+point_cache_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+def _font_fingerprint(path):
+    if not path:
+        return None
+    try:
+        return [path, os.path.getmtime(path)]
+    except OSError:
+        return [path, None]
+
+def _point_cache_key(text, grid_w, grid_h, margin_cells, scale):
+    fallbacks = [_font_fingerprint(p) for p in FONT_COVERAGE.fallback_fonts(text)]
+    payload = json.dumps([
+        _POINT_CACHE_VERSION, text, int(grid_w), int(grid_h), int(margin_cells), int(scale),
+        _font_fingerprint(primary_font_path()), fallbacks,
+    ], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def _point_cache_path(key):
+    return os.path.join(POINT_CACHE_DIR, key + ".pts")
+
+def _read_bands(mm, off, size):
+    if size < off + 4:
+        return None
+    m = struct.unpack_from("<I", mm, off)[0]
+    if m == 0 or size != off + 4 + m * 4:
+        return None
+    vals = struct.unpack_from(f"<{m * 2}h", mm, off + 4)
+    return [(vals[i], vals[i + 1]) for i in range(0, len(vals), 2)]
+
+def point_cache_load(key, with_bands=False):
+    """
+    命中返回 (N, 2) int16 视图（有 NumPy 时直接映射文件）或 [(gx, gy), ...]；未命中返回 None。
+    with_bands=True 时返回 (点, 行带表或 None)，未命中仍返回 None。
+    """
+    path = _point_cache_path(key)
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < 8:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    n = struct.unpack_from("<I", mm, 4)[0]
+    if mm[:4] != _POINT_CACHE_MAGIC or size < 8 + n * 4:
+        mm.close()
+        return None
+    bands = _read_bands(mm, 8 + n * 4, size)
+    if size != 8 + n * 4 and bands is None:
+        mm.close()
+        return None
+    try:
+        os.utime(path)   # 记录最近使用，供淘汰参考
+    except OSError:
+        pass
+    if np is not None:
+        pts = np.frombuffer(mm, dtype="<i2", count=n * 2, offset=8).reshape(n, 2)
+    else:
+        vals = array("h")
+        vals.frombytes(mm[8:8 + n * 4])
+        mm.close()
+        if sys.byteorder != "little":
+            vals.byteswap()
+        pts = [(vals[i], vals[i + 1]) for i in range(0, len(vals), 2)]
+    return (pts, bands) if with_bands else pts
+
+def point_cache_store(key, points, bands=None):
+    if isinstance(points, PointSet):
+        points = points._a if np is not None else list(points)
+    vals = array("h")
+    if np is not None and isinstance(points, np.ndarray):
+        vals.frombytes(np.ascontiguousarray(points, dtype=np.int16).tobytes())
+    else:
+        for gx, gy in points:
+            vals.append(gx); vals.append(gy)
+    if sys.byteorder != "little":
+        vals.byteswap()
+    path = _point_cache_path(key)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(POINT_CACHE_DIR, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(_POINT_CACHE_MAGIC + struct.pack("<I", len(vals) // 2))
+            vals.tofile(f)
+            if bands:
+                f.write(struct.pack(f"<I{len(bands) * 2}h", len(bands), *(r for b in bands for r in b)))
+        os.replace(tmp, path)
+    except OSError:
+        try: os.remove(tmp)
+        except OSError: pass
+        return False
+    point_cache_stats["stores"] += 1
+    point_cache_evict()
+    return True
+
+def point_cache_evict(max_bytes=None):
+    """目录超过上限时，按 mtime 从旧到新删除，直到回到上限以内。"""
+    limit = POINT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        names = [n for n in os.listdir(POINT_CACHE_DIR) if n.endswith(".pts")]
+    except OSError:
+        return 0
+    entries = []
+    for n in names:
+        p = os.path.join(POINT_CACHE_DIR, n)
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    total = sum(e[1] for e in entries)
+    removed = 0
+    for _, size, p in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(p)
+        except OSError:
+            continue   # Windows 下仍被映射的文件删不掉，跳过
+        total -= size
+        removed += 1
+    point_cache_stats["evictions"] += removed
+    return removed
+
+def point_cache_clear():
+    return point_cache_evict(max_bytes=0)
+
+def cached_text_to_grid_points(text: str, grid_w: int, grid_h: int, margin_cells: int = 2, scale: int = 4):
+    """带磁盘缓存的 text_to_grid_points，返回值同样是 [(gx, gy), ...]。"""
+    if not POINT_CACHE_ENABLED:
+        return text_to_grid_points(text, grid_w, grid_h, margin_cells, scale)
+    key = _point_cache_key(text, grid_w, grid_h, margin_cells, scale)
+    hit = point_cache_load(key)
+    if hit is not None:
+        point_cache_stats["hits"] += 1
+        return grid_points_view(hit)
+    point_cache_stats["misses"] += 1
+    if np is not None:
+        arr = text_to_grid_array(text, grid_w, grid_h, margin_cells, scale)
+        point_cache_store(key, arr)
+        return grid_points_view(arr)
+    pts = text_to_grid_points(text, grid_w, grid_h, margin_cells, scale)
+    point_cache_store(key, pts)
+    return pts
+
+
 # ======== 公共工具 ========
+class PointSet:
+    """
+    紧凑点集：有 NumPy 时是 (N, 2) 整数数组，否则是交错存放 x, y 的 array('h'/'i')。
+    对外表现为只读的 [(x, y), ...] 序列（len / 迭代 / 下标 / 切片 / ==），旧函数可直接接收；
+    to_screen / order_by / take 走整块运算，不再为每个点建元组和映射 dict。
+    """
+    __slots__ = ("_a",)
+
+    def __init__(self, points=(), wide=False):
+        if isinstance(points, PointSet):
+            points = points._a
+        if np is not None:
+            dtype = np.int32 if wide else np.int16
+            if isinstance(points, np.ndarray):
+                a = points.reshape(-1, 2)
+                self._a = a if a.dtype == dtype else a.astype(dtype)
+            else:
+                a = np.array(points if isinstance(points, list) else list(points), dtype=dtype)
+                self._a = a.reshape(-1, 2)
+        else:
+            a = array("i" if wide else "h")
+            if isinstance(points, array):
+                a.extend(points)
+            else:
+                for x, y in points:
+                    a.append(x); a.append(y)
+            self._a = a
+
+    @classmethod
+    def _wrap(cls, a):
+        ps = cls.__new__(cls)
+        ps._a = a
+        return ps
+
+    def __len__(self):
+        return len(self._a) if np is not None else len(self._a) // 2
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        if np is not None:
+            return map(tuple, self._a.tolist())
+        a = self._a
+        return ((a[i], a[i + 1]) for i in range(0, len(a), 2))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if np is not None:
+                return self._wrap(self._a[i])
+            return self._wrap(array(self._a.typecode, self._interleaved(range(len(self))[i])))
+        if np is not None:
+            x, y = self._a[i].tolist()
+            return (x, y)
+        if i < 0:
+            i += len(self)
+        return (self._a[2 * i], self._a[2 * i + 1])
+
+    def _interleaved(self, indices):
+        a, out = self._a, []
+        for i in indices:
+            out.append(a[2 * i]); out.append(a[2 * i + 1])
+        return out
+
+    def __eq__(self, other):
+        if isinstance(other, (PointSet, list, tuple)):
+            return len(self) == len(other) and all(p == tuple(q) for p, q in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"PointSet({len(self)} 点)"
+
+    def tolist(self):
+        return list(self)
+
+    def xs(self):
+        return self._a[:, 0] if np is not None else self._a[0::2]
+
+    def ys(self):
+        return self._a[:, 1] if np is not None else self._a[1::2]
+
+    def take(self, indices):
+        if np is not None:
+            return self._wrap(self._a[np.asarray(indices, dtype=np.intp)])
+        return self._wrap(array(self._a.typecode, self._interleaved(indices)))
+
+    def to_screen(self, cell_size, kuan_size, dot_size):
+        """同 grid_to_screen：小窗左上角屏幕坐标（int32，4K 下也不溢出）。"""
+        ox = (cell_size - kuan_size) // 2
+        oy = (cell_size - dot_size) // 2
+        if np is not None:
+            out = self._a.astype(np.int32) * cell_size
+            out[:, 0] += ox
+            out[:, 1] += oy
+            return self._wrap(out)
+        return PointSet(((x * cell_size + ox, y * cell_size + oy) for x, y in self), wide=True)
+
+    def argsort(self, display_order):
+        """sort_points 的下标版本：返回让 self 按 DISPLAY_ORDER 排好的下标（与 sorted 的稳定顺序一致）。"""
+        n = len(self)
+        if np is not None:
+            x = self._a[:, 0].astype(np.int64)
+            y = self._a[:, 1].astype(np.int64)
+            if display_order == 0:
+                return np.lexsort((y, x))
+            if display_order == 1:
+                return np.lexsort((-y, -x))
+            if display_order == 2:
+                return np.lexsort((x, y))
+            if display_order == 3:
+                return np.lexsort((-x, -y))
+            if display_order == 4:
+                cx = int(x.sum()) / n
+                cy = int(y.sum()) / n
+                return np.argsort((x - cx) ** 2 + (y - cy) ** 2, kind="stable")
+            if display_order == 5:
+                return hilbert_order(x, y)
+            if display_order == 6:
+                return nearest_neighbour_order(x, y)
+            return np.arange(n)
+        pts = self.tolist()
+        idx = list(range(n))
+        key = {0: lambda i: pts[i], 2: lambda i: (pts[i][1], pts[i][0])}
+        if display_order in (0, 1):
+            return sorted(idx, key=key[0], reverse=display_order == 1)
+        if display_order in (2, 3):
+            return sorted(idx, key=key[2], reverse=display_order == 3)
+        if display_order == 4 and n:
+            cx = sum(p[0] for p in pts) / n
+            cy = sum(p[1] for p in pts) / n
+            return sorted(idx, key=lambda i: (pts[i][0]-cx)**2 + (pts[i][1]-cy)**2)
+        if display_order in (5, 6) and n:
+            xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+            return hilbert_order(xs, ys) if display_order == 5 else nearest_neighbour_order(xs, ys)
+        return idx
+
+    @classmethod
+    def concat(cls, parts, wide=False):
+        """把若干 PointSet 按顺序拼成一个。"""
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls(wide=wide)
+        if len(parts) == 1:
+            return parts[0]
+        if np is not None:
+            return cls._wrap(np.concatenate([p._a for p in parts]))
+        a = array(parts[0]._a.typecode)
+        for p in parts:
+            a.extend(p._a)
+        return cls._wrap(a)
+
+    def order_by(self, display_order):
+        """返回按 DISPLAY_ORDER 排好的新 PointSet（结果与 sort_points 相同）。"""
+        if not self:
+            return self
+        return self.take(self.argsort(display_order))
+
+# ======== 逐行流式栅格化：先算完的行先交出去 ========
+def _line_layout(text, target_w, target_h, scale):
+    """
+    _layout_ops 按行分组：返回 (canvas_w, [(row0, row1, 绘制指令), ...])，row0~row1 是该组墨迹覆盖的网格行，
+    墨迹行范围相互重叠的相邻行并成一组。画布无效时返回 None。调用方持有 _render_lock。
+    """
+    layout = _layout_ops(text, target_w, target_h, scale)
+    if layout is None:
+        return None
+    canvas_w, _, ops = layout
+    draw = _measure_draw()
+    groups = []
+    for k in sorted(ops):
+        top = bottom = None
+        for x, y, s, f in ops[k]:
+            b = draw.textbbox((x, y), s, font=f)
+            if b[3] > b[1]:
+                top = b[1] if top is None else min(top, b[1])
+                bottom = b[3] if bottom is None else max(bottom, b[3])
+        if top is None:
+            continue
+        r0 = max(0, int(top) // scale)
+        r1 = min(target_h, -(-int(bottom) // scale))
+        if r1 <= r0:
+            continue
+        if groups and r0 < groups[-1][1]:
+            g0, g1, gops = groups[-1]
+            groups[-1] = (min(g0, r0), max(g1, r1), gops + ops[k])
+        else:
+            groups.append((r0, r1, list(ops[k])))
+    return canvas_w, groups
+
+def _render_line_band(ops, canvas_w, row0, row1, scale):
+    """只画一组行：画布高度是这组占的网格行数 x scale，NEAREST 缩小时与整幅渲染逐格一致。"""
+    img = Image.new("L", (canvas_w, (row1 - row0) * scale), 255)
+    _draw_ops(img, ops, row0 * scale)
+    return img
+
+def iter_text_line_points(text: str, grid_w: int, grid_h: int, margin_cells: int = 2, scale: int = 4,
+                          cache=True):
+    """
+    逐行流式栅格化：字号按整段文本统一拟合，每画完一行（墨迹重叠的几行算一组）就 yield 该行的 PointSet。
+    各行按顺序拼起来与 text_to_grid_points 完全相同；全部画完后整段连同行带表写入缓存，
+    命中时按行带表直接切片，不排版也不碰 Pillow（没有行带表的文件排一次版，并把行带表补写回去）。
+    """
+    target_w = max(1, grid_w - margin_cells * 2)
+    target_h = max(1, grid_h - margin_cells * 2)
+    offset_x = (grid_w - target_w) // 2
+    offset_y = (grid_h - target_h) // 2
+    key = layout = None
+    if cache and POINT_CACHE_ENABLED:
+        key = _point_cache_key(text, grid_w, grid_h, margin_cells, scale)
+        hit = point_cache_load(key, with_bands=True)
+        if hit is not None:
+            point_cache_stats["hits"] += 1
+            ps, bands = PointSet(hit[0]), hit[1]
+            if bands is None:
+                with _render_lock:
+                    layout = _line_layout(text, target_w, target_h, scale)
+                if layout is None:
+                    return
+                bands = [(r0 + offset_y, r1 + offset_y) for r0, r1, _ in layout[1]]
+                point_cache_store(key, ps, bands)   # 下次命中就不用再排版
+            ys = ps.ys()
+            if np is None:
+                ys = list(ys)
+            for row0, row1 in bands:
+                if np is not None:
+                    lo, hi = np.searchsorted(ys, [row0, row1]).tolist()
+                else:
+                    lo = bisect.bisect_left(ys, row0)
+                    hi = bisect.bisect_left(ys, row1)
+                if hi > lo:
+                    yield ps[lo:hi]
+            return
+        point_cache_stats["misses"] += 1
+
+    with _render_lock:
+        layout = _line_layout(text, target_w, target_h, scale)
+    if layout is None:
+        return
+    canvas_w, groups = layout
+    with _render_lock:
+        _prefetch_glyphs(g[2] for g in groups)
+    parts = []
+    for row0, row1, ops in groups:
+        with _render_lock:
+            img = _render_line_band(ops, canvas_w, row0, row1, scale)
+        if np is not None:
+            pts = PointSet(_bitmap_to_points_np(img, target_w, row1 - row0, offset_x, offset_y + row0))
+        else:
+            pts = PointSet([(gx + offset_x, gy + offset_y + row0)
+                            for gx, gy in _bitmap_to_points_py(img, target_w, row1 - row0)])
+        parts.append(pts)
+        if pts:
+            yield pts
+    if key is not None:
+        point_cache_store(key, PointSet.concat(parts),
+                          [(r0 + offset_y, r1 + offset_y) for r0, r1, _ in groups])
+
+def text_line_bands(text: str, grid_w: int, grid_h: int, margin_cells: int = 2, scale: int = 4):
+    """文本各行（墨迹重叠的几行算一组）占的网格行 [(row0, row1), ...]，与 iter_text_line_points 的切分一致。"""
+    if POINT_CACHE_ENABLED:
+        hit = point_cache_load(_point_cache_key(text, grid_w, grid_h, margin_cells, scale), with_bands=True)
+        if hit is not None and hit[1] is not None:
+            return hit[1]
+    target_w = max(1, grid_w - margin_cells * 2)
+    target_h = max(1, grid_h - margin_cells * 2)
+    offset_y = (grid_h - target_h) // 2
+    with _render_lock:
+        layout = _line_layout(text, target_w, target_h, scale)
+    if layout is None:
+        return []
+    return [(r0 + offset_y, r1 + offset_y) for r0, r1, _ in layout[1]]
+
 def grid_to_screen(points, cell_size, kuan_size, dot_size):
+    if isinstance(points, PointSet):
+        return points.to_screen(cell_size, kuan_size, dot_size)
     res = []
     for gx, gy in points:
         px = gx * cell_size + (cell_size - kuan_size) // 2
@@ -210,29 +1282,137 @@ def grid_to_screen(points, cell_size, kuan_size, dot_size):
         res.append((px, py))
     return res
 
-def screen_center_from_grid(gx, gy):
-    return (gx * CELL_SIZE + CELL_SIZE // 2, gy * CELL_SIZE + CELL_SIZE // 2)
+def screen_center_from_grid(gx, gy, cell_size=None):
+    cell = CELL_SIZE if cell_size is None else cell_size   # 不传时沿用旧的全局（apply_config 流程）
+    return (gx * cell + cell // 2, gy * cell + cell // 2)
+
+# ======== 提示小窗池 ========
+WINDOW_POOL_MAX_IDLE = 3000   # 段与段之间最多保留多少个隐藏的空闲小窗
+
+class WindowPool:
+    """
+    提示小窗在段与段之间复用：段结束时只 withdraw 不 destroy，下一段改几何/颜色/文字后再显示。
+    空闲数随最近两段的用量伸缩（不超过 WINDOW_POOL_MAX_IDLE），多出来的才真正销毁。
+    """
+    def __init__(self, root, max_idle=None):
+        self.root = root
+        self.max_idle = WINDOW_POOL_MAX_IDLE if max_idle is None else max_idle
+        self.idle = []
+        self.labels = {}
+        self.borders = {}
+        self.active = 0
+        self._recent = deque(maxlen=2)
+        self._segment_peak = 0
+        self.stats = {"created": 0, "reused": 0, "released": 0, "destroyed": 0, "broken": 0, "peak_active": 0}
+
+    def _pop_idle(self):
+        while self.idle:
+            window = self.idle.pop()
+            try:
+                if window.winfo_exists():
+                    return window
+            except tk.TclError:
+                pass
+            self._forget(window)
+        return None
+
+    def acquire(self, x, y, w, h, text, bg, border):
+        window = self._pop_idle()
+        if window is not None:
+            label = self.labels[window]
+            self.stats["reused"] += 1
+        else:
+            window = tk.Toplevel(self.root)
+            window.attributes("-topmost", True)
+            label = tk.Label(window, text=text, bg=bg, font=('仿宋', 18), width=15, height=2)
+            label.pack()
+            self.labels[window] = label
+            self.borders[window] = None
+            self.stats["created"] += 1
+        window.geometry(f"{w}x{h}+{x}+{y}")
+        if self.borders[window] != border:
+            window.overrideredirect(not border)
+            self.borders[window] = border
+        label.configure(text=text, bg=bg)
+        window.deiconify()
+        window.attributes("-topmost", True)
+        self.active += 1
+        self._segment_peak = max(self._segment_peak, self.active)
+        self.stats["peak_active"] = max(self.stats["peak_active"], self.active)
+        return window
+
+    def _forget(self, window):
+        # 已经被外部销毁的窗口：从池里除名，单独计数
+        self.labels.pop(window, None)
+        self.borders.pop(window, None)
+        self.stats["broken"] += 1
+
+    def release_all(self, windows):
+        released = 0
+        for window in windows:
+            self.active -= 1   # 不管收回成功与否，它都不再显示
+            try:
+                window.withdraw()
+            except tk.TclError:
+                self._forget(window)
+                continue
+            self.idle.append(window)
+            released += 1
+        self.stats["released"] += released
+        self._recent.append(self._segment_peak)
+        self._segment_peak = self.active
+        self.trim(min(self.max_idle, max(self._recent)))
+
+    def trim(self, keep=0):
+        while len(self.idle) > keep:
+            window = self.idle.pop(0)
+            try:
+                window.destroy()
+            except tk.TclError:
+                self._forget(window)
+                continue
+            self.labels.pop(window, None)
+            self.borders.pop(window, None)
+            self.stats["destroyed"] += 1
+
+    def report(self):
+        st = self.stats
+        broken = f"，失效 {st['broken']}" if st["broken"] else ""
+        return (f"小窗池：新建 {st['created']}，复用 {st['reused']}，销毁 {st['destroyed']}{broken}，"
+                f"峰值 {st['peak_active']}，空闲 {len(self.idle)}")
 
-def show_warn_tip(x, y):
-    if not SHOW_WINDOWS:
+def show_warn_tip(x, y, pool=None, conf=None):
+    conf = current_config() if conf is None else conf
+    if not conf.SHOW_WINDOWS:
         return
+    tip = random.choice(conf.tips)
+    bg = random.choice(conf.bg_colors)
+    if pool is not None:
+        return pool.acquire(x, y, conf.Kuan_SIZE, conf.DOT_SIZE, tip, bg, conf.SHOW_BORDER)
     window = tk.Toplevel()
-    window.geometry(f"{Kuan_SIZE}x{DOT_SIZE}+{x}+{y}")
-    if SHOW_BORDER:
+    window.geometry(f"{conf.Kuan_SIZE}x{conf.DOT_SIZE}+{x}+{y}")
+    if conf.SHOW_BORDER:
         window.overrideredirect(False)
     else:
         window.overrideredirect(True)
     window.attributes("-topmost", True)
-    tip = random.choice(tips)
-    bg = random.choice(bg_colors)
     label = tk.Label(window, text=tip, bg=bg, font=('仿宋', 18), width=15, height=2)
     label.pack()
-    window.update()
     return window
 
 def sort_points(points, display_order):
+    if isinstance(points, PointSet):
+        return points.order_by(display_order)
     if not points:
         return points
+    if display_order in (5, 6):
+        if np is not None:
+            xs = np.fromiter((p[0] for p in points), dtype=np.int64, count=len(points))
+            ys = np.fromiter((p[1] for p in points), dtype=np.int64, count=len(points))
+        else:
+            xs, ys = [p[0] for p in points], [p[1] for p in points]
+        idx = hilbert_order(xs, ys) if display_order == 5 else nearest_neighbour_order(xs, ys)
+        return [points[i] for i in idx]
     if display_order == 0:
         return sorted(points, key=lambda p: (p[0], p[1]))
     elif display_order == 1:
@@ -248,6 +1428,177 @@ def sort_points(points, display_order):
     else:
         return points
 
+# ======== 局部性显示顺序：5=希尔伯特曲线 6=最近邻巡游 ========
+# 轴向排序里相邻的两个点常常隔得很远，粒子连线就长、顶点多；这两种顺序让相邻点尽量挨着。
+# 输入的坐标先归一化到格点（减最小值再除以公约数），屏幕坐标和网格坐标得到同样的顺序。
+def _lattice(xs, ys):
+    if np is not None and isinstance(xs, np.ndarray):
+        x = xs.astype(np.int64) - int(xs.min())
+        y = ys.astype(np.int64) - int(ys.min())
+        gx = int(np.gcd.reduce(x)) or 1
+        gy = int(np.gcd.reduce(y)) or 1
+        return x // gx, y // gy
+    mx, my = min(xs), min(ys)
+    x = [v - mx for v in xs]
+    y = [v - my for v in ys]
+    gx = gy = 0
+    for v in x: gx = math.gcd(gx, v)
+    for v in y: gy = math.gcd(gy, v)
+    gx, gy = gx or 1, gy or 1
+    return [v // gx for v in x], [v // gy for v in y]
+
+def hilbert_order(xs, ys):
+    """按希尔伯特曲线上的位置排序，返回下标；有 NumPy 时整列按位计算 key（每层一次向量运算）。"""
+    x, y = _lattice(xs, ys)
+    n = len(x)
+    if n == 0:
+        return []
+    side = 1
+    while side <= max(int(max(x)), int(max(y))):
+        side <<= 1
+    if np is not None and isinstance(x, np.ndarray):
+        d = np.zeros(n, dtype=np.int64)
+        s = side >> 1
+        while s > 0:
+            rx = (x & s) > 0
+            ry = (y & s) > 0
+            d += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+            flip = ~ry & rx
+            x = np.where(flip, side - 1 - x, x)
+            y = np.where(flip, side - 1 - y, y)
+            x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+            s >>= 1
+        return np.argsort(d, kind="stable")
+    keys = []
+    for px, py in zip(x, y):
+        d, s = 0, side >> 1
+        while s > 0:
+            rx = 1 if px & s else 0
+            ry = 1 if py & s else 0
+            d += s * s * ((3 * rx) ^ ry)
+            if ry == 0:
+                if rx == 1:
+                    px, py = side - 1 - px, side - 1 - py
+                px, py = py, px
+            s >>= 1
+        keys.append(d)
+    return sorted(range(n), key=keys.__getitem__)
+
+# 先走正交邻居（距离 1），再走对角（√2）：同一连通块里“最近”的一步几乎总在这 8 个格子里
+_NN_STEPS = [(1, 0), (0, 1), (-1, 0), (0, -1), (1, 1), (-1, 1), (1, -1), (-1, -1)]
+
+def nearest_neighbour_order(xs, ys):
+    """
+    贪心最近邻巡游，返回下标。从最左上的点出发，每步走到最近的未访问点：
+    先查 8 邻格（稠密 rank 表），当前连通块里邻格都走过了再在块内剩余点里找最近的（向量化 argmin），
+    整块走完才跳到全局最近的下一块。
+    """
+    x, y = _lattice(xs, ys)
+    n = len(x)
+    if n == 0:
+        return []
+    use_np = np is not None and isinstance(x, np.ndarray)
+    xl = x.tolist() if use_np else list(x)
+    yl = y.tolist() if use_np else list(y)
+    W = max(xl) + 3
+    rank = array("i", [-1]) * (W * (max(yl) + 3))
+    for i in range(n):
+        rank[(yl[i] + 1) * W + xl[i] + 1] = i
+    steps = [dy * W + dx for dx, dy in _NN_STEPS]
+
+    # 8 连通块
+    comp = array("i", [-1]) * n
+    members = []
+    for s0 in range(n):
+        if comp[s0] >= 0:
+            continue
+        cid = len(members)
+        comp[s0] = cid
+        group = [s0]
+        k = 0
+        while k < len(group):
+            i = group[k]; k += 1
+            base = (yl[i] + 1) * W + xl[i] + 1
+            for o in steps:
+                j = rank[base + o]
+                if j >= 0 and comp[j] < 0:
+                    comp[j] = cid
+                    group.append(j)
+        members.append(np.array(group, dtype=np.intp) if use_np else group)
+    left = [len(m) for m in members]
+
+    visited = np.zeros(n, dtype=bool) if use_np else bytearray(n)
+
+    def nearest(cands, px, py):
+        if use_np:
+            cands = cands[~visited[cands]]
+            if len(cands) == 0:
+                return -1
+            d2 = (x[cands] - px) ** 2 + (y[cands] - py) ** 2
+            return int(cands[int(np.argmin(d2))])
+        best, bd = -1, None
+        for j in cands:
+            if not visited[j]:
+                d = (xl[j] - px) ** 2 + (yl[j] - py) ** 2
+                if bd is None or d < bd:
+                    best, bd = j, d
+        return best
+
+    cur = min(range(n), key=lambda i: (xl[i], yl[i]))
+    order = []
+    all_idx = np.arange(n) if use_np else range(n)
+    while True:
+        visited[cur] = True
+        order.append(cur)
+        c = comp[cur]
+        left[c] -= 1
+        if len(order) == n:
+            break
+        nxt = -1
+        base = (yl[cur] + 1) * W + xl[cur] + 1
+        for o in steps:
+            j = rank[base + o]
+            if j >= 0 and not visited[j]:
+                nxt = j
+                break
+        if nxt < 0:
+            nxt = nearest(members[c] if left[c] else all_idx, xl[cur], yl[cur])
+        cur = nxt
+    return np.array(order, dtype=np.intp) if use_np else order
+
+def path_length(points):
+    """按顺序依次连接各点的折线总长（像素）。"""
+    if isinstance(points, PointSet) and np is not None:
+        a = points._a.astype(np.float64)
+        return float(np.hypot(*np.diff(a, axis=0).T).sum()) if len(a) > 1 else 0.0
+    pts = list(points)
+    return sum(math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(pts, pts[1:]))
+
+def stroke_stats(strokes):
+    """粒子笔画的绘制开销：路径/桥接线总长（像素）、折线顶点数、桥接条数。"""
+    length, vertices, bridges = 0.0, 0, 0
+    for st in strokes:
+        for kind, path in zip(st["kinds"], st["paths"]):
+            if path is None:
+                continue
+            if kind == STROKE_BRIDGE:
+                bridges += 1
+            vertices += len(path) // 2
+            length += path_length(zip(path[0::2], path[1::2]))   # path 是 [x0, y0, x1, y1, ...]
+    return {"length_px": round(length, 1), "vertices": vertices, "bridges": bridges}
+
+def compare_display_orders(cfg, sw, sh, orders=None):
+    """对一段粒子配置试遍 DISPLAY_ORDER，返回 {order: stroke_stats}，用来挑画起来最省的顺序。"""
+    conf = resolve_config(cfg)
+    cell = conf.CELL_SIZE
+    lines = list(iter_text_line_points(conf.text, max(1, sw // cell), max(1, sh // cell), conf.GRID_MARGIN, 4))
+    pts = PointSet.concat(lines)
+    out = {}
+    for order in (DISPLAY_ORDERS if orders is None else orders):
+        c = conf.replace(DISPLAY_ORDER=order)
+        out[order] = stroke_stats([plan_particle_strokes(c, b) for b in plan_particle_batches(c, pts, lines)])
+    return out
+
 def _rects_overlap(ax, ay, bx, by, w, h, pad):
     pad = max(0, int(pad))
     w_pad = w + pad
@@ -258,363 +1609,1420 @@ def _rects_overlap(ax, ay, bx, by, w, h, pad):
     if by >= ay + h_pad: return False
     return True
 
+class _RectIndex:
+    """
+    均匀网格空间哈希：桶宽 = w + pad、桶高 = h + pad。
+    两个 w x h 矩形（含 pad）相碰时横纵向距离都小于桶尺寸，所以只需查 3x3 个相邻桶。
+    """
+    __slots__ = ("w", "h", "pad", "bw", "bh", "buckets")
+
+    def __init__(self, w, h, pad):
+        self.w, self.h = w, h
+        self.pad = max(0, int(pad))
+        self.bw = max(1, int(w) + self.pad)
+        self.bh = max(1, int(h) + self.pad)
+        self.buckets = {}
+
+    def add(self, x, y):
+        key = (x // self.bw, y // self.bh)
+        b = self.buckets.get(key)
+        if b is None:
+            self.buckets[key] = [(x, y)]
+        else:
+            b.append((x, y))
+
+    def hits(self, x, y):
+        cx, cy = x // self.bw, y // self.bh
+        get = self.buckets.get
+        w, h, pad = self.w, self.h, self.pad
+        for by in (cy - 1, cy, cy + 1):
+            for bx in (cx - 1, cx, cx + 1):
+                b = get((bx, by))
+                if b is None:
+                    continue
+                for kx, ky in b:
+                    if _rects_overlap(x, y, kx, ky, w, h, pad):
+                        return True
+        return False
+
 def filter_points_non_overlap(points, w, h, pad, limit):
     kept = []
+    index = _RectIndex(w, h, pad)
     for x, y in points:
-        conflict = False
-        for kx, ky in kept:
-            if _rects_overlap(x, y, kx, ky, w, h, pad):
-                conflict = True
-                break
-        if not conflict:
+        if not index.hits(x, y):
             kept.append((x, y))
+            index.add(x, y)
             if len(kept) >= limit:
                 break
     return kept
 
 def filter_points_non_overlap_with_base(points, base_points, w, h, pad, limit):
     kept = []
+    index = _RectIndex(w, h, pad)
+    for bx, by in base_points:
+        index.add(bx, by)
     for x, y in points:
-        conflict = False
-        for bx, by in base_points:
-            if _rects_overlap(x, y, bx, by, w, h, pad):
-                conflict = True
-                break
-        if conflict:
-            continue
-        for kx, ky in kept:
-            if _rects_overlap(x, y, kx, ky, w, h, pad):
-                conflict = True
-                break
-        if not conflict:
+        if not index.hits(x, y):
             kept.append((x, y))
+            index.add(x, y)
             if len(kept) >= limit:
                 break
     return kept
 
-def split_points_into_lines(points):
-    if not points:
-        return [points]
-    ys = sorted(set(p[1] for p in points))
-    clusters, cur, prev = [], [], None
-    for y in ys:
-        if prev is None or y == prev + 1:
-            cur.append(y)
-        else:
-            clusters.append(cur); cur = [y]
-        prev = y
-    if cur: clusters.append(cur)
-    if len(clusters) == 2:
-        top_rows = set(clusters[0]); bottom_rows = set(clusters[1])
-        top_points = [p for p in points if p[1] in top_rows]
-        bottom_points = [p for p in points if p[1] in bottom_rows]
-        return [top_points, bottom_points]
-    return [points]
+def split_points_into_lines(points, bands=None):
+    """
+    按排版给出的行带 [(row0, row1), ...]（text_line_bands）把点分成若干行，从上到下，空行不出组。
+    不给行带或只有一行时整体一组：字形内部的空白（“二”“三”）不算换行。
+    """
+    if not points or not bands or len(bands) < 2:
+        return [points]
+    starts = [b[0] for b in bands]
+    is_set = isinstance(points, PointSet)
+    groups = [[] for _ in bands]
+    ys = points.ys().tolist() if is_set else [p[1] for p in points]
+    for i, y in enumerate(ys):
+        groups[max(0, bisect.bisect_right(starts, y) - 1)].append(i)
+    if is_set:
+        return [points.take(g) for g in groups if g]
+    return [[points[i] for i in g] for g in groups if g]
+
+NEIGHBORS_8 = [(-1,-1), (0,-1), (1,-1),
+               (-1, 0),          (1, 0),
+               (-1, 1), (0, 1),  (1, 1)]
+
+def build_components(points):
+    s = set(points)
+    comp_id = {}; comps = []
+    for p in points:
+        if p in comp_id: continue
+        cid = len(comps)
+        queue = deque([p])
+        comp_id[p] = cid
+        comp_pts = [p]
+        while queue:
+            x, y = queue.popleft()
+            for dx, dy in NEIGHBORS_8:
+                q = (x+dx, y+dy)
+                if q in s and q not in comp_id:
+                    comp_id[q] = cid
+                    queue.append(q)
+                    comp_pts.append(q)
+        comps.append(comp_pts)
+    return comp_id, comps, s
+
+def bfs_path(a, b, allowed_set):
+    if a == b: return [a]
+    if a not in allowed_set or b not in allowed_set: return None
+    queue = deque([a]); parent = {a: None}
+    while queue:
+        x, y = queue.popleft()
+        for dx, dy in NEIGHBORS_8:
+            q = (x+dx, y+dy)
+            if q not in allowed_set or q in parent: continue
+            parent[q] = (x, y)
+            if q == b:
+                path = [q]
+                while parent[path[-1]] is not None:
+                    path.append(parent[path[-1]])
+                path.reverse()
+                return path
+            queue.append(q)
+    return None
+
+
+# ======== 统一延时（由配置控制）：按速率生成，每帧有时间预算 ========
+SPAWN_FRAME_MS = 16          # 调度器帧间隔（毫秒）
+SPAWN_FRAME_BUDGET_MS = 8    # 每帧最多花多少毫秒生成，超出部分留到下一帧
+
+class SpawnScheduler:
+    """
+    替代“每生成一个就 after(间隔) 一次”：
+    每个条目都有绝对到期时间（间隔 = GEN_INTERVAL_MS + 0~GEN_JITTER_MS 的浮点抖动，逐个累加），
+    每帧把已到期的条目尽量生成完，超出帧预算的顺延到下一帧，所以 1 ms 以下的间隔和抖动都按实际速率兑现，
+    总耗时可预期。GEN_INTERVAL_MS<=0 表示不限速，只受帧预算约束。
+    batches 之间与开头各多等一个间隔（与旧的 after 链一致）。
+    streaming=True 时批次可以边播边用 feed() 追加，close() 之后播完才算结束。
+    """
+    def __init__(self, widget, batches, spawn, on_finish=None, interval_ms=0, jitter_ms=0,
+                 frame_ms=None, budget_ms=None, label="spawn", streaming=False):
+        self.widget = widget
+        self.label = label
+        self.batches = [b for b in batches]
+        self.spawn = spawn
+        self.on_finish = on_finish
+        self.interval_ms = float(interval_ms)
+        self.jitter_ms = max(0.0, float(jitter_ms))
+        self.frame_ms = SPAWN_FRAME_MS if frame_ms is None else frame_ms
+        self.budget_ms = SPAWN_FRAME_BUDGET_MS if budget_ms is None else budget_ms
+        self.total = sum(len(b) for b in self.batches)
+        self._b = 0
+        self._i = 0
+        self._job = None
+        self._next_due = 0.0
+        self._burst = 0
+        self._started = False
+        self._finished = False
+        self._last_frame = float("-inf")
+        self.closed = not streaming
+        self.stats = {"spawned": 0, "frames": 0, "max_lag_ms": 0.0, "started_ms": 0.0, "finished_ms": 0.0}
+
+    def _gap(self):
+        if self.interval_ms <= 0:
+            return 0.0
+        return self.interval_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+
+    def start(self):
+        now = time.perf_counter() * 1000.0
+        self.stats["started_ms"] = now
+        self._next_due = now + self._gap()
+        self._started = True
+        self._wake(now)
+        return self
+
+    def _delay(self, now):
+        """
+        到下一帧的毫秒数：等到下一个条目到期，但两帧之间至少隔 frame_ms，
+        间隔比一帧短时就在一帧里把到期的一起生成，不为每个条目单独排 after。
+        """
+        return max(0, int(math.ceil(max(self._next_due, self._last_frame + self.frame_ms) - now)))
+
+    def _wake(self, now):
+        if self.widget is not None and self._job is None and not self._finished:
+            self._job = self.widget.after(self._delay(now), self._frame)
+
+    def feed(self, batch):
+        """流式追加一批。前面的批已经播完（在等数据）时，从现在起再等一个批间间隔。"""
+        now = time.perf_counter() * 1000.0
+        if self._b >= len(self.batches) and self._b:
+            self._next_due = max(self._next_due, now) + self._gap()
+        self.batches.append(batch)
+        self.total += len(batch)
+        if self._started:
+            self._wake(now)
+
+    def close(self):
+        """不会再有新批次：已有的播完就调用 on_finish。"""
+        self.closed = True
+        if self._started:
+            self._wake(time.perf_counter() * 1000.0)
+
+    def cancel(self):
+        if self._job is not None:
+            try:
+                self.widget.after_cancel(self._job)
+            except Exception:
+                pass
+            self._job = None
+
+    @property
+    def done(self):
+        return self.closed and self._b >= len(self.batches)
+
+    def pump(self):
+        """
+        生成所有已到期的条目（受帧预算约束），全部完成时调用 on_finish 并返回 True。
+        widget=None 时不自己排 after，由外部时钟（Timeline）每帧调用。
+        """
+        if self._finished:
+            return True
+        tr = TRACER
+        load = LOAD
+        mult = 1 if load is None else load.knobs["batch_mult"]
+        t0 = time.perf_counter() * 1000.0
+        deadline = t0 + (self.budget_ms if load is None else self.budget_ms * load.knobs["budget_scale"])
+        st = self.stats
+        st["frames"] += 1
+        spawned0, frame_lag = st["spawned"], 0.0
+        now = t0
+        while self._b < len(self.batches):
+            batch = self.batches[self._b]
+            if self._i >= len(batch):
+                self._b += 1
+                self._i = 0
+                if self._b < len(self.batches):
+                    self._next_due += self._gap()   # 批与批之间多等一个间隔
+                continue
+            if self._next_due > now or now >= deadline:
+                break
+            lag = now - self._next_due
+            if lag > frame_lag:
+                frame_lag = lag
+                if lag > st["max_lag_ms"]:
+                    st["max_lag_ms"] = lag
+            self.spawn(batch[self._i])
+            self._i += 1
+            st["spawned"] += 1
+            self._burst += 1
+            if self._burst >= mult:   # 降载时一个到期时刻连出 mult 个，少排几次帧
+                self._burst = 0
+                self._next_due += self._gap()
+            now = time.perf_counter() * 1000.0
+        if tr is not None and st["spawned"] > spawned0:
+            tr.end(self.label, t0 / 1000.0, cat="spawn", spawned=st["spawned"] - spawned0,
+                   lag_ms=round(frame_lag, 2))
+        if self.done:
+            self._finished = True
+            st["finished_ms"] = now
+            if callable(self.on_finish):
+                self.on_finish()
+            return True
+        return False
+
+    def _frame(self):
+        self._job = None
+        self._last_frame = time.perf_counter() * 1000.0
+        if self.pump() or self._b >= len(self.batches):
+            return   # 结束，或流式批次还没到（feed/close 会重新唤醒）
+        self._job = self.widget.after(max(1, self._delay(time.perf_counter() * 1000.0)), self._frame)
+
+
+class SegmentHandle:
+    """
+    一段正在播放的内容。scheduler 是它的生成调度器；spawned_at 是全部生成完的时刻（perf_counter 毫秒）；
+    teardown() 立即收场（幂等）；fade(ms) 在交叉淡出时调用（不支持的模式什么都不做）；
+    alive() 返回当前存活的窗口/画布元素数（只在埋点打开时调用）。
+    """
+    def __init__(self, teardown, fade=None):
+        self.scheduler = None
+        self.alive = lambda: 0
+        self.spawned_at = None
+        self.closed = False
+        self._teardown = teardown
+        self._fade = fade
+
+    def mark_spawned(self):
+        self.spawned_at = time.perf_counter() * 1000.0
+
+    def teardown(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+        self._teardown()
+
+    def fade(self, ms):
+        if self._fade is not None and not self.closed:
+            self._fade(ms)
+
+
+# ======== 自适应降载：按事件循环延迟调节特效强度 ========
+ADAPTIVE_LOAD = True        # 关掉后所有特效参数按配置原样执行
+ADAPTIVE_TARGET_MS = 8.0    # 允许的 tick 平均延迟（after 回调比计划时刻晚到的部分）
+ADAPTIVE_HOLD_MS = 500      # 两次降级之间至少隔多久
+ADAPTIVE_RESTORE_MS = 2000  # 余量持续多久才恢复一级
+
+# 每级的系数：火花数比例、每个到期时刻生成几个条目、调度器每帧预算比例、画布存活对象上限比例
+LOAD_LEVELS = (
+    {"spark_scale": 1.0,  "batch_mult": 1, "budget_scale": 1.0, "item_scale": 1.0},
+    {"spark_scale": 0.67, "batch_mult": 1, "budget_scale": 0.75, "item_scale": 0.75},
+    {"spark_scale": 0.34, "batch_mult": 2, "budget_scale": 0.5, "item_scale": 0.5},
+    {"spark_scale": 0.0,  "batch_mult": 3, "budget_scale": 0.4, "item_scale": 0.35},
+    {"spark_scale": 0.0,  "batch_mult": 4, "budget_scale": 0.3, "item_scale": 0.25},
+)
+
+LOAD = None   # 播放时由 main 创建的 LoadController；None 表示不调节
+
+def _log_load_adjust(ctrl, old, new, lag_ms):
+    if VERBOSE:
+        print(f"[降载] 第 {old} 级 -> 第 {new} 级（tick 平均延迟 {lag_ms:.1f} ms，目标 {ctrl.target_ms:.1f} ms）：{LOAD_LEVELS[new]}")
+    tr = TRACER
+    if tr is not None:
+        tr.counter("load_level", level=new, lag_ms=round(lag_ms, 2))
+
+class LoadController:
+    """
+    由 Timeline 每个 tick 喂一次“实际开始时刻 - 计划开始时刻”，做指数平滑：
+    平均延迟超过目标就降一级（火花变少、批量变大、调度器少占帧时间、轨迹更早压进位图），
+    延迟低于目标一半并持续 ADAPTIVE_RESTORE_MS 就恢复一级。每次调整都调用 on_adjust(ctrl, 旧级, 新级, 延迟)。
+    """
+    def __init__(self, target_ms=None, on_adjust=_log_load_adjust, alpha=0.2):
+        self.target_ms = ADAPTIVE_TARGET_MS if target_ms is None else float(target_ms)
+        self.on_adjust = on_adjust
+        self.alpha = alpha
+        self.level = 0
+        self.knobs = LOAD_LEVELS[0]
+        self.lag_ms = 0.0
+        self._changed_at = -1e9
+        self._calm_since = None
+        self.adjustments = 0
+
+    def sample(self, lag_ms, now_ms):
+        self.lag_ms += self.alpha * (max(0.0, lag_ms) - self.lag_ms)
+        if self.lag_ms > self.target_ms:
+            self._calm_since = None
+            if self.level < len(LOAD_LEVELS) - 1 and now_ms - self._changed_at >= ADAPTIVE_HOLD_MS:
+                self._set(self.level + 1, now_ms)
+        elif self.lag_ms < self.target_ms / 2:
+            if self._calm_since is None:
+                self._calm_since = now_ms
+            elif self.level > 0 and now_ms - self._calm_since >= ADAPTIVE_RESTORE_MS:
+                self._set(self.level - 1, now_ms)
+                self._calm_since = now_ms
+        else:
+            self._calm_since = None
+
+    def _set(self, level, now_ms):
+        old, self.level = self.level, level
+        self.knobs = LOAD_LEVELS[level]
+        self._changed_at = now_ms
+        self.adjustments += 1
+        if callable(self.on_adjust):
+            self.on_adjust(self, old, level, self.lag_ms)
+
+    def spark_count(self, base):
+        return int(round(base * self.knobs["spark_scale"]))
+
+    def max_items(self, base):
+        return max(1, int(base * self.knobs["item_scale"]))
+
+
+# ======== 段预处理（只读配置快照，不碰 Tk 与全局，可在后台线程/进程里跑） ========
+def order_particle_line(conf, points_group):
+    """粒子模式：一行网格点按 DISPLAY_ORDER 排好（屏幕坐标是网格坐标的单调变换，排好的下标直接取网格点）。"""
+    cell, kw, dh = conf.CELL_SIZE, conf.Kuan_SIZE, conf.DOT_SIZE
+    if isinstance(points_group, PointSet):
+        return points_group.take(points_group.to_screen(cell, kw, dh).argsort(conf.DISPLAY_ORDER))
+    sp = grid_to_screen(points_group, cell, kw, dh)
+    mapping = {sp[i]: points_group[i] for i in range(len(points_group))}
+    sp_sorted = sort_points(sp, conf.DISPLAY_ORDER)
+    return [mapping[p] for p in sp_sorted]
+
+def plan_particle_batches(conf, grid_points, lines=None):
+    """
+    粒子模式：按 DISPLAY_ORDER 排好的网格点批次，每行一批（TWO_LINES_TOGETHER 时整段一批）。
+    lines 是已经按行分好的点（iter_text_line_points / split_points_into_lines）；不给时整段算一行。
+    """
+    if conf.TWO_LINES_TOGETHER:
+        return [order_particle_line(conf, grid_points)]
+    if lines is None:
+        lines = [grid_points]
+    return [order_particle_line(conf, g) for g in lines]
+
+# 粒子笔画：每段预先算好遍历顺序和相邻粒子之间的连线坐标，绘制 tick 里只剩 canvas 调用
+STROKE_START, STROKE_PATH, STROKE_BRIDGE = 0, 1, 2
+
+def plan_particle_strokes(conf, ordered):
+    """
+    ordered：已按 DISPLAY_ORDER 排好的一批网格点（列表或 PointSet）。
+    沿每个 8 连通块做 DFS（起点与邻居都按显示顺序优先），连通块之间按各自首点的显示顺序衔接。
+    相邻两个粒子之间的路径就是生成树上的回溯路径，直接由 DFS 栈得到，不再逐对 BFS。
+    点用显示顺序下标表示，查邻居走稠密网格 rank 表（array），不建元组 dict / set。
+    返回 dict：centers=[(x, y)] 粒子屏幕中心，kinds=[STROKE_*]，paths=[扁平坐标列表或 None]。
+    """
+    cell = conf.CELL_SIZE
+    half = cell // 2
+    pts = ordered.tolist() if isinstance(ordered, PointSet) else [tuple(p) for p in ordered]
+    centers, kinds, paths = [], [], []
+    if not pts:
+        return {"centers": centers, "kinds": kinds, "paths": paths}
+    ox = min(p[0] for p in pts) - 1
+    oy = min(p[1] for p in pts) - 1
+    W = max(p[0] for p in pts) - ox + 2
+    H = max(p[1] for p in pts) - oy + 2
+    rank = array("i", [-1]) * (W * H)   # rank[(y-oy)*W + (x-ox)] = 显示顺序下标，-1 表示不在点集里
+    for i, (x, y) in enumerate(pts):
+        rank[(y - oy) * W + (x - ox)] = i
+    offsets = [dy * W + dx for dx, dy in NEIGHBORS_8]
+
+    def center(i):
+        x, y = pts[i]
+        return (x * cell + half, y * cell + half)
+
+    def neighbors(i):
+        x, y = pts[i]
+        base = (y - oy) * W + (x - ox)
+        nb = [r for r in (rank[base + o] for o in offsets) if r >= 0]
+        nb.sort(reverse=True)   # 反序：pop() 先取显示顺序靠前的
+        return nb
+
+    if conf.DISPLAY_ORDER in TOUR_ORDERS:
+        return _tour_strokes(pts, neighbors, center)
+
+    visited = bytearray(len(pts))
+    last = None
+    for start in range(len(pts)):
+        if visited[start]:
+            continue
+        visited[start] = 1
+        c = center(start)
+        if last is None:
+            kinds.append(STROKE_START); paths.append(None)
+        else:
+            kinds.append(STROKE_BRIDGE); paths.append([*center(last), *c])
+        centers.append(c)
+        last = start
+        stack = [start]
+        pending = [neighbors(start)]
+        trail = [start]          # 上一个粒子到栈顶的已走路径
+        while stack:
+            nb = pending[-1]
+            while nb and visited[nb[-1]]:
+                nb.pop()
+            if not nb:
+                stack.pop(); pending.pop()
+                if stack:
+                    trail.append(stack[-1])
+                continue
+            q = nb.pop()
+            visited[q] = 1
+            trail.append(q)
+            coords = []
+            for g in trail:
+                coords.extend(center(g))
+            kinds.append(STROKE_PATH); paths.append(coords)
+            centers.append(center(q))
+            last = q
+            stack.append(q); pending.append(neighbors(q))
+            trail = [q]
+    return {"centers": centers, "kinds": kinds, "paths": paths}
+
+TOUR_ORDERS = (5, 6)   # 本身就是巡游路线的显示顺序：笔画按顺序连，不再做 DFS
+
+def _tour_strokes(pts, neighbors, center):
+    """
+    希尔伯特/最近邻顺序里前后两点大多相邻：相邻就直接连；同一连通块里隔开的走块内最短格路径（BFS）；
+    跨连通块画桥接线。返回格式同 plan_particle_strokes。
+    """
+    n = len(pts)
+    comp = array("i", [-1]) * n
+    for s0 in range(n):
+        if comp[s0] >= 0:
+            continue
+        comp[s0] = s0
+        group = [s0]
+        for i in group:
+            for j in neighbors(i):
+                if comp[j] < 0:
+                    comp[j] = s0
+                    group.append(j)
+
+    def route(a, b):
+        parent = {a: a}
+        frontier = [a]
+        while frontier and b not in parent:
+            nxt = []
+            for i in frontier:
+                for j in neighbors(i):
+                    if j not in parent:
+                        parent[j] = i
+                        nxt.append(j)
+            frontier = nxt
+        path = [b]
+        while path[-1] != a:
+            path.append(parent[path[-1]])
+        path.reverse()
+        return path
+
+    centers, kinds, paths = [center(0)], [STROKE_START], [None]
+    for i in range(1, n):
+        c = center(i)
+        if comp[i] != comp[i - 1]:
+            kinds.append(STROKE_BRIDGE); paths.append([*center(i - 1), *c])
+        else:
+            coords = []
+            for g in route(i - 1, i):
+                coords.extend(center(g))
+            kinds.append(STROKE_PATH); paths.append(coords)
+        centers.append(c)
+    return {"centers": centers, "kinds": kinds, "paths": paths}
+
+def place_window_line(conf, points_group, placed, remaining):
+    """
+    窗口模式：一行网格点 -> 排序 + 上限 remaining + 可选的不重叠过滤后的屏幕坐标。
+    placed 是前面各行已保留的窗口，不重叠时新窗口也要避开它们。
+    """
+    if remaining <= 0:
+        return []
+    kw, dh = conf.Kuan_SIZE, conf.DOT_SIZE
+    sp = sort_points(grid_to_screen(points_group, conf.CELL_SIZE, kw, dh), conf.DISPLAY_ORDER)
+    if not (conf.SHOW_BORDER and conf.FORBID_OVERLAP):
+        return sp[:remaining]
+    limit = min(remaining, len(sp))
+    if placed:
+        return filter_points_non_overlap_with_base(sp, placed, kw, dh, conf.MIN_GAP_PX, limit)
+    return filter_points_non_overlap(sp, kw, dh, conf.MIN_GAP_PX, limit)
+
+def plan_window_batches(conf, grid_points, lines=None):
+    """窗口模式（点阵分支）：每行一批（TWO_LINES_TOGETHER 时整段一批），总数不超过 MAX_WINDOWS。lines 同上。"""
+    if conf.TWO_LINES_TOGETHER or lines is None:
+        lines = [grid_points]
+    batches, placed = [], []
+    for g in lines:
+        kept = place_window_line(conf, g, placed, conf.MAX_WINDOWS - len(placed))
+        placed.extend(kept)
+        batches.append(kept)
+    return batches
+
+def _jitter_grid_shape(count, span_w, span_h, bw, bh):
+    """在能放下 count 个格子的 (列, 行) 组合里，挑每格相对窗口余量最大的那个。"""
+    cols_max = max(1, span_w // bw)
+    rows_max = max(1, span_h // bh)
+    if count >= cols_max * rows_max:
+        return cols_max, rows_max
+    best, best_score = (cols_max, rows_max), -1.0
+    for cols in range(1, cols_max + 1):
+        rows = -(-count // cols)
+        if rows > rows_max:
+            continue
+        score = min(span_w / cols / bw, span_h / rows / bh)
+        if score > best_score:
+            best, best_score = (cols, rows), score
+    return best
+
+def place_random_windows(sw, sh, w, h, pad, count, forbid_overlap, rng=random):
+    """
+    随机摆放 count 个 w x h 窗口，返回 (位置列表, 统计)。
+    禁止重叠时用“格子抖动”采样：把可用区域切成不少于 count 个、每个都不小于 (w+pad) x (h+pad)
+    的格子，随机挑 count 个格子，窗口在格内随机抖动。窗口不会越出自己的格子，所以天然互不相碰，
+    O(count) 完成、不需要重试；格子不够时（超过屏幕容量）剩下的才允许重叠。
+    统计：placed=满足约束的个数，fallback=回退为允许重叠的个数。
+    """
+    max_x = max(0, sw - w)
+    max_y = max(0, sh - h)
+    chosen = []
+    stats = {"placed": 0, "fallback": 0}
+    if count <= 0:
+        return chosen, stats
+    if not forbid_overlap:
+        chosen = [(rng.randint(0, max_x), rng.randint(0, max_y)) for _ in range(count)]
+        stats["placed"] = count
+        return chosen, stats
+
+    pad = max(0, int(pad))
+    bw = max(1, int(w) + pad)
+    bh = max(1, int(h) + pad)
+    span_w = max_x + bw   # 最右的窗口（含间距）占到 max_x + bw
+    span_h = max_y + bh
+    cols, rows = _jitter_grid_shape(count, span_w, span_h, bw, bh)
+    cells = cols * rows
+    picked = rng.sample(range(cells), min(count, cells))
+    for c in picked:
+        cx, cy = c % cols, c // cols
+        x0, x1 = cx * span_w // cols, (cx + 1) * span_w // cols
+        y0, y1 = cy * span_h // rows, (cy + 1) * span_h // rows
+        x = min(max_x, rng.randint(x0, max(x0, x1 - bw)))
+        y = min(max_y, rng.randint(y0, max(y0, y1 - bh)))
+        chosen.append((x, y))
+    stats["placed"] = len(chosen)
+
+    # 屏幕实在放不下：允许重叠，把还缺的随便拼上去
+    while len(chosen) < count:
+        chosen.append((rng.randint(0, max_x), rng.randint(0, max_y)))
+        stats["fallback"] += 1
+
+    rng.shuffle(chosen)
+    return chosen, stats
+
+def plan_random_windows(conf, sw, sh, rng=random):
+    """窗口模式（随机分支）：预先随机出 RANDOM_WINDOW_COUNT 个位置，返回 (位置, 统计)。"""
+    count = min(int(conf.RANDOM_WINDOW_COUNT), conf.MAX_WINDOWS)
+    return place_random_windows(
+        sw, sh, conf.Kuan_SIZE, conf.DOT_SIZE, conf.MIN_GAP_PX, count,
+        conf.SHOW_BORDER and conf.FORBID_OVERLAP, rng,
+    )
+
+def _is_random_window_segment(conf):
+    return (not conf.PARTICLE) and conf.RANDOM_WINDOW_COUNT > 0
+
+def _segment_line_bands(conf, sw, sh):
+    """不走预处理（plan=None）的旧调用方式用：本段文本在全屏网格上的行带。"""
+    cell = conf.CELL_SIZE
+    return text_line_bands(conf.text, max(1, sw // cell), max(1, sh // cell), conf.GRID_MARGIN, 4)
+
+def iter_segment_plan(conf, sw, sh, rng=random):
+    """
+    plan_segment 的流式版本：先 yield 计划头（mode 等，batches/strokes 为空、complete=False），
+    之后每栅格化并排好一行就 yield 一块 {"points", "batch"[, "strokes"]}，调用方用 merge_plan_part 并进计划头。
+    粒子/窗口两种模式都可以在后面几行还在计算时先播第一行。TWO_LINES_TOGETHER 时整段只有一块。
+    """
+    tr = TRACER
+    plan = {"mode": "particle" if conf.PARTICLE else "window", "grid_points": PointSet(),
+            "batches": [], "complete": False}
+    if _is_random_window_segment(conf):
+        plan["mode"] = "random"
+        tb = tr.begin() if tr is not None else None
+        plan["positions"], plan["placement"] = plan_random_windows(conf, sw, sh, rng)
+        if tr is not None:
+            tr.end("place_random", tb, points=len(plan["positions"]))
+        yield plan
+        return
+    if conf.PARTICLE:
+        plan["strokes"] = []
+    yield plan
+
+    cell = conf.CELL_SIZE
+    grid_w = max(1, sw // cell)
+    grid_h = max(1, sh // cell)
+    lines = iter_text_line_points(conf.text, grid_w, grid_h, margin_cells=conf.GRID_MARGIN, scale=4)
+    if conf.TWO_LINES_TOGETHER:
+        lines = iter([PointSet.concat(list(lines))])
+    placed, k = [], -1
+    while True:
+        k += 1
+        tb = tr.begin() if tr is not None else None
+        pts = next(lines, None)
+        if pts is None:
+            break
+        if not pts:
+            continue
+        if tr is not None:
+            tr.end("rasterize", tb, text=conf.text, grid=f"{grid_w}x{grid_h}", line=k, points=len(pts))
+        tb = tr.begin() if tr is not None else None
+        part = {"points": pts}
+        if conf.PARTICLE:
+            part["batch"] = order_particle_line(conf, pts)
+            part["strokes"] = plan_particle_strokes(conf, part["batch"])
+        else:
+            part["batch"] = place_window_line(conf, pts, placed, conf.MAX_WINDOWS - len(placed))
+            placed.extend(part["batch"])
+        if tr is not None:
+            tr.end("plan_" + plan["mode"], tb, line=k, kept=len(part["batch"]))
+        yield part
+
+def merge_plan_part(plan, part):
+    """把 iter_segment_plan 的一块并进计划头。"""
+    plan["grid_points"] = PointSet.concat([plan["grid_points"], part["points"]])
+    plan["batches"].append(part["batch"])
+    if "strokes" in part:
+        plan["strokes"].append(part["strokes"])
+
+def plan_segment(conf, sw, sh, rng=random):
+    """
+    一段的全部几何准备：栅格化 -> 排序/过滤 -> 连通块（一次算完，见 iter_segment_plan）。
+    返回普通 dict（可跨进程传递）；点阵为空时 grid_points 为空、没有批次。rng 是随机摆放用的随机源。
+    """
+    gen = iter_segment_plan(conf, sw, sh, rng)
+    plan = next(gen)
+    for part in gen:
+        merge_plan_part(plan, part)
+    plan["complete"] = True
+    return plan
+
+
+# ======== 后台预取：当前段播放时准备后面 K 段 ========
+PREFETCH_AHEAD = 2             # 提前准备几段
+PREFETCH_USE_PROCESSES = False # True=进程池（绕开 GIL，但每个进程各自加载字体）；False=线程池
+
+class SegmentPipeline:
+    """
+    用不可变配置快照在线程/进程池里准备各段，结果经 queue 交回 Tk 线程；Tk 线程只做 poll，不等待。
+    线程池时按 iter_segment_plan 逐行交回：第一行排好就能开播，后面的行经 plan["sink"] 送给正在播的段。
+    进程池时整段算完（plan_segment）再交回。
+    """
+    def __init__(self, sequence, sw, sh, ahead=None, use_processes=None):
+        self.confs = [resolve_config(cfg) for cfg in sequence]
+        self.sw, self.sh = sw, sh
+        self.ahead = max(1, int(PREFETCH_AHEAD if ahead is None else ahead))
+        use_processes = PREFETCH_USE_PROCESSES if use_processes is None else use_processes
+        self.streaming = not use_processes
+        if use_processes:
+            # spawn：主进程已经建了 Tk，不能 fork（与字形进程池、窗口分片一致）
+            self._pool = ProcessPoolExecutor(max_workers=self.ahead,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.ahead)
+        self._ready = queue.Queue()
+        self._submitted = set()
+        self._plans = {}
+        self._live = {}   # 已交给播放端、还在逐行补充的计划
+
+    def _stream(self, i):
+        put = self._ready.put
+        try:
+            gen = iter_segment_plan(self.confs[i], self.sw, self.sh)
+            put(("head", i, next(gen)))
+            for part in gen:
+                put(("part", i, part))
+            put(("done", i, None))
+        except Exception as e:
+            put(("error", i, e))
+
+    def prefetch(self, idx):
+        for i in range(idx, min(idx + self.ahead, len(self.confs))):
+            if i in self._submitted:
+                continue
+            self._submitted.add(i)
+            if self.streaming:
+                self._pool.submit(self._stream, i)
+                continue
+            fut = self._pool.submit(plan_segment, self.confs[i], self.sw, self.sh)
+            fut.add_done_callback(lambda f, i=i: self._ready.put(("future", i, f)))
+
+    def poll(self):
+        """把后台交回的计划头/行并进对应计划；已开播的段收到新行时转给它的 plan["sink"]（None 表示结束）。"""
+        while True:
+            try:
+                kind, i, val = self._ready.get_nowait()
+            except queue.Empty:
+                return
+            if kind == "future":
+                try:
+                    self._plans[i] = val.result()
+                except Exception as e:
+                    self._plans[i] = _error_plan(e)
+                continue
+            if kind == "head":
+                self._plans[i] = val
+                continue
+            plan = self._live.get(i) or self._plans.get(i)
+            if kind == "error" and plan is None:
+                self._plans[i] = _error_plan(val)
+                continue
+            if plan is None:
+                continue
+            sink = plan.get("sink")
+            if kind == "part":
+                merge_plan_part(plan, val)
+                if sink is not None:
+                    sink(val)
+                continue
+            if kind == "error":
+                print(f"[段{i}] 后续行预处理失败：{val!r}")
+            plan["complete"] = True
+            self._live.pop(i, None)
+            if sink is not None:
+                sink(None)
+
+    def take(self, idx):
+        """
+        取第 idx 段的计划；还没有可播的内容返回 None。计划出错时返回带 error 的空计划。
+        流式计划在第一行排好后就交出（complete=False），其余行由 poll 追加。
+        """
+        self.prefetch(idx)
+        self.poll()
+        plan = self._plans.get(idx)
+        if plan is None or not (plan["complete"] or plan["batches"]):
+            return None
+        del self._plans[idx]
+        if not plan["complete"]:
+            self._live[idx] = plan
+        return plan
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+def _error_plan(e):
+    return {"mode": "error", "grid_points": [], "batches": [], "complete": True, "error": e}
+
+
+# ======== 火花特效引擎 ========
+SPARK_FRAME_MS = 16   # 火花统一帧间隔（毫秒）
+
+class SparkEngine:
+    """
+    所有火花共用一个定帧回调：状态按列存放（x/y/vx/vy/r/age 各一个列表），
+    画布上的圆从预分配池里取用，寿命到了只隐藏不删除；池满时回收最老的火花。
+    每帧最多推进 pool_size 个火花，耗时记录在 stats 里。
+    """
+    def __init__(self, canvas, color_ref, pool_size, steps, frame_ms=SPARK_FRAME_MS):
+        self.canvas = canvas
+        self.color_ref = color_ref
+        self.steps = max(1, int(steps))
+        self.frame_ms = frame_ms
+        n = max(1, int(pool_size))
+        self.items = [canvas.create_oval(0, 0, 0, 0, outline="", state="hidden") for _ in range(n)]
+        self.x = [0.0] * n; self.y = [0.0] * n
+        self.vx = [0.0] * n; self.vy = [0.0] * n
+        self.r = [0.0] * n; self.age = [0] * n
+        self.fill = [None] * n
+        self.free = list(range(n))
+        self.live = deque()
+        self._job = None
+        self.stats = {"frames": 0, "spawned": 0, "recycled": 0, "peak_live": 0,
+                      "total_ms": 0.0, "max_ms": 0.0}
+
+    def emit(self, cx, cy, count, speed, radius):
+        canvas = self.canvas
+        c = self.color_ref["val"]
+        for _ in range(count):
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = self.live.popleft()   # 池满：回收最老的
+                self.stats["recycled"] += 1
+            angle = random.uniform(0, 2*math.pi)
+            vx = speed * random.uniform(0.6, 1.2) * math.cos(angle)
+            vy = speed * random.uniform(0.6, 1.2) * math.sin(angle)
+            # 与旧实现一致：出生即走第一步
+            x, y = cx + vx, cy + vy
+            r = max(0.5, radius * 0.85)
+            self.x[slot], self.y[slot], self.vx[slot], self.vy[slot] = x, y, vx, vy
+            self.r[slot], self.age[slot], self.fill[slot] = r, 1, c
+            canvas.coords(self.items[slot], x-r, y-r, x+r, y+r)
+            canvas.itemconfig(self.items[slot], fill=c, state="normal")
+            self.live.append(slot)
+        self.stats["spawned"] += count
+        if len(self.live) > self.stats["peak_live"]:
+            self.stats["peak_live"] = len(self.live)
+        if self._job is None and self.live:
+            self._job = canvas.after(self.frame_ms, self._frame)
+
+    def _frame(self):
+        t0 = time.perf_counter()
+        canvas, items, steps = self.canvas, self.items, self.steps
+        X, Y, VX, VY, R, AGE, FILL = self.x, self.y, self.vx, self.vy, self.r, self.age, self.fill
+        c = self.color_ref["val"]
+        still = deque()
+        try:
+            for slot in self.live:
+                if AGE[slot] >= steps:
+                    canvas.itemconfig(items[slot], state="hidden")
+                    self.free.append(slot)
+                    continue
+                x = X[slot] = X[slot] + VX[slot]
+                y = Y[slot] = Y[slot] + VY[slot]
+                r = R[slot] = max(0.5, R[slot] * 0.85)
+                canvas.coords(items[slot], x-r, y-r, x+r, y+r)
+                if FILL[slot] != c:
+                    canvas.itemconfig(items[slot], fill=c)
+                    FILL[slot] = c
+                AGE[slot] += 1
+                still.append(slot)
+        except tk.TclError:
+            self._job = None   # 画布已销毁
+            return
+        self.live = still
+        dt = (time.perf_counter() - t0) * 1000.0
+        st = self.stats
+        st["frames"] += 1
+        st["total_ms"] += dt
+        if dt > st["max_ms"]:
+            st["max_ms"] = dt
+        self._job = canvas.after(self.frame_ms, self._frame) if still else None
+
+    def stop(self):
+        if self._job is not None:
+            try:
+                self.canvas.after_cancel(self._job)
+            except Exception:
+                pass
+            self._job = None
+
+    def report(self):
+        st = self.stats
+        avg = st["total_ms"] / st["frames"] if st["frames"] else 0.0
+        return (f"火花：{st['spawned']} 个，{st['frames']} 帧，平均 {avg:.2f} ms/帧，"
+                f"最长 {st['max_ms']:.2f} ms，峰值 {st['peak_live']}/{len(self.items)}，回收 {st['recycled']}")
+
+
+# ======== 粒子轨迹栅格层 ========
+_IMAGE_TK = None   # 导入过的 PIL.ImageTk；False 表示导入失败
+
+def _load_image_tk():
+    """
+    PIL.ImageTk 只导入一次。没装 Pillow，或者发行版把它拆成单独的包（如 python3-pil.imagetk）又没装时，
+    提示一次并返回 None，轨迹层改为把矢量对象全部留在画布上。
+    """
+    global _IMAGE_TK
+    if _IMAGE_TK is None:
+        try:
+            from PIL import ImageTk
+            _IMAGE_TK = ImageTk
+        except ImportError:
+            _IMAGE_TK = False
+            print("[轨迹] 没有 PIL.ImageTk，轨迹不压进位图，全部留在画布上")
+    return _IMAGE_TK or None
+
+class TrailLayer:
+    """
+    已画完的粒子点和路径线先以矢量对象存在画布上，同时记下绘制指令；
+    矢量对象数超过 max_items 时，把这些指令一次性画进 Pillow 位图（PhotoImage，压在最底层），
+    再删掉矢量对象。这样画布上的存活对象数与文本长短无关，重绘开销不再随进度增长。
+    """
+    def __init__(self, canvas, sw, sh, bg, max_items):
+        self.canvas = canvas
+        self.sw, self.sh = sw, sh
+        self.bg = bg
+        self.max_items = max(1, int(max_items))
+        self.items = []
+        self.ops = []
+        self.image = None
+        self.photo = None
+        self.image_item = None
+        self.flushes = 0
+        self._rgb_cache = {}
+        self.image_tk = _load_image_tk()
+        self.enabled = self.image_tk is not None
+
+    def _rgb(self, color):
+        rgb = self._rgb_cache.get(color)
+        if rgb is None:
+            try:
+                rgb = ImageColor.getrgb(color)[:3]
+            except ValueError:
+                r, g, b = self.canvas.winfo_rgb(color)   # Tk 认识、Pillow 不认识的颜色名
+                rgb = (r >> 8, g >> 8, b >> 8)
+            self._rgb_cache[color] = rgb
+        return rgb
 
-NEIGHBORS_8 = [(-1,-1), (0,-1), (1,-1),
-               (-1, 0),          (1, 0),
-               (-1, 1), (0, 1),  (1, 1)]
+    def add_line(self, item, coords, fill, width, dash=None):
+        self.items.append(item)
+        self.ops.append(("line", coords, fill, width, dash))
+        self._maybe_flush()
 
-def build_components(points):
-    s = set(points)
-    comp_id = {}; comps = []
-    for p in points:
-        if p in comp_id: continue
-        cid = len(comps)
-        queue = deque([p])
-        comp_id[p] = cid
-        comp_pts = [p]
-        while queue:
-            x, y = queue.popleft()
-            for dx, dy in NEIGHBORS_8:
-                q = (x+dx, y+dy)
-                if q in s and q not in comp_id:
-                    comp_id[q] = cid
-                    queue.append(q)
-                    comp_pts.append(q)
-        comps.append(comp_pts)
-    return comp_id, comps, s
+    def add_oval(self, item, bbox, fill):
+        self.items.append(item)
+        self.ops.append(("oval", bbox, fill, 0, None))
+        self._maybe_flush()
 
-def bfs_path(a, b, allowed_set):
-    if a == b: return [a]
-    if a not in allowed_set or b not in allowed_set: return None
-    queue = deque([a]); parent = {a: None}
-    while queue:
-        x, y = queue.popleft()
-        for dx, dy in NEIGHBORS_8:
-            q = (x+dx, y+dy)
-            if q not in allowed_set or q in parent: continue
-            parent[q] = (x, y)
-            if q == b:
-                path = [q]
-                while parent[path[-1]] is not None:
-                    path.append(parent[path[-1]])
-                path.reverse()
-                return path
-            queue.append(q)
-    return None
+    def _maybe_flush(self):
+        if len(self.items) > self.max_items:
+            if self.enabled:
+                self.flush()
+            else:
+                self.items.clear()
+                self.ops.clear()
 
+    def flush(self):
+        if not self.ops or not self.enabled:
+            return
+        if self.image is None:
+            self.image = Image.new("RGB", (self.sw, self.sh), self._rgb(self.bg))
+        draw = ImageDraw.Draw(self.image)
+        for kind, coords, fill, width, dash in self.ops:
+            rgb = self._rgb(fill)
+            if kind == "oval":
+                draw.ellipse(coords, fill=rgb)
+                continue
+            pts = list(zip(coords[0::2], coords[1::2]))
+            if dash:
+                _draw_dashed(draw, pts, rgb, width, dash)
+            else:
+                draw.line(pts, fill=rgb, width=width, joint="curve")
+            if width > 2:   # 模拟 capstyle=ROUND
+                h = width / 2
+                for x, y in (pts[0], pts[-1]):
+                    draw.ellipse((x-h, y-h, x+h, y+h), fill=rgb)
+        if self.photo is None:
+            self.photo = self.image_tk.PhotoImage(self.image)
+            self.image_item = self.canvas.create_image(0, 0, anchor="nw", image=self.photo)
+            self.canvas.tag_lower(self.image_item)
+        else:
+            self.photo.paste(self.image)
+        self.canvas.delete(*self.items)
+        self.items.clear()
+        self.ops.clear()
+        self.flushes += 1
 
-# ======== 统一延时（由配置控制） ========
-def _next_delay_ms():
-    if GEN_INTERVAL_MS <= 0:
-        return 0
-    jitter = random.randint(0, max(0, int(GEN_JITTER_MS)))
-    return max(0, int(GEN_INTERVAL_MS + jitter))
+def _draw_dashed(draw, pts, rgb, width, dash):
+    on, off = max(1, dash[0]), max(0, dash[1] if len(dash) > 1 else dash[0])
+    for (x1, y1), (x2, y2) in zip(pts, pts[1:]):
+        length = math.hypot(x2 - x1, y2 - y1)
+        if length == 0:
+            continue
+        ux, uy = (x2 - x1) / length, (y2 - y1) / length
+        t = 0.0
+        while t < length:
+            e = min(t + on, length)
+            draw.line([(x1 + ux*t, y1 + uy*t), (x1 + ux*e, y1 + uy*e)], fill=rgb, width=width)
+            t = e + off
 
 
 # ======== 粒子模式（支持 on_done 回调） ========
-def run_particle_mode(root, sw, sh, grid_points, on_done=None):
+def run_particle_mode(root, sw, sh, grid_points, on_done=None, plan=None, external_clock=False, conf=None):
+    """
+    粒子模式。返回 SegmentHandle；给了 on_done 时生成完等 HOLD_AFTER_DONE_MS 自行收场再回调，
+    否则由调用方（Timeline）决定何时 teardown。external_clock=True 时生成调度由调用方 pump。
+    conf 为本段的 SegmentConfig；不传时取全局（旧的 apply_config 流程）。
+    """
+    conf = current_config() if conf is None else conf
     stage = tk.Toplevel(root)
     stage.attributes("-topmost", True)
     stage.overrideredirect(True)
     stage.geometry(f"{sw}x{sh}+0+0")
 
     # Windows 透明色；其他平台回退
-    if 'TRANSPARENT_CANVAS' in globals() and TRANSPARENT_CANVAS and os.name == "nt":
-        canvas_bg = TRANSPARENT_COLOR
+    if conf.TRANSPARENT_CANVAS and os.name == "nt":
+        canvas_bg = conf.TRANSPARENT_COLOR
         try:
-            stage.configure(bg=TRANSPARENT_COLOR)
-            stage.wm_attributes("-transparentcolor", TRANSPARENT_COLOR)
+            stage.configure(bg=conf.TRANSPARENT_COLOR)
+            stage.wm_attributes("-transparentcolor", conf.TRANSPARENT_COLOR)
         except tk.TclError:
-            canvas_bg = PARTICLE_BG
+            canvas_bg = conf.PARTICLE_BG
     else:
-        canvas_bg = PARTICLE_BG
+        canvas_bg = conf.PARTICLE_BG
 
     canvas = tk.Canvas(stage, width=sw, height=sh, highlightthickness=0, bg=canvas_bg)
     canvas.pack(fill="both", expand=True)
 
-    current_color = {"val": random.choice(bg_colors)}
+    current_color = {"val": random.choice(conf.bg_colors)}
     def tick_color():
-        current_color["val"] = random.choice(bg_colors)
-        canvas.after(PARTICLE_COLOR_CHANGE_MS, tick_color)
+        current_color["val"] = random.choice(conf.bg_colors)
+        canvas.after(conf.PARTICLE_COLOR_CHANGE_MS, tick_color)
     tick_color()
 
-    line_groups = split_points_into_lines(grid_points)
-
-    def prep_batches_for_grid():
-        batches = []
-        def order_grid(points_group):
-            sp = grid_to_screen(points_group, CELL_SIZE, Kuan_SIZE, DOT_SIZE)
-            mapping = {sp[i]: points_group[i] for i in range(len(points_group))}
-            sp_sorted = sort_points(sp, DISPLAY_ORDER)
-            return [mapping[p] for p in sp_sorted]
-        if TWO_LINES_TOGETHER or len(line_groups) != 2:
-            batches.append(order_grid(grid_points))
-        else:
-            batches.extend([order_grid(line_groups[0]), order_grid(line_groups[1])])
-        return batches
+    if plan is None:
+        lines = split_points_into_lines(grid_points, _segment_line_bands(conf, sw, sh))
+        plan = {"strokes": [plan_particle_strokes(conf, b) for b in plan_particle_batches(conf, grid_points, lines)]}
+    strokes = plan["strokes"]
 
-    batches = prep_batches_for_grid()
-    comp_id_map, comps, allowed_set = build_components(grid_points)
+    sparks = None
+    if conf.PARTICLE_SPARKS and conf.PARTICLE_SPARK_COUNT > 0:
+        sparks = SparkEngine(canvas, current_color, conf.PARTICLE_SPARK_POOL, conf.PARTICLE_SPARK_STEPS)
 
     def spawn_sparks(cx, cy):
-        if not PARTICLE_SPARKS or PARTICLE_SPARK_COUNT <= 0:
-            return
-        for _ in range(PARTICLE_SPARK_COUNT):
-            angle = random.uniform(0, 2*math.pi)
-            vx = PARTICLE_SPARK_SPEED_PX * random.uniform(0.6, 1.2) * math.cos(angle)
-            vy = PARTICLE_SPARK_SPEED_PX * random.uniform(0.6, 1.2) * math.sin(angle)
-            radius = PARTICLE_SPARK_RADIUS
-            item = canvas.create_oval(cx-radius, cy-radius, cx+radius, cy+radius,
-                                      fill=current_color["val"], outline="")
-            def step(i=0, x=cx, y=cy, r=radius, it=item, vx=vx, vy=vy):
-                if i >= PARTICLE_SPARK_STEPS:
-                    try: canvas.delete(it)
-                    except Exception: pass
-                    return
-                x += vx; y += vy
-                nr = max(0.5, r * 0.85)
-                try:
-                    canvas.coords(it, x-nr, y-nr, x+nr, y+nr)
-                    canvas.itemconfig(it, fill=current_color["val"])
-                except Exception:
-                    return
-                canvas.after(16, step, i+1, x, y, nr, it, vx, vy)
-            step()
+        if sparks is not None:
+            load = LOAD
+            n = conf.PARTICLE_SPARK_COUNT if load is None else load.spark_count(conf.PARTICLE_SPARK_COUNT)
+            if n > 0:
+                sparks.emit(cx, cy, n, conf.PARTICLE_SPARK_SPEED_PX, conf.PARTICLE_SPARK_RADIUS)
+
+    # 已提交的点/线超过上限时压进位图层（PARTICLE_MAX_ITEMS<=0 关闭）
+    trail = TrailLayer(canvas, sw, sh, canvas_bg, conf.PARTICLE_MAX_ITEMS) if conf.PARTICLE_MAX_ITEMS > 0 else None
 
-    def draw_segment(p, q):
-        cx1, cy1 = screen_center_from_grid(*p)
-        cx2, cy2 = screen_center_from_grid(*q)
+    def draw_stroke(kind, path, cx, cy):
         c_now = current_color["val"]
-        if comp_id_map.get(p) == comp_id_map.get(q):
-            path = bfs_path(p, q, allowed_set)
-            if path and len(path) >= 2:
-                coords = []
-                for gx, gy in path:
-                    x, y = screen_center_from_grid(gx, gy)
-                    coords.extend([x, y])
-                canvas.create_line(*coords, fill=c_now, width=PARTICLE_LINE_WIDTH, capstyle=tk.ROUND)
-        else:
-            if SHOW_PARTICLE_BRIDGE:
-                kwargs = dict(fill=c_now, width=PARTICLE_BRIDGE_WIDTH, capstyle=tk.ROUND)
-                if PARTICLE_BRIDGE_DASH is not None:
-                    kwargs["dash"] = PARTICLE_BRIDGE_DASH
-                canvas.create_line(cx1, cy1, cx2, cy2, **kwargs)
-        r = PARTICLE_DOT_RADIUS
-        canvas.create_oval(cx2-r, cy2-r, cx2+r, cy2+r, fill=c_now, outline=c_now, width=0)
-        spawn_sparks(cx2, cy2)
+        if trail is not None and LOAD is not None:
+            trail.max_items = LOAD.max_items(conf.PARTICLE_MAX_ITEMS)
+        if kind == STROKE_PATH:
+            it = canvas.create_line(path, fill=c_now, width=conf.PARTICLE_LINE_WIDTH, capstyle=tk.ROUND)
+            if trail is not None:
+                trail.add_line(it, path, c_now, conf.PARTICLE_LINE_WIDTH)
+        elif kind == STROKE_BRIDGE and conf.SHOW_PARTICLE_BRIDGE:
+            kwargs = dict(fill=c_now, width=conf.PARTICLE_BRIDGE_WIDTH, capstyle=tk.ROUND)
+            if conf.PARTICLE_BRIDGE_DASH is not None:
+                kwargs["dash"] = conf.PARTICLE_BRIDGE_DASH
+            it = canvas.create_line(path, **kwargs)
+            if trail is not None:
+                trail.add_line(it, path, c_now, conf.PARTICLE_BRIDGE_WIDTH, conf.PARTICLE_BRIDGE_DASH)
+        r = conf.PARTICLE_DOT_RADIUS
+        it = canvas.create_oval(cx-r, cy-r, cx+r, cy+r, fill=c_now, outline=c_now, width=0)
+        if trail is not None:
+            trail.add_oval(it, (cx-r, cy-r, cx+r, cy+r), c_now)
+        spawn_sparks(cx, cy)
 
-    def finish():
+    def teardown():
+        if sparks is not None:
+            sparks.stop()
+            report_stats("sparks", sparks.report(), sparks.stats)
         try:
             stage.destroy()
         except Exception:
             pass
+
+    def fade(ms):
+        steps = max(1, int(ms) // SPARK_FRAME_MS)
+        def step(i=1):
+            if handle.closed:
+                return
+            try:
+                stage.attributes("-alpha", max(0.0, 1.0 - i / steps))
+            except tk.TclError:
+                return
+            if i < steps:
+                stage.after(SPARK_FRAME_MS, step, i + 1)
+        step()
+
+    handle = SegmentHandle(teardown, fade)
+
+    def finish():
+        handle.teardown()
         if callable(on_done):
             root.after(10, on_done)
 
-    def draw_batches(batch_idx=0, idx=0, last_grid=None):
-        if batch_idx >= len(batches):
-            stage.after(HOLD_AFTER_DONE_MS, finish)
-            return
-        seq = batches[batch_idx]
-        if idx >= len(seq):
-            stage.after(_next_delay_ms(), draw_batches, batch_idx+1, 0, None)
-            return
-        step = 1 if PARTICLE_SINGLE_STEP else max(1, int(PARTICLE_BATCH_SIZE))
-        end = min(idx + step, len(seq))
-        part = seq[idx:end]
-        if last_grid is None and part:
-            gx, gy = part[0]
-            x, y = screen_center_from_grid(gx, gy)
-            c_now = current_color["val"]
-            r = PARTICLE_DOT_RADIUS
-            canvas.create_oval(x-r, y-r, x+r, y+r, fill=c_now, outline=c_now, width=0)
-            spawn_sparks(x, y)
-            last_point = part[0]; items = part[1:]
-        else:
-            last_point = last_grid; items = part
-        for g in items:
-            if last_point is not None:
-                draw_segment(last_point, g)
-            last_point = g
-        canvas.after(_next_delay_ms(), draw_batches, batch_idx, end, last_point)
+    def on_spawned():
+        handle.mark_spawned()
+        if callable(on_done):
+            stage.after(conf.HOLD_AFTER_DONE_MS, finish)
+
+    # 每个生成单元是一批粒子：SINGLE_STEP=1 个，否则 PARTICLE_BATCH_SIZE 个
+    step = 1 if conf.PARTICLE_SINGLE_STEP else max(1, int(conf.PARTICLE_BATCH_SIZE))
 
-    stage.after(_next_delay_ms(), draw_batches)
+    def stroke_units(st):
+        return [(st, i, min(i + step, len(st["centers"]))) for i in range(0, len(st["centers"]), step)]
+
+    def draw_unit(unit):
+        st, start, end = unit
+        centers, kinds, paths = st["centers"], st["kinds"], st["paths"]
+        for i in range(start, end):
+            cx, cy = centers[i]
+            draw_stroke(kinds[i], paths[i], cx, cy)
+
+    handle.alive = lambda: len(canvas.find_all())
+    streaming = not plan.get("complete", True)
+    handle.scheduler = SpawnScheduler(None if external_clock else stage, [stroke_units(st) for st in strokes],
+                                      draw_unit, on_spawned, conf.GEN_INTERVAL_MS, conf.GEN_JITTER_MS,
+                                      label="spawn_particles", streaming=streaming).start()
+    if streaming:
+        # 计划还在逐行补充：后续行的笔画到了就接着排进调度器
+        plan["sink"] = lambda part: (handle.scheduler.close() if part is None
+                                     else handle.scheduler.feed(stroke_units(part["strokes"])))
+    return handle
 
 
 # ======== 窗口模式（支持 on_done 回调） ========
-def run_window_mode(root, sw, sh, grid_points, on_done=None):
+def run_window_mode(root, sw, sh, grid_points, on_done=None, plan=None, pool=None, external_clock=False,
+                    conf=None, shards=None):
     """
     窗口模式：
     - 如果 RANDOM_WINDOW_COUNT > 0：本段改为随机位置弹出 X 个窗口，使用本段大小/颜色/时间配置；
       全部出现后等待 HOLD_AFTER_DONE_MS 并销毁，再进入下一段。
     - 否则：按原点阵/排序/两行顺序逻辑生成。
+    返回值与 on_done / external_clock / conf 的约定同 run_particle_mode。
+    传入 shards（WindowShards）时窗口交给各分片子进程去建，收场时一起收回。
     """
+    conf = current_config() if conf is None else conf
     windows = []
+    seg = shards.begin(conf) if shards is not None else None
 
-    def finish():
-        # 等待 -> 销毁所有窗口 -> 调用下一段
-        def _destroy_all():
+    def teardown():
+        # 销毁所有窗口（有小窗池时只是收回池里）
+        if seg is not None:
+            shards.release(seg)
+        elif pool is not None:
+            pool.release_all(windows)
+        else:
             for w in windows:
                 try:
                     w.destroy()
                 except Exception:
                     pass
-            if callable(on_done):
-                root.after(10, on_done)
-        root.after(HOLD_AFTER_DONE_MS, _destroy_all)
 
-    # ===== 分支 A：随机位置弹出 X 个 =====
-    if isinstance(globals().get("RANDOM_WINDOW_COUNT", 0), int) and RANDOM_WINDOW_COUNT > 0:
-        count = min(int(RANDOM_WINDOW_COUNT), MAX_WINDOWS)
-
-        # 预先随机出不重叠的位置（若开启 FORBID_OVERLAP/MIN_GAP_PX）
-        chosen = []
-        tries = 0
-        max_tries = max(2000, count * 50)
-        while len(chosen) < count and tries < max_tries:
-            tries += 1
-            x = random.randint(0, max(0, sw - Kuan_SIZE))
-            y = random.randint(0, max(0, sh - DOT_SIZE))
-            if SHOW_BORDER and FORBID_OVERLAP:
-                conflict = False
-                for (px, py) in chosen:
-                    if _rects_overlap(x, y, px, py, Kuan_SIZE, DOT_SIZE, MIN_GAP_PX):
-                        conflict = True
-                        break
-                if conflict:
-                    continue
-            chosen.append((x, y))
+    handle = SegmentHandle(teardown)
 
-        # 如果太难找不重叠，就允许少量重叠：把还缺的随便拼上去
-        while len(chosen) < count:
-            x = random.randint(0, max(0, sw - Kuan_SIZE))
-            y = random.randint(0, max(0, sh - DOT_SIZE))
-            chosen.append((x, y))
+    def finish():
+        # 等待 -> 销毁所有窗口 -> 调用下一段
+        handle.mark_spawned()
+        if not callable(on_done):
+            return
+        def _destroy_all():
+            handle.teardown()
+            root.after(10, on_done)
+        root.after(conf.HOLD_AFTER_DONE_MS, _destroy_all)
 
-        random.shuffle(chosen)
+    def spawn_one(pos):
+        if seg is not None:
+            if conf.SHOW_WINDOWS:
+                shards.spawn(seg, pos[0], pos[1])
+            return
+        w = show_warn_tip(pos[0], pos[1], pool, conf)
+        if w is not None:
+            windows.append(w)
 
-        def spawn_random(i=0):
-            if i >= len(chosen):
-                finish()
-                return
-            x, y = chosen[i]
-            w = show_warn_tip(x, y)
-            if w is not None:
-                windows.append(w)
-            root.after(_next_delay_ms(), spawn_random, i + 1)
-
-        root.after(_next_delay_ms(), spawn_random)
-        return  # 这一分支直接返回，等待 finish()
-
-    # ===== 分支 B：按点阵/两行顺序生成（你原来的逻辑） =====
-    line_groups = split_points_into_lines(grid_points)
-
-    def prepare_batches_for_windows():
-        batches = []
-
-        def prep_one(points_group):
-            sp = grid_to_screen(points_group, CELL_SIZE, Kuan_SIZE, DOT_SIZE)
-            sp = sort_points(sp, DISPLAY_ORDER)
-            return sp
-
-        if TWO_LINES_TOGETHER or len(line_groups) != 2:
-            all_sp = prep_one(grid_points)
-            if SHOW_BORDER and FORBID_OVERLAP:
-                all_sp = filter_points_non_overlap(
-                    all_sp, Kuan_SIZE, DOT_SIZE, MIN_GAP_PX, min(MAX_WINDOWS, len(all_sp))
-                )
-            else:
-                all_sp = all_sp[:MAX_WINDOWS]
-            batches.append(all_sp)
+    # ===== 分支 A：随机位置弹出 X 个 =====
+    if _is_random_window_segment(conf):
+        chosen = plan["positions"] if plan is not None else plan_random_windows(conf, sw, sh)[0]
+        batches = [chosen]
+    else:
+        # ===== 分支 B：按点阵/两行顺序生成（你原来的逻辑） =====
+        if plan is not None:
+            batches = plan["batches"]
         else:
-            top_sp = prep_one(line_groups[0])
-            bot_sp = prep_one(line_groups[1])
-            remaining = MAX_WINDOWS
-            if SHOW_BORDER and FORBID_OVERLAP:
-                top_kept = filter_points_non_overlap(
-                    top_sp, Kuan_SIZE, DOT_SIZE, MIN_GAP_PX, min(remaining, len(top_sp))
-                )
-                remaining -= len(top_kept)
-                bot_kept = filter_points_non_overlap_with_base(
-                    bot_sp, top_kept, Kuan_SIZE, DOT_SIZE, MIN_GAP_PX, min(remaining, len(bot_sp))
-                )
-            else:
-                top_kept = top_sp[:remaining]
-                remaining -= len(top_kept)
-                bot_kept = bot_sp[:remaining]
-            batches.extend([top_kept, bot_kept])
-        return batches
+            lines = split_points_into_lines(grid_points, _segment_line_bands(conf, sw, sh))
+            batches = plan_window_batches(conf, grid_points, lines)
+
+    handle.alive = (lambda: shards.alive(seg)) if seg is not None else (lambda: len(windows))
+    streaming = plan is not None and not plan.get("complete", True)
+    handle.scheduler = SpawnScheduler(None if external_clock else root, batches, spawn_one, finish,
+                                      conf.GEN_INTERVAL_MS, conf.GEN_JITTER_MS, label="spawn_windows",
+                                      streaming=streaming).start()
+    if streaming:
+        plan["sink"] = lambda part: (handle.scheduler.close() if part is None
+                                     else handle.scheduler.feed(part["batch"]))
+    return handle
+
+
+# ======== 窗口分片：屏幕分成几条竖带，每条由一个自带 Tk 的子进程弹窗 ========
+# 一个 Tk 解释器只能串行建 Toplevel，窗口再多也快不过一个核。WINDOW_SHARDS>1 时，窗口模式把每个坐标
+# 按 x 交给所在竖带的子进程去建；开播、速率、收场仍由主进程时间线这一个时钟决定，子进程只管建窗/收窗。
+WINDOW_SHARDS = 0        # >1 时启用，建议不超过 CPU 核数
+SHARD_POLL_MS = 4        # 子进程空闲时多久看一次管道（毫秒）
+SHARD_BUDGET_MS = 12     # 子进程每轮最多花多少毫秒建窗，剩下的下一轮接着建
+
+def _shard_main(conn, index):
+    """
+    子进程入口：自己的 tk.Tk 和小窗池。消息：("begin", 段号, 配置) / ("spawn", [(段号, x, y), ...]) /
+    ("release", 段号) / ("quit",)；Tk 建好后回 ("ready", index)，退出前回 ("stats", index, 小窗池统计)。
+    """
+    root = tk.Tk()
+    root.withdraw()
+    pool = WindowPool(root)
+    conn.send(("ready", index))
+    confs, windows, pending = {}, {}, deque()
 
-    batches = prepare_batches_for_windows()
+    def handle(msg):
+        kind = msg[0]
+        if kind == "begin":
+            confs[msg[1]] = msg[2]
+            windows[msg[1]] = []
+        elif kind == "spawn":
+            pending.extend(msg[1])
+        elif kind == "release":
+            pool.release_all(windows.pop(msg[1], []))
+            confs.pop(msg[1], None)   # 还没建的直接作废（tick 里会跳过）
+        elif kind == "quit":
+            return False
+        return True
 
-    def spawn_batches(batch_idx=0, i=0):
-        if batch_idx >= len(batches):
-            finish()
+    def tick():
+        try:
+            while conn.poll():
+                if not handle(conn.recv()):
+                    conn.send(("stats", index, dict(pool.stats)))
+                    root.destroy()
+                    return
+        except (EOFError, OSError):
+            root.destroy()   # 主进程已经没了
             return
-        current = batches[batch_idx]
-        if i >= len(current):
-            root.after(_next_delay_ms(), spawn_batches, batch_idx + 1, 0)
+        deadline = time.perf_counter() + SHARD_BUDGET_MS / 1000.0
+        while pending and time.perf_counter() < deadline:
+            seg, x, y = pending.popleft()
+            if seg in confs:
+                w = show_warn_tip(x, y, pool, confs[seg])
+                if w is not None:
+                    windows[seg].append(w)
+        root.after(1 if pending else SHARD_POLL_MS, tick)
+
+    root.after(0, tick)
+    root.mainloop()
+
+class WindowShards:
+    """
+    主进程这边的分片协调器：坐标按 x 分给各竖带的子进程，同一帧攒成一条消息再发（after_idle 时统一发），
+    收场时同一 tick 向所有分片广播 release。子进程回 ready 之前它那一片先攒着；
+    起不来或中途退出（比如没有显示器）的分片改回主进程的小窗池弹，保证不丢窗口。
+    """
+    def __init__(self, root, sw, n, pool=None):
+        ctx = multiprocessing.get_context("spawn")   # 父进程已经建了 Tk，不能 fork
+        self.root, self.sw, self.n = root, sw, n
+        self.pool = pool
+        self._conns, self._procs = [], []
+        for i in range(n):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_shard_main, args=(child, i), daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        self._dead = [False] * n
+        self._ready = [False] * n
+        self._buf = [[] for _ in range(n)]
+        self._flush_job = None
+        self._confs = {}
+        self._local = {}    # 段号 -> 兜底在主进程建的窗口
+        self._alive = {}    # 段号 -> 已分出去的窗口数
+        self._seg = 0
+        self.stats = {"routed": [0] * n, "messages": 0, "fallback": 0}
+        self.shard_stats = {}
+
+    def _send(self, i, msg):
+        if self._dead[i]:
+            return False
+        try:
+            self._conns[i].send(msg)
+            return True
+        except (OSError, EOFError):
+            self._dead[i] = True
+            print(f"[分片] 子进程 {i} 已退出，这一片改回主进程弹窗")
+            return False
+
+    def _check_ready(self, i):
+        """不阻塞地看子进程是否已经建好 Tk；进程已经退出则标记为失效。"""
+        if self._ready[i] or self._dead[i]:
+            return self._ready[i]
+        try:
+            if self._conns[i].poll():
+                self._ready[i] = self._conns[i].recv()[0] == "ready"
+        except (OSError, EOFError):
+            pass
+        if not self._ready[i] and not self._procs[i].is_alive():
+            self._dead[i] = True
+            print(f"[分片] 子进程 {i} 没能启动，这一片改回主进程弹窗")
+        return self._ready[i]
+
+    def _spawn_local(self, seg, x, y):
+        conf = self._confs.get(seg)
+        if conf is None:
             return
-        x, y = current[i]
-        w = show_warn_tip(x, y)
+        w = show_warn_tip(x, y, self.pool, conf)
         if w is not None:
-            windows.append(w)
-        root.after(_next_delay_ms(), spawn_batches, batch_idx, i + 1)
+            self._local.setdefault(seg, []).append(w)
+        self.stats["fallback"] += 1
+
+    def begin(self, conf):
+        """开始新的一段，返回段号；配置发给所有分片。"""
+        self._seg += 1
+        seg = self._seg
+        self._confs[seg] = conf
+        self._alive[seg] = 0
+        for i in range(self.n):
+            self._send(i, ("begin", seg, conf))
+        return seg
+
+    def spawn(self, seg, x, y):
+        i = min(self.n - 1, max(0, x * self.n // max(1, self.sw)))
+        self._alive[seg] = self._alive.get(seg, 0) + 1
+        if self._dead[i]:
+            self._spawn_local(seg, x, y)
+            return
+        self._buf[i].append((seg, x, y))
+        self.stats["routed"][i] += 1
+        if self._flush_job is None:
+            self._flush_job = self.root.after_idle(self.flush)
+
+    def flush(self):
+        self._flush_job = None
+        waiting = False
+        for i, buf in enumerate(self._buf):
+            if not buf:
+                continue
+            if not self._check_ready(i) and not self._dead[i]:
+                waiting = True   # 还在启动：留到下一轮
+                continue
+            self._buf[i] = []
+            if not self._send(i, ("spawn", buf)):
+                self.stats["routed"][i] -= len(buf)
+                for seg, x, y in buf:
+                    self._spawn_local(seg, x, y)
+            else:
+                self.stats["messages"] += 1
+        if waiting:
+            self._flush_job = self.root.after(SHARD_POLL_MS, self.flush)
+
+    def alive(self, seg):
+        return self._alive.get(seg, 0)
+
+    def release(self, seg):
+        """收场：没发出去的先发掉，再同时通知所有分片收回这一段的窗口。"""
+        if self._flush_job is not None:
+            try:
+                self.root.after_cancel(self._flush_job)
+            except Exception:
+                pass
+        self.flush()
+        self._buf = [[p for p in buf if p[0] != seg] for buf in self._buf]   # 还没启动好的分片上积压的作废
+        for i in range(self.n):
+            self._send(i, ("release", seg))
+        local = self._local.pop(seg, [])
+        if local and self.pool is not None:
+            self.pool.release_all(local)
+        self._confs.pop(seg, None)
+        self._alive.pop(seg, None)
 
-    root.after(_next_delay_ms(), spawn_batches)
+    def close(self, timeout=2.0):
+        for i in range(self.n):
+            self._send(i, ("quit",))
+        for i, (conn, proc) in enumerate(zip(self._conns, self._procs)):
+            try:
+                while not self._dead[i] and conn.poll(timeout):
+                    msg = conn.recv()
+                    if msg[0] == "stats":
+                        self.shard_stats[msg[1]] = msg[2]
+                        break
+            except (OSError, EOFError):
+                pass
+            conn.close()
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
 
+    def report(self):
+        created = sum(st["created"] for st in self.shard_stats.values())
+        reused = sum(st["reused"] for st in self.shard_stats.values())
+        routed = "/".join(str(n) for n in self.stats["routed"])
+        return (f"窗口分片：{self.n} 个进程，各分到 {routed} 个，子进程新建 {created}、复用 {reused}，"
+                f"主进程兜底 {self.stats['fallback']} 个")
 
 
 # ======== 配置：序列与应用 ========
@@ -642,7 +3050,10 @@ def default_base_config():
 
         # 扩散火花（粒子）
         PARTICLE_SPARKS=True, PARTICLE_SPARK_COUNT=3, PARTICLE_SPARK_STEPS=10,
-        PARTICLE_SPARK_SPEED_PX=2.0, PARTICLE_SPARK_RADIUS=3,
+        PARTICLE_SPARK_SPEED_PX=2.0, PARTICLE_SPARK_RADIUS=3, PARTICLE_SPARK_POOL=600,
+
+        # 轨迹栅格层（粒子）
+        PARTICLE_MAX_ITEMS=4000,
 
         # 文本与配色
         text="",
@@ -659,21 +3070,135 @@ def default_base_config():
     )
 
 
+DISPLAY_ORDERS = (0, 1, 2, 3, 4, 5, 6)   # 0左→右 1右→左 2上→下 3下→上 4中心→外 5希尔伯特曲线 6最近邻巡游
+
+# dataclass 的 slots= 要 Python 3.10；3.9 上照样只读，只是不带 __slots__
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(frozen=True, **_DATACLASS_SLOTS)
+class SegmentConfig:
+    """
+    一段的完整配置（只读；Python 3.10 起带 __slots__）。字段与 default_base_config() 的键一一对应，
+    用 SegmentConfig.from_dict(cfg) 合并默认值、处理联动并校验。
+    显式传给 plan_segment / run_*_mode / show_warn_tip，不经过模块全局，
+    所以可以在后台线程或进程里同时准备多段。
+    """
+    CELL_SIZE: int
+    Kuan_SIZE: int
+    DOT_SIZE: int
+    GRID_MARGIN: int
+    MAX_WINDOWS: int
+    SHOW_WINDOWS: bool
+    SHOW_BORDER: bool
+    Display_text: bool
+    Custom_colors: bool
+    FORBID_OVERLAP: bool
+    MIN_GAP_PX: int
+    DISPLAY_ORDER: int
+    TWO_LINES_TOGETHER: bool
+    GEN_INTERVAL_MS: float
+    GEN_JITTER_MS: float
+    HOLD_AFTER_DONE_MS: int
+    RANDOM_WINDOW_COUNT: int
+    PARTICLE: bool
+    PARTICLE_SINGLE_STEP: bool
+    PARTICLE_BATCH_SIZE: int
+    PARTICLE_DOT_RADIUS: float
+    PARTICLE_LINE_WIDTH: int
+    PARTICLE_COLOR_CHANGE_MS: int
+    PARTICLE_BG: str
+    TRANSPARENT_CANVAS: bool
+    TRANSPARENT_COLOR: str
+    SHOW_PARTICLE_BRIDGE: bool
+    PARTICLE_BRIDGE_DASH: object
+    PARTICLE_BRIDGE_WIDTH: int
+    PARTICLE_SPARKS: bool
+    PARTICLE_SPARK_COUNT: int
+    PARTICLE_SPARK_STEPS: int
+    PARTICLE_SPARK_SPEED_PX: float
+    PARTICLE_SPARK_RADIUS: float
+    PARTICLE_SPARK_POOL: int
+    PARTICLE_MAX_ITEMS: int
+    text: str
+    tips: tuple
+    bg_colors: tuple
+    BG_COLOR: str
+    DOT_COLORS: tuple
+
+    def __post_init__(self):
+        def bad(name, why):
+            raise ValueError(f"配置项 {name}={getattr(self, name)!r} 无效：{why}")
+        for name in ("CELL_SIZE", "Kuan_SIZE", "DOT_SIZE", "PARTICLE_BATCH_SIZE",
+                     "PARTICLE_COLOR_CHANGE_MS", "PARTICLE_SPARK_STEPS", "PARTICLE_SPARK_POOL"):
+            v = getattr(self, name)
+            if not isinstance(v, int) or isinstance(v, bool) or v <= 0:
+                bad(name, "应为正整数")
+        for name in ("GRID_MARGIN", "MAX_WINDOWS", "MIN_GAP_PX", "HOLD_AFTER_DONE_MS",
+                     "RANDOM_WINDOW_COUNT", "PARTICLE_SPARK_COUNT", "PARTICLE_MAX_ITEMS"):
+            v = getattr(self, name)
+            if not isinstance(v, int) or isinstance(v, bool) or v < 0:
+                bad(name, "应为非负整数")
+        for name in ("GEN_INTERVAL_MS", "GEN_JITTER_MS", "PARTICLE_DOT_RADIUS",
+                     "PARTICLE_SPARK_SPEED_PX", "PARTICLE_SPARK_RADIUS"):
+            if not isinstance(getattr(self, name), (int, float)):
+                bad(name, "应为数字")
+        if self.GEN_JITTER_MS < 0:
+            bad("GEN_JITTER_MS", "不能为负")
+        if self.DISPLAY_ORDER not in DISPLAY_ORDERS:
+            bad("DISPLAY_ORDER", f"可选值 {DISPLAY_ORDERS}")
+        if not isinstance(self.text, str):
+            bad("text", "应为字符串")
+        if not self.tips:
+            bad("tips", "至少要有一条")
+        if not self.bg_colors:
+            bad("bg_colors", "至少要有一种颜色")
+        if self.PARTICLE_BRIDGE_DASH is not None and len(self.PARTICLE_BRIDGE_DASH) < 2:
+            bad("PARTICLE_BRIDGE_DASH", "应为 (线段长度, 空段长度) 或 None")
+
+    @classmethod
+    def from_dict(cls, cfg):
+        """合并默认值并处理联动（Display_text / Custom_colors），未知键直接报错（多半是拼错）。"""
+        base = default_base_config()
+        unknown = set(cfg or {}) - set(base)
+        if unknown:
+            raise ValueError(f"未知配置项：{', '.join(sorted(unknown))}")
+        base.update(cfg or {})
+        if not base["Display_text"]:
+            base["tips"] = ['']
+        if not base["Custom_colors"]:
+            base["bg_colors"] = [
+                'lightpink','skyblue','lightgreen','lavender','lightyellow','plum','coral','bisque',
+                'aquamarine','mistyrose','honeydew','peachpuff','paleturquoise','lavenderblush',
+                'oldlace','lemonchiffon','lightcyan','lightgray','lightpink','lightsalmon',
+                'lightseagreen','lightskyblue','lightslategray','lightsteelblue','lightyellow'
+            ]
+        for key in ("tips", "bg_colors", "DOT_COLORS"):
+            base[key] = tuple(base[key])
+        if base["PARTICLE_BRIDGE_DASH"] is not None:
+            base["PARTICLE_BRIDGE_DASH"] = tuple(base["PARTICLE_BRIDGE_DASH"])
+        return cls(**base)
+
+    def as_dict(self):
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def replace(self, **changes):
+        """返回改了若干字段的新配置（同样会校验）。"""
+        return _replace_fields(self, **changes)
+
+def resolve_config(cfg):
+    """合并默认值、处理联动并校验，返回只读的 SegmentConfig（不写全局，可安全交给后台线程）。"""
+    if isinstance(cfg, SegmentConfig):
+        return cfg
+    return SegmentConfig.from_dict(cfg)
+
 def apply_config(cfg):
-    """把一段 cfg 应用到全局，并处理联动。"""
-    base = default_base_config()
-    base.update(cfg or {})
-    # 联动：Display_text / Custom_colors
-    if not base["Display_text"]:
-        base["tips"] = ['']
-    if not base["Custom_colors"]:
-        base["bg_colors"] = [
-            'lightpink','skyblue','lightgreen','lavender','lightyellow','plum','coral','bisque',
-            'aquamarine','mistyrose','honeydew','peachpuff','paleturquoise','lavenderblush',
-            'oldlace','lemonchiffon','lightcyan','lightgray','lightpink','lightsalmon',
-            'lightseagreen','lightskyblue','lightslategray','lightsteelblue','lightyellow'
-        ]
-    globals().update(base)
+    """兼容旧流程：把一段 cfg 应用到模块全局。播放主流程已改为显式传 SegmentConfig，不再依赖全局。"""
+    globals().update(resolve_config(cfg).as_dict())
+
+def current_config():
+    """当前全局配置的快照（兼容旧的 apply_config 流程）；还没 apply_config 过的键取默认值。"""
+    g = globals()
+    return SegmentConfig.from_dict({k: g[k] for k in default_base_config() if k in g})
 
 def get_config_sequence():
     global CELL_SIZE,SHOW_BORDER,Kuan_SIZE,SHOW_WINDOWS,bg_colors,tips,DOT_SIZE,PARTICLE,HOLD_AFTER_DONE_MS,MAX_WINDOWS,FORBID_OVERLAP,MIN_GAP_PX,TWO_LINES_TOGETHER,DISPLAY_ORDER
@@ -698,8 +3223,8 @@ def get_config_sequence():
         FORBID_OVERLAP=True,     # 禁止窗口重叠/“相碰”
         MIN_GAP_PX=0,            # 窗口之间最小间距（像素），FORBID_OVERLAP=True 时有效
 
-        DISPLAY_ORDER=1,         # 生成顺序：0左→右 1右→左 2上→下 3下→上 4中心→外
-        TWO_LINES_TOGETHER=False,# 两行是否一起生成：True一起；False先上行后下行
+        DISPLAY_ORDER=1,         # 生成顺序：0左→右 1右→左 2上→下 3下→上 4中心→外 5希尔伯特曲线 6最近邻巡游（粒子连线最短）
+        TWO_LINES_TOGETHER=False,# 多行是否一起生成：True一起；False逐行从上到下（先算好的行先播）
 
         # ======== 生成速度 & 完成后等待（两种模式通用） ========
         GEN_INTERVAL_MS=1,       # 基础生成间隔（毫秒），越小越快；0≈几乎瞬间
@@ -730,6 +3255,10 @@ def get_config_sequence():
         PARTICLE_SPARK_STEPS=10,  # 火花寿命（步数/帧数）
         PARTICLE_SPARK_SPEED_PX=2.0,# 火花每步外扩像素
         PARTICLE_SPARK_RADIUS=3,  # 火花初始半径（逐帧衰减）
+        PARTICLE_SPARK_POOL=600,  # 同时存活的火花上限（画布对象预分配、循环复用）
+
+        # 轨迹栅格层：已画完的点/线超过这个数量就压成一张位图，画布对象数不再随文本变长而增长
+        PARTICLE_MAX_ITEMS=4000,  # 画布上矢量点/线的上限；0=关闭（全部保留为矢量对象）
 
         # ======== 文本与配色 ========
         text="文字",            # 要渲染的文本（支持换行、符号、emoji 等）
@@ -944,53 +3473,899 @@ def get_config_sequence():
     return seq
 
 
-# ========== 主流程：依次播放多段 ==========
-def main():
-    root = tk.Tk()
-    root.withdraw()
-    sw = root.winfo_screenwidth()
-    sh = root.winfo_screenheight()
+# ======== 时间线：整套序列共用一个单调时钟 ========
+TIMELINE_FRAME_MS = 16   # 时间线 tick 间隔（毫秒）
 
-    sequence = get_config_sequence()
+def estimate_spawn_ms(plan, conf):
+    """按配置速率估算一段的生成耗时（毫秒）；不限速（GEN_INTERVAL_MS<=0）时记为 0。"""
+    interval = conf.GEN_INTERVAL_MS
+    if interval <= 0:
+        return 0.0
+    per = interval + max(0, conf.GEN_JITTER_MS) / 2.0
+    if plan["mode"] == "random":
+        units, nb = len(plan["positions"]), 1
+    elif plan["mode"] == "particle":
+        step = 1 if conf.PARTICLE_SINGLE_STEP else max(1, int(conf.PARTICLE_BATCH_SIZE))
+        units = sum(-(-len(st["centers"]) // step) for st in plan["strokes"])
+        nb = len(plan["strokes"])
+    else:
+        units, nb = sum(len(b) for b in plan["batches"]), len(plan["batches"])
+    return per * (units + nb)   # 开头与批间各多一个间隔
 
-    def run_step(idx=0):
-        if idx >= len(sequence):
-            try:
-                root.destroy()
-            except Exception:
-                pass
+class Timeline:
+    """
+    把 get_config_sequence() 编排成绝对时间上的事件，由一个单调时钟 tick 驱动：
+    第 k 段计划开始时刻 = 第 k-1 段计划结束时刻 - crossfade_ms，
+    计划结束时刻 = 计划开始 + 估算生成耗时 + HOLD_AFTER_DONE_MS。
+    每段的生成调度也由这个 tick 推进；收场时刻取 max(计划结束, 实际生成完 + HOLD)，
+    所以主线程卡顿只体现为该段的偏差，不会累积到后面的计划时刻里。
+    crossfade_ms>0 时下一段与上一段的停留期重叠开始，粒子舞台在重叠期内淡出。
+    流式计划（第一行先开播）的计划结束时刻先按已到的行估算，整段算完后再修正。
+    """
+    def __init__(self, root, sw, sh, sequence, pipeline, pool=None,
+                 start_at=0, end_at=None, crossfade_ms=0, on_finish=None, shards=None):
+        self.root, self.sw, self.sh = root, sw, sh
+        self.sequence = sequence
+        self.pipeline = pipeline
+        self.pool = pool
+        self.shards = shards
+        last = len(sequence) - 1 if end_at is None else min(int(end_at), len(sequence) - 1)
+        self.order = list(range(max(0, int(start_at)), last + 1))
+        self.crossfade_ms = max(0, int(crossfade_ms))
+        self.on_finish = on_finish
+        self.k = 0
+        self.next_start = 0.0
+        self.running = []
+        self.report = []
+        self.t0 = None
+        self._first_plan = None
+        self._last_tick = None
+        self._due_ms = None   # 下一次 tick 按计划该在什么时刻跑（排 after 时记下）
+
+    def now(self):
+        return time.perf_counter() * 1000.0 - self.t0
+
+    def start(self):
+        if not self.order:
+            self._tick_t0()
             return
+        self.pipeline.prefetch(self.order[0])
+        self._wait_first()
 
-        # 应用当前段配置
-        apply_config(sequence[idx])
+    def _wait_first(self):
+        # 时钟从第一段真正能开播时起算（首段的栅格化不计入偏差）
+        plan = self.pipeline.take(self.order[0])
+        if plan is None:
+            self.root.after(TIMELINE_FRAME_MS, self._wait_first)
+            return
+        self._first_plan = plan
+        self._tick_t0()
+
+    def _tick_t0(self):
+        self.t0 = time.perf_counter() * 1000.0
+        self._tick()
+
+    def _tick(self):
+        now = self.now()
+        load = LOAD
+        if load is not None and self._due_ms is not None:
+            # after() 回调相对计划时刻的迟到量就是事件循环延迟（不含 tick 自己的生成耗时）
+            load.sample(now - self._due_ms, now)
+        tr = TRACER
+        if tr is not None:
+            # 两次 tick 之间超出帧间隔的部分 ≈ Tk 重绘与其它事件处理占掉的时间
+            t_tick = tr.begin()
+            if self._last_tick is not None:
+                tr.counter("tick_gap_ms", over=round((t_tick - self._last_tick) * 1000.0 - TIMELINE_FRAME_MS, 2))
+            self._last_tick = t_tick
+        self.pipeline.poll()
+        # 1) 推进各段的生成，到点的收场
+        for seg in list(self.running):
+            if seg["streaming"] and seg["plan"]["complete"]:
+                self._replan(seg)
+            h = seg["handle"]
+            if h.scheduler is not None:
+                h.scheduler.pump()
+            if h.spawned_at is None:
+                continue
+            end_at = max(seg["rec"]["sched_end"], h.spawned_at - self.t0 + seg["hold"])
+            if self.crossfade_ms and not seg["fading"] and now >= end_at - self.crossfade_ms:
+                h.fade(self.crossfade_ms)
+                seg["fading"] = True
+            if now >= end_at:
+                tb = tr.begin() if tr is not None else None
+                h.teardown()
+                seg["rec"]["end"] = self.now()
+                self.running.remove(seg)
+                if tr is not None:
+                    rec = seg["rec"]
+                    tr.end("teardown", tb)
+                    tr.end(f"段{rec['segment']}", seg["t_trace"], cat="segment", mode=seg["mode"],
+                           start_drift_ms=round(rec["start"] - rec["sched_start"], 1),
+                           end_drift_ms=round(rec["end"] - rec["sched_end"], 1),
+                           max_spawn_lag_ms=round(h.scheduler.stats["max_lag_ms"], 1) if h.scheduler else 0,
+                           mem_peak_kb=tr.memory_peak_kb())
+        # 2) 到点开始下一段（不重叠时要等上一段收场）
+        streaming = any(seg["streaming"] for seg in self.running)
+        if (self.k < len(self.order) and now >= self.next_start and not streaming
+                and not (self.running and not self.crossfade_ms)):
+            idx = self.order[self.k]
+            plan, self._first_plan = self._first_plan, None
+            if plan is None:
+                plan = self.pipeline.take(idx)
+            if plan is not None:
+                self.k += 1
+                self._start_segment(idx, plan, now)
+                if self.k < len(self.order):
+                    self.pipeline.prefetch(self.order[self.k])
+        if tr is not None:
+            if self.running:
+                tr.counter("alive", **{f"段{seg['rec']['segment']}": seg["handle"].alive() for seg in self.running})
+            tr.end("tick", t_tick, cat="timeline")
+        # 3) 全部结束
+        if self.k >= len(self.order) and not self.running:
+            self.print_report()
+            if callable(self.on_finish):
+                self.on_finish()
+            return
+        self._due_ms = self.now() + TIMELINE_FRAME_MS
+        self.root.after(TIMELINE_FRAME_MS, self._tick)
 
+    def _start_segment(self, idx, plan, now):
+        # 本段配置显式传给 run_*（不再写模块全局）
+        conf = self.pipeline.confs[idx]
+        rec = {"segment": idx, "sched_start": self.next_start, "start": now, "sched_end": None, "end": None}
+        self.report.append(rec)
+
+        if plan["mode"] == "error":
+            print(f"[段{idx}] 预处理失败：{plan['error']!r}。跳过。")
+            rec["sched_end"] = rec["end"] = now
+            return
         # === 是否需要点阵 ===
         # 1) 粒子模式一定需要点阵
         # 2) 窗口模式但 RANDOM_WINDOW_COUNT <= 0 也需要点阵
         # 3) 窗口模式且 RANDOM_WINDOW_COUNT > 0 则不需要点阵（走随机弹窗分支）
-        need_grid = PARTICLE or (globals().get("RANDOM_WINDOW_COUNT", 0) <= 0)
-
-        pts = []
-        if need_grid:
-            grid_w = max(1, sw // CELL_SIZE)
-            grid_h = max(1, sh // CELL_SIZE)
-            pts = text_to_grid_points(text, grid_w, grid_h, margin_cells=GRID_MARGIN, scale=4)
-            if not pts:
-                print(f"[段{idx}] 网格过小或渲染失败，未生成点阵。跳过。")
-                root.after(10, run_step, idx + 1)
-                return
+        pts = plan["grid_points"]
+        if plan["mode"] != "random" and not pts:
+            print(f"[段{idx}] 网格过小或渲染失败，未生成点阵。跳过。")
+            rec["sched_end"] = rec["end"] = now
+            return
+        if plan["mode"] == "random":
+            st = plan["placement"]
+            if st["fallback"]:
+                print(f"[段{idx}] 随机弹窗：{st['placed']} 个满足不重叠，{st['fallback']} 个放不下改为允许重叠。")
+
+        hold = conf.HOLD_AFTER_DONE_MS
+        rec["sched_end"] = rec["sched_start"] + estimate_spawn_ms(plan, conf) + hold
+        self.next_start = rec["sched_end"] - self.crossfade_ms
 
         # === 根据模式运行 ===
-        if PARTICLE:
-            run_particle_mode(root, sw, sh, pts, on_done=lambda: run_step(idx + 1))
+        tr = TRACER
+        t_seg = tr.begin() if tr is not None else None
+        if plan["mode"] == "particle":
+            handle = run_particle_mode(self.root, self.sw, self.sh, pts, plan=plan, external_clock=True,
+                                       conf=conf)
         else:
             # run_window_mode 内部已支持 RANDOM_WINDOW_COUNT>0 的随机弹窗逻辑
-            run_window_mode(root, sw, sh, pts, on_done=lambda: run_step(idx + 1))
+            handle = run_window_mode(self.root, self.sw, self.sh, pts, plan=plan, pool=self.pool,
+                                     external_clock=True, conf=conf, shards=self.shards)
+        if tr is not None:
+            tr.end("stage_" + plan["mode"], t_seg)
+        self.running.append({"handle": handle, "rec": rec, "hold": hold, "fading": False,
+                             "mode": plan["mode"], "t_trace": t_seg, "plan": plan, "conf": conf,
+                             "streaming": not plan["complete"]})
+
+    def _replan(self, seg):
+        # 流式计划补齐了：按完整计划重估本段结束时刻，下一段的开始时刻跟着挪
+        seg["streaming"] = False
+        rec = seg["rec"]
+        rec["sched_end"] = rec["sched_start"] + estimate_spawn_ms(seg["plan"], seg["conf"]) + seg["hold"]
+        if rec is self.report[-1]:
+            self.next_start = rec["sched_end"] - self.crossfade_ms
+
+    def print_report(self):
+        de = 0.0
+        for rec in self.report:
+            ds = rec["start"] - rec["sched_start"]
+            de = (rec["end"] or rec["start"]) - rec["sched_end"]
+            report_stats("timeline_segment", f"[时间线] 段{rec['segment']}：开始偏差 {ds:+.0f} ms，结束偏差 {de:+.0f} ms",
+                         {"segment": rec["segment"], "start_drift_ms": round(ds, 1), "end_drift_ms": round(de, 1)})
+        if self.report:
+            # 最后一段的结束偏差就是整场相对计划丢掉（或多出）的时间
+            report_stats("timeline", f"[时间线] 全程累计偏差 {de:+.0f} ms", {"drift_ms": round(de, 1)})
+
+
+# ======== 离线渲染（无 Tk）：导出 PNG 帧序列 / GIF ========
+HEADLESS_DESKTOP = "#1e1e1e"   # 离线渲染时代替桌面的底色（透明画布、窗口模式都画在它上面）
+
+def _spawn_times(lengths, interval_ms, jitter_ms, rng, t0=0.0):
+    """与 SpawnScheduler 相同的时间表：开头与批间各多一个间隔；返回每批每个条目的时刻列表。"""
+    def gap():
+        if interval_ms <= 0:
+            return 0.0
+        return interval_ms + (rng.uniform(0, jitter_ms) if jitter_ms > 0 else 0.0)
+    t = t0 + gap()
+    out = []
+    for bi, n in enumerate(lengths):
+        if bi:
+            t += gap()
+        times = []
+        for _ in range(n):
+            times.append(t)
+            t += gap()
+        out.append(times)
+    return out, t
+
+def build_render_script(sequence, sw, sh, seed=0, start_at=0, end_at=None):
+    """
+    复用 plan_segment（栅格化、排序、不重叠过滤、粒子笔画遍历）把序列编成带时刻的绘制指令。
+    所有随机数都来自由 seed 派生的独立随机源，同一 seed 得到逐像素相同的输出。
+    """
+    last = len(sequence) - 1 if end_at is None else min(int(end_at), len(sequence) - 1)
+    segments = []
+    t = 0.0
+    for idx in range(max(0, int(start_at)), last + 1):
+        conf = resolve_config(sequence[idx])
+        plan = plan_segment(conf, sw, sh, rng=random.Random(f"{seed}:{idx}:plan"))
+        if plan["mode"] != "random" and not plan["grid_points"]:
+            continue
+        rng = random.Random(f"{seed}:{idx}:render")
+        seg = {"segment": idx, "seed": seed, "start": t, "mode": plan["mode"], "ops": [],
+               "colors": list(conf.bg_colors), "color_ms": max(1, conf.PARTICLE_COLOR_CHANGE_MS),
+               "births": [], "sparks": [], "spark_steps": conf.PARTICLE_SPARK_STEPS,
+               "spark_radius": conf.PARTICLE_SPARK_RADIUS}
+        interval, jitter = conf.GEN_INTERVAL_MS, conf.GEN_JITTER_MS
+        ops = seg["ops"]
+        if plan["mode"] == "particle":
+            seg["bg"] = None if conf.TRANSPARENT_CANVAS else conf.PARTICLE_BG
+            step = 1 if conf.PARTICLE_SINGLE_STEP else max(1, int(conf.PARTICLE_BATCH_SIZE))
+            strokes = plan["strokes"]
+            lengths = [-(-len(st["centers"]) // step) for st in strokes]
+            times, t_end = _spawn_times(lengths, interval, jitter, rng, t)
+            r = conf.PARTICLE_DOT_RADIUS
+            sparks_on = conf.PARTICLE_SPARKS and conf.PARTICLE_SPARK_COUNT > 0
+            speed = conf.PARTICLE_SPARK_SPEED_PX
+            for st, unit_times in zip(strokes, times):
+                for u, tu in enumerate(unit_times):
+                    for i in range(u * step, min((u + 1) * step, len(st["centers"]))):
+                        cx, cy = st["centers"][i]
+                        kind, path = st["kinds"][i], st["paths"][i]
+                        if kind == STROKE_PATH:
+                            ops.append((tu, "line", path, conf.PARTICLE_LINE_WIDTH, None))
+                        elif kind == STROKE_BRIDGE and conf.SHOW_PARTICLE_BRIDGE:
+                            ops.append((tu, "line", path, conf.PARTICLE_BRIDGE_WIDTH, conf.PARTICLE_BRIDGE_DASH))
+                        ops.append((tu, "dot", (cx-r, cy-r, cx+r, cy+r), 0, None))
+                        if sparks_on:
+                            for _ in range(conf.PARTICLE_SPARK_COUNT):
+                                angle = rng.uniform(0, 2*math.pi)
+                                vx = speed * rng.uniform(0.6, 1.2) * math.cos(angle)
+                                vy = speed * rng.uniform(0.6, 1.2) * math.sin(angle)
+                                seg["births"].append(tu)
+                                seg["sparks"].append((cx, cy, vx, vy))
+        else:
+            seg["bg"] = None
+            batches = [plan["positions"]] if plan["mode"] == "random" else plan["batches"]
+            times, t_end = _spawn_times([len(b) for b in batches], interval, jitter, rng, t)
+            kw, dh = conf.Kuan_SIZE, conf.DOT_SIZE
+            for batch, batch_times in zip(batches, times):
+                for (x, y), tu in zip(batch, batch_times):
+                    if conf.SHOW_WINDOWS:
+                        ops.append((tu, "window", (x, y, kw, dh), rng.choice(conf.bg_colors),
+                                    (rng.choice(conf.tips), conf.SHOW_BORDER)))
+        seg["end"] = t_end + conf.HOLD_AFTER_DONE_MS
+        segments.append(seg)
+        t = seg["end"]
+    return {"size": (sw, sh), "duration": t, "segments": segments}
+
+class _SegmentLayer:
+    """某一段的持久图层：指令按时间顺序增量画上去，帧与帧之间只补新增的部分。"""
+    def __init__(self, seg, size, tip_font):
+        self.seg = seg
+        bg = seg["bg"]
+        self.image = Image.new("RGBA", size, ImageColor.getrgb(bg) + (255,) if bg else (0, 0, 0, 0))
+        self.draw = ImageDraw.Draw(self.image)
+        self.next_op = 0
+        self.tip_font = tip_font
+        self._colors = {}
+
+    def color_at(self, t):
+        seg = self.seg
+        slot = int((t - seg["start"]) // seg["color_ms"])
+        c = self._colors.get(slot)
+        if c is None:
+            c = random.Random(f"{seg['seed']}:{seg['segment']}:color:{slot}").choice(seg["colors"])
+            c = self._colors[slot] = ImageColor.getrgb(c)[:3] + (255,)
+        return c
+
+    def advance(self, t):
+        ops, draw = self.seg["ops"], self.draw
+        while self.next_op < len(ops) and ops[self.next_op][0] <= t:
+            tu, kind, geom, a, b = ops[self.next_op]
+            self.next_op += 1
+            if kind == "dot":
+                draw.ellipse(geom, fill=self.color_at(tu))
+            elif kind == "line":
+                rgb = self.color_at(tu)
+                pts = list(zip(geom[0::2], geom[1::2]))
+                if b:
+                    _draw_dashed(draw, pts, rgb, a, b)
+                else:
+                    draw.line(pts, fill=rgb, width=a, joint="curve")
+            elif kind == "window":
+                x, y, w, h = geom
+                tip, border = b
+                rgb = ImageColor.getrgb(a)[:3] + (255,)
+                draw.rectangle((x, y, x + w - 1, y + h - 1), fill=rgb,
+                               outline=(60, 60, 60, 255) if border else None)
+                if tip and self.tip_font is not None:
+                    tb = draw.textbbox((0, 0), tip, font=self.tip_font)
+                    tx = x + (w - (tb[2] - tb[0])) // 2 - tb[0]
+                    ty = y + (h - (tb[3] - tb[1])) // 2 - tb[1]
+                    win = self.image.crop((x, y, x + w, y + h))
+                    ImageDraw.Draw(win).text((tx - x, ty - y), tip, fill=(0, 0, 0, 255), font=self.tip_font)
+                    self.image.paste(win, (x, y))
+
+    def draw_sparks(self, frame_draw, t):
+        seg = self.seg
+        births = seg["births"]
+        if not births:
+            return
+        life = seg["spark_steps"] * SPARK_FRAME_MS
+        lo = bisect.bisect_right(births, t - life)
+        hi = bisect.bisect_right(births, t)
+        c = self.color_at(t)
+        r0 = seg["spark_radius"]
+        for i in range(lo, hi):
+            cx, cy, vx, vy = seg["sparks"][i]
+            k = int((t - births[i]) // SPARK_FRAME_MS) + 1
+            x, y = cx + vx * k, cy + vy * k
+            r = max(0.5, r0 * 0.85 ** k)
+            frame_draw.ellipse((x - r, y - r, x + r, y + r), fill=c)
+
+def _render_frame_chunk(script, frame_ids, fps, out_dir, scale):
+    """渲染一段连续帧并写成 PNG；在进程池里并行跑，每个进程只处理自己那一段帧。"""
+    size = tuple(script["size"])
+    desktop = ImageColor.getrgb(HEADLESS_DESKTOP)[:3] + (255,)
+    path = primary_font_path()
+    tip_font = _load_font(path, 14) if path else ImageFont.load_default()
+    layers = {}
+    for fi in frame_ids:
+        t = fi * 1000.0 / fps
+        frame = Image.new("RGBA", size, desktop)
+        for seg in script["segments"]:
+            key = seg["segment"]
+            if not (seg["start"] <= t < seg["end"]):
+                layers.pop(key, None)
+                continue
+            layer = layers.get(key)
+            if layer is None:
+                layer = layers[key] = _SegmentLayer(seg, size, tip_font)
+            layer.advance(t)
+            frame.alpha_composite(layer.image)
+            layer.draw_sparks(ImageDraw.Draw(frame), t)
+        out = frame.convert("RGB")
+        if scale != 1.0:
+            out = out.resize((max(1, int(size[0] * scale)), max(1, int(size[1] * scale))), Image.BILINEAR)
+        out.save(os.path.join(out_dir, f"frame_{fi:05d}.png"))
+    return len(frame_ids)
+
+def render_headless(sequence, out_dir, sw=1920, sh=1080, fps=30, seed=0, gif=None,
+                    start_at=0, end_at=None, scale=1.0, jobs=None):
+    """
+    不依赖 Tk，把配置序列按固定帧率渲染成 out_dir/frame_00000.png...，可选再合成 GIF。
+    帧按连续区间分给进程池并行渲染/编码；返回帧数。
+    """
+    script = build_render_script(sequence, sw, sh, seed=seed, start_at=start_at, end_at=end_at)
+    n_frames = max(1, int(math.ceil(script["duration"] * fps / 1000.0)))
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = max(1, int(jobs or os.cpu_count() or 1))
+    per = -(-n_frames // jobs)
+    chunks = [list(range(i, min(i + per, n_frames))) for i in range(0, n_frames, per)]
+    if jobs == 1:
+        for ch in chunks:
+            _render_frame_chunk(script, ch, fps, out_dir, scale)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            for f in [ex.submit(_render_frame_chunk, script, ch, fps, out_dir, scale) for ch in chunks]:
+                f.result()
+    if gif:
+        frames = (Image.open(os.path.join(out_dir, f"frame_{i:05d}.png")) for i in range(n_frames))
+        first = next(frames)
+        first.save(gif, save_all=True, append_images=frames, duration=int(round(1000 / fps)), loop=0)
+    return n_frames
+
+
+# ======== 编译好的 show bundle：配置 + 预先算好的几何，播放时直接映射 ========
+# 文件 = 16 字节头（魔数、版本、JSON 长度）+ UTF-8 JSON 目录 + 按 64 字节对齐的小端整数数组。
+# 目录里每段记校验过的完整配置、模式，以及各数组的 [偏移, 类型码, 元素数]：
+#   grid=网格点 int16 (x, y) 交错；窗口段 batches=每批屏幕坐标 int32 交错；
+#   粒子段 strokes=每批 centers int32 交错 / kinds uint8 / path_off int32 / path_xy int32。
+# 随机弹窗段不存几何，播放时照常现场随机。播放端只读 JSON 和 mmap，不导入 Pillow。
+_BUNDLE_MAGIC = b"ZBSHOW\x00\x00"
+_BUNDLE_VERSION = 1
+_BUNDLE_ALIGN = 64
+_BUNDLE_ITEMSIZE = {"h": 2, "i": 4, "B": 1}
+_BUNDLE_DTYPES = {"h": "<i2", "i": "<i4", "B": "u1"}
+
+class _BundleWriter:
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
 
-    run_step(0)
+    def add(self, code, values):
+        """追加一个数组，返回目录项 [相对偏移, 类型码, 元素数]。"""
+        if np is not None and isinstance(values, np.ndarray):
+            raw = np.ascontiguousarray(values, dtype=_BUNDLE_DTYPES[code]).tobytes()
+        else:
+            a = array(code, values)
+            if sys.byteorder == "big":
+                a.byteswap()
+            raw = a.tobytes()
+        pad = -self.size % _BUNDLE_ALIGN
+        if pad:
+            self.chunks.append(b"\0" * pad)
+            self.size += pad
+        desc = [self.size, code, len(raw) // _BUNDLE_ITEMSIZE[code]]
+        self.chunks.append(raw)
+        self.size += len(raw)
+        return desc
+
+def _flat_pairs(points):
+    out = []
+    for x, y in points:
+        out.append(x); out.append(y)
+    return out
+
+def compile_bundle(sequence, path, sw, sh, progress=None):
+    """把一套配置序列编译成 bundle 文件（需要 Pillow），返回 (段数, 文件字节数)。"""
+    writer = _BundleWriter()
+    segments = []
+    for idx, cfg in enumerate(sequence):
+        conf = resolve_config(cfg)
+        plan = plan_segment(conf, sw, sh)
+        seg = {"config": conf.as_dict(), "mode": plan["mode"]}
+        if plan["mode"] != "random":
+            gp = plan["grid_points"]
+            seg["grid"] = writer.add("h", gp._a if np is not None else gp._a.tolist())
+            if plan["mode"] == "particle":
+                seg["strokes"] = []
+                for st in plan["strokes"]:
+                    off, xy = [0], []
+                    for p in st["paths"]:
+                        if p:
+                            xy.extend(p)
+                        off.append(len(xy))
+                    seg["strokes"].append({
+                        "centers": writer.add("i", _flat_pairs(st["centers"])),
+                        "kinds": writer.add("B", st["kinds"]),
+                        "path_off": writer.add("i", off),
+                        "path_xy": writer.add("i", xy),
+                    })
+            else:
+                seg["batches"] = [writer.add("i", _flat_pairs(b)) for b in plan["batches"]]
+        segments.append(seg)
+        if progress:
+            progress(idx, plan)
+    head = json.dumps({"screen": [sw, sh], "font": _font_fingerprint(primary_font_path()),
+                       "created": time.strftime("%Y-%m-%d %H:%M:%S"), "segments": segments},
+                      ensure_ascii=False).encode("utf-8")
+    base = 16 + len(head)
+    base += -base % _BUNDLE_ALIGN
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(struct.pack("<8sII", _BUNDLE_MAGIC, _BUNDLE_VERSION, len(head)))
+            f.write(head)
+            f.write(b"\0" * (base - 16 - len(head)))
+            for chunk in writer.chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        # 写到一半失败（磁盘满、被打断）：不留半截的临时文件
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+    return len(segments), base + writer.size
+
+class ShowBundle:
+    """
+    只读打开 bundle：配置在构造时校验成 SegmentConfig，几何数组按需从 mmap 取视图。
+    plan(idx, sw, sh) 返回与 plan_segment 相同结构的计划（粒子段只还原播放要用的 strokes，batches 为空）。
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if len(mm) < 16:
+            raise ValueError(f"{path} 不是 show bundle")
+        magic, version, head_len = struct.unpack_from("<8sII", mm, 0)
+        if magic != _BUNDLE_MAGIC:
+            raise ValueError(f"{path} 不是 show bundle")
+        if version != _BUNDLE_VERSION:
+            raise ValueError(f"bundle 版本 {version} 与当前程序（{_BUNDLE_VERSION}）不符，请重新 --compile")
+        meta = json.loads(mm[16:16 + head_len].decode("utf-8"))
+        base = 16 + head_len
+        self._base = base + (-base % _BUNDLE_ALIGN)
+        self.screen = tuple(meta["screen"])
+        self.segments = meta["segments"]
+        self.confs = [SegmentConfig.from_dict(seg["config"]) for seg in self.segments]
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _array(self, desc):
+        off, code, count = desc
+        off += self._base
+        if np is not None:
+            return np.frombuffer(self._mm, dtype=_BUNDLE_DTYPES[code], count=count, offset=off)
+        a = array(code)
+        a.frombytes(self._mm[off:off + count * _BUNDLE_ITEMSIZE[code]])
+        if sys.byteorder == "big":
+            a.byteswap()
+        return a
+
+    def _pairs(self, desc):
+        flat = self._array(desc)
+        if np is not None:
+            return list(map(tuple, flat.reshape(-1, 2).tolist()))
+        it = iter(flat)
+        return list(zip(it, it))
+
+    def plan(self, idx, sw, sh):
+        seg, conf = self.segments[idx], self.confs[idx]
+        if seg["mode"] == "random":
+            positions, placement = plan_random_windows(conf, sw, sh)
+            return {"mode": "random", "grid_points": [], "batches": [], "complete": True,
+                    "positions": positions, "placement": placement}
+        plan = {"mode": seg["mode"], "grid_points": PointSet(self._array(seg["grid"])), "batches": [],
+                "complete": True}
+        if seg["mode"] == "particle":
+            plan["strokes"] = []
+            for st in seg["strokes"]:
+                kinds = self._array(st["kinds"]).tolist()
+                off = self._array(st["path_off"]).tolist()
+                xy = self._array(st["path_xy"]).tolist()
+                paths = [None if k == STROKE_START else xy[off[i]:off[i + 1]] for i, k in enumerate(kinds)]
+                plan["strokes"].append({"centers": self._pairs(st["centers"]), "kinds": kinds, "paths": paths})
+        else:
+            plan["batches"] = [self._pairs(b) for b in seg["batches"]]
+        return plan
+
+    def close(self):
+        try:
+            self._mm.close()
+        except BufferError:
+            pass   # 还有数组视图在用，交给垃圾回收
+
+class BundlePipeline:
+    """SegmentPipeline 的 bundle 版：计划直接从映射的文件里取，不栅格化、不开后台线程。"""
+    def __init__(self, bundle, sw, sh):
+        self.bundle = bundle
+        self.confs = bundle.confs
+        self.sw, self.sh = sw, sh
+
+    def prefetch(self, idx):
+        pass
+
+    def poll(self):
+        pass
+
+    def take(self, idx):
+        return self.bundle.plan(idx, self.sw, self.sh)
+
+    def shutdown(self):
+        self.bundle.close()
+
+
+# ======== 基准测试（无需显示器）：热点函数计时 + 与基线对比 ========
+BENCH_SCREENS = {"1080p": (1920, 1080), "1440p": (2560, 1440), "4k": (3840, 2160)}
+BENCH_CELLS = (10, 20, 30, 50)
+BENCH_TEXTS = {
+    "cjk_short": "装逼",
+    "cjk_long": "好好吃饭好好休息早点休息",
+    "cjk_2lines": "天天开心\n万事如意",
+    "emoji": "🔥😎🚀✨",
+    "arabic": "مرحبا بالعالم",
+}
+BENCH_NOISE_FLOOR_MS = 0.05   # 低于这个耗时的用例不判定回退（计时噪声）
+
+def _bench_time(fn, repeat, setup=None):
+    """先跑一遍预热，再跑 repeat 次；返回 (最小毫秒, 中位毫秒, 最后一次结果)。"""
+    if setup: setup()
+    result = fn()
+    samples = []
+    for _ in range(max(1, repeat)):
+        if setup: setup()
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    samples.sort()
+    return samples[0], samples[len(samples) // 2], result
+
+def run_benchmarks(repeat=5, screens=None, cells=None, texts=None, progress=None):
+    """
+    对 text_to_grid_points / 两个不重叠过滤 / build_components / bfs_path / sort_points /
+    split_points_into_lines / 流式栅格化的首行（以及 PointSet 的 to_screen / order_by）按 屏幕 x CELL_SIZE x 文本 计时，返回可直接写成 JSON 的 dict。
+    栅格化每次都清空字号记忆，测的是每段真实要付的冷启动成本。
+    """
+    screens = screens or BENCH_SCREENS
+    cells = cells or BENCH_CELLS
+    texts = texts or BENCH_TEXTS
+    conf = resolve_config({})
+    kw, dh, pad, limit = conf.Kuan_SIZE, conf.DOT_SIZE, conf.MIN_GAP_PX, conf.MAX_WINDOWS
+    results = {}
+
+    def record(name, screen, cell, text_key, n_in, timing):
+        key = f"{name}|{screen}|cell{cell}|{text_key}"
+        results[key] = {"min_ms": round(timing[0], 4), "median_ms": round(timing[1], 4), "n": n_in}
+        if progress:
+            progress(key, results[key])
+
+    for screen, (sw, sh) in screens.items():
+        for cell in cells:
+            grid_w, grid_h = max(1, sw // cell), max(1, sh // cell)
+            for text_key, text in texts.items():
+                timing = _bench_time(lambda: text_to_grid_points(text, grid_w, grid_h, 1, 4), repeat,
+                                     setup=_fit_font_size_cached.cache_clear)
+                pts = timing[2]
+                record("text_to_grid_points", screen, cell, text_key, len(pts), timing)
+                # 字形缓存也清空：第一次见到这些字时的成本
+                record("text_to_grid_points.glyphs_cold", screen, cell, text_key, len(pts),
+                       _bench_time(lambda: text_to_grid_points(text, grid_w, grid_h, 1, 4), repeat,
+                                   setup=lambda: (_fit_font_size_cached.cache_clear(), GLYPH_ATLAS.clear())))
+                if not pts:
+                    continue
+                screen_pts = grid_to_screen(pts, cell, kw, dh)
+                record("filter_points_non_overlap", screen, cell, text_key, len(pts),
+                       _bench_time(lambda: filter_points_non_overlap(screen_pts, kw, dh, pad, limit), repeat))
+                half = len(screen_pts) // 2
+                base = filter_points_non_overlap(screen_pts[:half], kw, dh, pad, limit)
+                record("filter_points_non_overlap_with_base", screen, cell, text_key, len(pts),
+                       _bench_time(lambda: filter_points_non_overlap_with_base(
+                           screen_pts[half:], base, kw, dh, pad, limit), repeat))
+                timing = _bench_time(lambda: build_components(pts), repeat)
+                record("build_components", screen, cell, text_key, len(pts), timing)
+                _, comps, allowed = timing[2]
+                big = max(comps, key=len)
+                record("bfs_path", screen, cell, text_key, len(big),
+                       _bench_time(lambda: bfs_path(big[0], big[-1], allowed), repeat))
+                for order in (0, 2, 4):
+                    record(f"sort_points[{order}]", screen, cell, text_key, len(pts),
+                           _bench_time(lambda: sort_points(pts, order), repeat))
+                bands = text_line_bands(text, grid_w, grid_h, 1, 4)
+                record("split_points_into_lines", screen, cell, text_key, len(pts),
+                       _bench_time(lambda: split_points_into_lines(pts, bands), repeat))
+                # 流式栅格化交出第一行的耗时（播放端最早能开始生成的时刻）
+                timing = _bench_time(lambda: next(iter_text_line_points(text, grid_w, grid_h, 1, 4, cache=False),
+                                                  PointSet()), repeat, setup=_fit_font_size_cached.cache_clear)
+                record("iter_text_line_points.first", screen, cell, text_key, len(timing[2]), timing)
+                ps = PointSet(pts)
+                record("PointSet.to_screen", screen, cell, text_key, len(pts),
+                       _bench_time(lambda: ps.to_screen(cell, kw, dh), repeat))
+                sps = ps.to_screen(cell, kw, dh)
+                for order in (0, 2, 4):
+                    record(f"PointSet.order_by[{order}]", screen, cell, text_key, len(pts),
+                           _bench_time(lambda: sps.order_by(order), repeat))
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "pillow": getattr(Image, "__version__", "?"),
+            "numpy": getattr(np, "__version__", None),
+            "font": primary_font_path(),
+            "repeat": repeat,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+
+def compare_benchmarks(current, baseline, threshold=0.15):
+    """按 min_ms 对比；比基线慢超过 threshold（比例）的用例视为回退，返回 [(key, 基线, 当前, 比值)]。"""
+    regressions = []
+    base = baseline.get("results", {})
+    for key, cur in current.get("results", {}).items():
+        old = base.get(key)
+        if old is None or old["min_ms"] < BENCH_NOISE_FLOOR_MS:
+            continue
+        ratio = cur["min_ms"] / old["min_ms"]
+        if ratio > 1.0 + threshold:
+            regressions.append((key, old["min_ms"], cur["min_ms"], ratio))
+    regressions.sort(key=lambda r: -r[3])
+    return regressions
+
+
+# ========== 主流程：依次播放多段 ==========
+def main(start_at=0, end_at=None, crossfade_ms=0, trace=None, trace_memory=False, bundle=None):
+    global TRACER, LOAD
+    if trace:
+        TRACER = Tracer(memory=trace_memory)
+    LOAD = LoadController() if ADAPTIVE_LOAD else None
+    root = tk.Tk()
+    root.withdraw()
+    sw = root.winfo_screenwidth()
+    sh = root.winfo_screenheight()
+
+    if bundle is not None:
+        # 播放编译好的 bundle：几何直接从映射的文件里取
+        show = ShowBundle(bundle)
+        if show.screen != (sw, sh):
+            print(f"[bundle] 按 {show.screen[0]}x{show.screen[1]} 编译，当前屏幕 {sw}x{sh}，坐标按原样播放")
+        sequence = show.confs
+        pipeline = BundlePipeline(show, sw, sh)
+    else:
+        sequence = get_config_sequence()
+        # 几何准备（栅格化/排序/过滤/连通块）在后台提前做，Tk 线程只负责播放
+        pipeline = SegmentPipeline(sequence, sw, sh)
+    # 窗口模式的小窗跨段复用
+    pool = WindowPool(root)
+    # 窗口模式分给多个 Tk 子进程（子进程起不来时那一片仍用上面的小窗池）
+    shards = WindowShards(root, sw, WINDOW_SHARDS, pool) if WINDOW_SHARDS > 1 else None
+
+    def done():
+        pipeline.shutdown()
+        GLYPH_ATLAS.shutdown()
+        if shards is not None:
+            shards.close()
+            report_stats("window_shards", shards.report(), {"routed": shards.stats["routed"]})
+        report_stats("window_pool", pool.report(), pool.stats)
+        if LOAD is not None and LOAD.adjustments:
+            report_stats("adaptive_load", f"[降载] 共调整 {LOAD.adjustments} 次，结束时第 {LOAD.level} 级",
+                         {"adjustments": LOAD.adjustments, "level": LOAD.level})
+        if TRACER is not None:
+            TRACER.save(trace)
+            print(f"trace 已写入：{trace}（{len(TRACER.events)} 个事件）")
+        try:
+            root.destroy()
+        except Exception:
+            pass
+
+    Timeline(root, sw, sh, sequence, pipeline, pool, start_at=start_at, end_at=end_at,
+             crossfade_ms=crossfade_ms, on_finish=done, shards=shards).start()
     root.mainloop()
 
 
+def warm_point_cache(sw, sh, sequence=None):
+    """把整套配置序列的点阵（连同行带表）预先算好写进磁盘缓存，返回 (段数, 新写入数)。"""
+    sequence = get_config_sequence() if sequence is None else sequence
+    stores_before = point_cache_stats["stores"]
+    n = 0
+    for cfg in sequence:
+        conf = resolve_config(cfg)
+        if _is_random_window_segment(conf):
+            continue
+        grid_w = max(1, sw // conf.CELL_SIZE)
+        grid_h = max(1, sh // conf.CELL_SIZE)
+        for _ in iter_text_line_points(conf.text, grid_w, grid_h, margin_cells=conf.GRID_MARGIN, scale=4):
+            pass   # 走完整个生成器才会写入缓存
+        n += 1
+    return n, point_cache_stats["stores"] - stores_before
+
+def _parse_screen(value):
+    try:
+        w, h = value.lower().split("x")
+        return int(w), int(h)
+    except ValueError:
+        raise argparse.ArgumentTypeError("屏幕尺寸格式应为 宽x高，例如 1920x1080")
+
+def _detect_screen():
+    root = tk.Tk()
+    root.withdraw()
+    try:
+        return root.winfo_screenwidth(), root.winfo_screenheight()
+    finally:
+        root.destroy()
+
+def cli(argv=None):
+    global POINT_CACHE_ENABLED, ADAPTIVE_LOAD, GLYPH_POOL_WORKERS, WINDOW_SHARDS, VERBOSE
+    parser = argparse.ArgumentParser(description="弹窗/粒子文字秀")
+    parser.add_argument("--warm-cache", action="store_true", help="预先生成整套序列的点阵缓存后退出")
+    parser.add_argument("--clear-cache", action="store_true", help="清空点阵磁盘缓存后退出")
+    parser.add_argument("--no-cache", action="store_true", help="本次运行不读写点阵缓存")
+    parser.add_argument("--screen", type=_parse_screen, default=None,
+                        help="预热缓存时使用的屏幕尺寸 宽x高（默认读取当前屏幕）")
+    parser.add_argument("--start", type=int, default=0, help="从第几段开始播放（从 0 数）")
+    parser.add_argument("--end", type=int, default=None, help="播放到第几段为止（含），用于预览一段区间")
+    parser.add_argument("--crossfade", type=int, default=0, metavar="MS",
+                        help="相邻两段重叠的毫秒数（粒子舞台在重叠期内淡出）")
+    parser.add_argument("--render", metavar="DIR", default=None,
+                        help="不开窗口，离线渲染成 DIR/frame_00000.png... 后退出（屏幕尺寸取 --screen，默认 1920x1080）")
+    parser.add_argument("--gif", metavar="PATH", default=None, help="配合 --render：另外合成一张 GIF 动图")
+    parser.add_argument("--fps", type=int, default=30, help="离线渲染帧率")
+    parser.add_argument("--seed", type=int, default=0, help="离线渲染随机种子（同一种子输出完全一致）")
+    parser.add_argument("--render-scale", type=float, default=1.0, help="离线渲染输出缩放比例")
+    parser.add_argument("--jobs", type=int, default=None, help="离线渲染并行进程数（默认 CPU 核数）")
+    parser.add_argument("--no-adaptive", action="store_true",
+                        help="关闭自适应降载（机器卡时也按配置的火花数/批量/速率执行）")
+    parser.add_argument("--trace", metavar="OUT.json", default=None,
+                        help="记录每段各阶段耗时/生成延迟/存活数量，结束时写成 Chrome trace JSON")
+    parser.add_argument("--trace-memory", action="store_true", help="配合 --trace：同时用 tracemalloc 记录每段内存峰值")
+    parser.add_argument("--compare-orders", action="store_true",
+                        help="对每个粒子段试遍 DISPLAY_ORDER，打印连线总长/顶点数/桥接数后退出")
+    parser.add_argument("--bench", metavar="OUT.json", default=None,
+                        help="跑一遍热点函数基准测试，结果写成 JSON 后退出（不需要显示器）")
+    parser.add_argument("--bench-baseline", metavar="BASE.json", default=None,
+                        help="配合 --bench：与基线对比，有回退时退出码为 1")
+    parser.add_argument("--bench-threshold", type=float, default=0.15,
+                        help="慢多少（比例）算回退，默认 0.15")
+    parser.add_argument("--bench-repeat", type=int, default=5, help="每个用例计时次数（取最小值）")
+    parser.add_argument("--compile", metavar="OUT.zbs", default=None,
+                        help="把整套序列编译成 bundle（配置 + 预先算好的点阵/坐标/粒子路径）后退出")
+    parser.add_argument("--play", metavar="SHOW.zbs", default=None,
+                        help="直接播放编译好的 bundle（不栅格化，启动不导入 Pillow）")
+    parser.add_argument("--glyph-workers", type=int, default=None, metavar="N",
+                        help="长文本缺字时用 N 个进程并行栅格化字形（默认不开）")
+    parser.add_argument("--verbose", action="store_true",
+                        help="播放结束时打印火花/小窗池/分片/时间线偏差等统计（--trace 时这些统计也会写进 trace）")
+    parser.add_argument("--window-shards", type=int, default=None, metavar="N",
+                        help="窗口模式把屏幕分成 N 条竖带，各由一个自带 Tk 的子进程弹窗（默认不开）")
+    args = parser.parse_args(argv)
+    if not args.play:
+        require_pillow()
+
+    if args.no_cache:
+        POINT_CACHE_ENABLED = False
+    if args.no_adaptive:
+        ADAPTIVE_LOAD = False
+    if args.glyph_workers is not None:
+        GLYPH_POOL_WORKERS = max(0, args.glyph_workers)
+    if args.verbose:
+        VERBOSE = True
+    if args.window_shards is not None:
+        WINDOW_SHARDS = max(0, args.window_shards)
+    if args.clear_cache:
+        print(f"已清理 {point_cache_clear()} 个缓存文件：{POINT_CACHE_DIR}")
+    if args.warm_cache:
+        sw, sh = args.screen or _detect_screen()
+        n, stored = warm_point_cache(sw, sh)
+        print(f"已预热 {n} 段点阵（新写入 {stored}，屏幕 {sw}x{sh}）：{POINT_CACHE_DIR}")
+    if args.compare_orders:
+        sw, sh = args.screen or (1920, 1080)
+        for idx, cfg in enumerate(get_config_sequence()):
+            if not resolve_config(cfg).PARTICLE:
+                continue
+            stats = compare_display_orders(cfg, sw, sh)
+            best = min(stats, key=lambda k: stats[k]["length_px"])
+            for order, st in stats.items():
+                mark = "  <- 最短" if order == best else ""
+                print(f"[段{idx}] DISPLAY_ORDER={order}：连线 {st['length_px']:.0f} px，"
+                      f"顶点 {st['vertices']}，桥接 {st['bridges']}{mark}")
+        return
+    if args.bench:
+        report = run_benchmarks(repeat=args.bench_repeat,
+                                progress=lambda k, r: print(f"{k:<70} {r['min_ms']:>10.3f} ms  n={r['n']}"))
+        with open(args.bench, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"基准结果已写入：{args.bench}")
+        if args.bench_baseline:
+            with open(args.bench_baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+            regressions = compare_benchmarks(report, baseline, args.bench_threshold)
+            for key, old, new, ratio in regressions:
+                print(f"[回退] {key}: {old:.3f} -> {new:.3f} ms（x{ratio:.2f}）")
+            if regressions:
+                print(f"共 {len(regressions)} 个用例比基线慢超过 {args.bench_threshold:.0%}")
+                sys.exit(1)
+            print("未发现回退")
+        return
+    if args.compile:
+        sw, sh = args.screen or _detect_screen()
+        n, size = compile_bundle(get_config_sequence(), args.compile, sw, sh,
+                                 progress=lambda i, plan: print(f"[编译] 段{i}：{plan['mode']}"))
+        print(f"已编译 {n} 段（{sw}x{sh}，{size / 1024:.0f} KB）：{args.compile}")
+        return
+    if args.render:
+        sw, sh = args.screen or (1920, 1080)
+        n = render_headless(get_config_sequence(), args.render, sw, sh, fps=args.fps, seed=args.seed,
+                            gif=args.gif, start_at=args.start, end_at=args.end,
+                            scale=args.render_scale, jobs=args.jobs)
+        print(f"已渲染 {n} 帧（{sw}x{sh} @ {args.fps}fps）：{args.render}")
+        return
+    if args.clear_cache or args.warm_cache:
+        return
+    main(start_at=args.start, end_at=args.end, crossfade_ms=args.crossfade,
+         trace=args.trace, trace_memory=args.trace_memory, bundle=args.play)
+
 
 if __name__ == "__main__":
-    main()
+    cli()